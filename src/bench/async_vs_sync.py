@@ -0,0 +1,43 @@
+"""Compare the async request path with the old blocking handlers.
+
+Run from ``src``: ``python -m bench.async_vs_sync``. The blocking variant
+reproduces the previous ``def`` handler + sync ``Client`` shape, where every
+broker call holds a Starlette threadpool slot for its whole round trip.
+"""
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+from bench.load import run_load
+from bench.stub_broker import StubServices
+from common.dependencies import get_client
+from main import app
+
+LATENCY = 0.05
+
+
+def blocking_app() -> FastAPI:
+    blocking = FastAPI()
+
+    @blocking.get("/operation_market/last_prices")
+    def get_last_prices(figi: str):
+        time.sleep(LATENCY)
+        return [{"figi": figi, "price": 1.0, "time": "2023-01-01T00:00:00Z"}]
+
+    return blocking
+
+
+async def main():
+    stub = StubServices(latency=LATENCY)
+    app.dependency_overrides[get_client] = lambda: stub
+
+    path = "/operation_market/last_prices?figi=BBG004730N88"
+    for name, target in (("blocking", blocking_app()), ("async", app)):
+        result = await run_load(target, path, requests=2000, concurrency=500)
+        print(f"{name:>8}: {result['rps']:8.1f} rps  p50={result['p50_ms']:.1f}ms  "
+              f"p95={result['p95_ms']:.1f}ms  p99={result['p99_ms']:.1f}ms  errors={result['errors']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
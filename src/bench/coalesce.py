@@ -0,0 +1,39 @@
+"""Count upstream calls for a burst of identical requests with and without single-flight.
+
+Run from ``src``: ``python -m bench.coalesce``. Responses are not cached here,
+so every request that is not coalesced reaches the stub broker.
+"""
+import asyncio
+
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+
+from bench.load import run_load
+from bench.stub_broker import StubServices
+from common import config
+from common.broker import BrokerClient
+from common.dependencies import get_client
+from main import app
+from market_data.hub import MarketDataHubs
+
+PATHS = ("/operation_market/order_book?figi=BBG004730N88&depth=20",
+         "/operation_market/last_prices?figi=BBG004730N88")
+
+
+async def main():
+    FastAPICache.init(InMemoryBackend(), enable=False)
+    app.state.market_hubs = MarketDataHubs()
+    for enabled in (False, True):
+        config.BROKER_COALESCE_ENABLED = enabled
+        stub = StubServices(latency=0.05)
+        client = BrokerClient(stub, "bench-token")
+        app.dependency_overrides[get_client] = lambda: client
+        for path in PATHS:
+            before = stub.market_data.calls
+            result = await run_load(app, path, requests=1000, concurrency=200)
+            print(f"coalesce={enabled!s:>5} {path}: upstream={stub.market_data.calls - before:4d}  "
+                  f"{result['rps']:7.1f} rps  p50={result['p50_ms']:.1f}ms  errors={result['errors']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+"""Compare two ``bench.suite`` result files route by route.
+
+Run from ``src``: ``python -m bench.diff OLD.json NEW.json [--threshold 10]``. Exits with status 1 when any
+route lost more than ``threshold`` percent of throughput or gained as much p95 latency, or started failing.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def change(old: float, new: float) -> float:
+    return (new - old) / old * 100 if old else 0.0
+
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    regressions = list()
+    print(f"{'route':<70} {'rps':>18} {'p95 ms':>18} {'p99 ms':>18}")
+    for name in sorted(set(old["routes"]) | set(new["routes"])):
+        before, after = old["routes"].get(name), new["routes"].get(name)
+        if before is None or after is None:
+            print(f"{name[:70]:<70} {'only in ' + ('new' if before is None else 'old'):>18}")
+            continue
+        rps, p95, p99 = (change(before["rps"], after["rps"]), change(before["p95_ms"], after["p95_ms"]),
+                         change(before["p99_ms"], after["p99_ms"]))
+        flags = list()
+        if rps < -threshold:
+            flags.append("throughput")
+        if p95 > threshold:
+            flags.append("latency")
+        if after["errors"] > before["errors"]:
+            flags.append(f"errors {before['errors']}->{after['errors']}")
+        if flags:
+            regressions.append((name, flags))
+        print(f"{name[:70]:<70} {after['rps']:9.1f} ({rps:+6.1f}%) {after['p95_ms']:9.1f} ({p95:+6.1f}%) "
+              f"{after['p99_ms']:9.1f} ({p99:+6.1f}%) {'  REGRESSION: ' + ', '.join(flags) if flags else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old", type=Path)
+    parser.add_argument("new", type=Path)
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed change, percent")
+    args = parser.parse_args()
+
+    old, new = json.loads(args.old.read_text()), json.loads(args.new.read_text())
+    for key in ("requests", "concurrency", "latency", "cache"):
+        if old["meta"].get(key) != new["meta"].get(key):
+            print(f"warning: runs differ in {key}: {old['meta'].get(key)} vs {new['meta'].get(key)}")
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    regressions = compare(old, new, args.threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def run_load(app, path: str, requests: int = 1000, concurrency: int = 200, headers: dict | None = None,
+                   method: str = "GET", json=None) -> dict:
+    headers = headers or {"token": "bench-token"}
+    latencies = list()
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    # a failing route is counted as an error instead of aborting the whole run
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.request(method, path, headers=headers, json=json)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "method": method,
+        "path": path,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "rps": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
@@ -0,0 +1,115 @@
+"""Quotation conversion and Money arithmetic microbenchmarks.
+
+Run from ``src``: ``python -m bench.money_bench``. Compares the f-string
+parsing the routers used to do with the scalar and NumPy paths in
+``common.quotation`` on order-book sized and operation-list sized inputs,
+then P&L-style sums with the previous dataclass ``Money`` against the
+int-backed ``Money`` and ``MoneyArray``.
+"""
+import math
+import random
+import timeit
+from dataclasses import dataclass
+
+from tinkoff.invest import MoneyValue, Quotation
+
+from common.money import Money, MoneyArray
+from common.quotation import to_float, to_float_array, to_nano_array
+
+
+def fstring(values):
+    return [float(f'{abs(v.units)}.{abs(v.nano)}') for v in values]
+
+
+def scalar(values):
+    return [to_float(v) for v in values]
+
+
+def batch(values):
+    return to_float_array(values)
+
+
+def fixed_point(values):
+    return to_nano_array(values)
+
+
+def batch_sum(values):
+    return to_nano_array(values).sum()
+
+
+def scalar_sum(values):
+    return sum(to_float(v) for v in values)
+
+
+def order_book(depth: int = 50):
+    return [Quotation(units=random.randint(1, 5000), nano=random.randrange(0, 10 ** 9, 10 ** 7)) for _ in range(depth)]
+
+
+def operations(count: int = 100_000):
+    return [MoneyValue(currency="rub", units=random.randint(-10 ** 6, 10 ** 6), nano=0) for _ in range(count)]
+
+
+@dataclass(init=False, order=True)
+class LegacyMoney:
+    # the dataclass Money this module replaced, minus its debug prints
+    units: int
+    nano: int
+    MOD: int = 10 ** 9
+
+    def __init__(self, value, nano: int = None):
+        if nano:
+            self.units = value
+            self.nano = nano
+        else:
+            match value:
+                case int() as value:
+                    self.units = value
+                    self.nano = 0
+                case float() as value:
+                    self.units = int(math.floor(value))
+                    self.nano = int((value - math.floor(value)) * self.MOD)
+                case Quotation() | MoneyValue() as value:
+                    self.units = value.units
+                    self.nano = value.nano
+
+    def __add__(self, other):
+        return LegacyMoney(self.units + other.units + (self.nano + other.nano) // self.MOD,
+                           (self.nano + other.nano) % self.MOD)
+
+
+def legacy_total(values):
+    total = LegacyMoney(0)
+    for value in values:
+        total = total + LegacyMoney(value)
+    return total
+
+
+def money_total(values):
+    return sum(Money(value) for value in values)
+
+
+def money_sum(values):
+    return Money.sum(values)
+
+
+def money_array_sum(values):
+    return MoneyArray.from_values(values).sum()
+
+
+def main():
+    cases = {"order book (50 levels)": (order_book(), 2000), "operations (100k)": (operations(), 5)}
+    for name, (values, number) in cases.items():
+        print(name)
+        for func in (fstring, scalar, batch, fixed_point, scalar_sum, batch_sum):
+            seconds = min(timeit.repeat(lambda: func(values), number=number, repeat=3)) / number
+            print(f"  {func.__name__:>12}: {seconds * 1e6:10.1f} us/call")
+
+    values = operations(50_000)
+    print("money totals (50k operations)")
+    for func in (legacy_total, money_total, money_sum, money_array_sum):
+        seconds = min(timeit.repeat(lambda: func(values), number=3, repeat=3)) / 3
+        print(f"  {func.__name__:>15}: {seconds * 1e3:8.2f} ms/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Burst traffic through the client-side scheduler against a stub that enforces tariff limits.
+
+Run from ``src``: ``python -m bench.rate_limit``. The stub rejects calls over the
+limit with RESOURCE_EXHAUSTED, so a working scheduler shows zero rejections,
+queued reads, and order calls served ahead of the read backlog. The limit
+window is shortened to one second to keep the run short.
+"""
+import asyncio
+import time
+
+from bench.stub_broker import StubServices
+from common.broker import BrokerClient
+from common.rate_limit import RateLimiter
+
+LIMIT = 50
+WINDOW = 1.0
+
+
+async def timed(call) -> float:
+    started = time.perf_counter()
+    await call
+    return time.perf_counter() - started
+
+
+async def main():
+    for name, limiter in (("unlimited", None), ("scheduled", RateLimiter(period=WINDOW))):
+        stub = StubServices(latency=0.005, limit_per_minute=LIMIT, window=WINDOW)
+        client = BrokerClient(stub, "bench-token", limiter)
+
+        started = time.perf_counter()
+        reads = [asyncio.create_task(timed(client.market_data.get_last_prices(figi=["BBG004730N88"])))
+                 for _ in range(4 * LIMIT)]
+        await asyncio.sleep(0)
+        orders = [asyncio.create_task(timed(client.orders.get_orders(account_id="2000000000"))) for _ in range(10)]
+        read_times = await asyncio.gather(*reads, return_exceptions=True)
+        order_times = await asyncio.gather(*orders, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+
+        def avg(values):
+            values = [v for v in values if isinstance(v, float)]
+            return sum(values) / len(values) * 1000 if values else 0.0
+
+        print(f"{name:>9}: {elapsed:5.2f}s  rejected={stub.limits.rejected}  "
+              f"read avg={avg(read_times):.0f}ms  order avg={avg(order_times):.0f}ms")
+        if limiter is not None:
+            print(limiter.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
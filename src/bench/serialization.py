@@ -0,0 +1,65 @@
+"""CPU per request for a 2000-share payload across the response paths.
+
+Run from ``src``: ``python -m bench.serialization``. ``legacy`` is the old shape
+(validated models, ``response_model`` re-validation, stdlib JSON), ``orjson`` only swaps
+the encoder, ``fast`` skips re-validation, ``columns`` is the compact opt-in format.
+"""
+import asyncio
+import time
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from bench.stub_broker import make_share
+from common.compression import CompressionMiddleware
+from common.responses import COLUMNS, fast_response
+from instruments.catalog import share_from_instrument
+from instruments.schemas import AvailableShare
+
+SHARES = 2000
+REQUESTS = 50
+
+
+def bench_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware)
+    instruments = [make_share(i) for i in range(SHARES)]
+
+    @app.get("/legacy", response_model=List[AvailableShare], response_class=JSONResponse)
+    async def legacy():
+        return [AvailableShare(**share_from_instrument(inst).__dict__) for inst in instruments]
+
+    @app.get("/orjson", response_model=List[AvailableShare], response_class=ORJSONResponse)
+    async def orjson_only():
+        return [AvailableShare(**share_from_instrument(inst).__dict__) for inst in instruments]
+
+    @app.get("/fast", response_model=List[AvailableShare])
+    async def fast():
+        return fast_response([share_from_instrument(inst) for inst in instruments])
+
+    @app.get("/columns", response_model=List[AvailableShare])
+    async def columns():
+        return fast_response([share_from_instrument(inst) for inst in instruments], COLUMNS, AvailableShare)
+
+    return app
+
+
+async def main():
+    app = bench_app()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for path in ("/legacy", "/orjson", "/fast", "/columns"):
+            for encoding in ("identity", "gzip", "br"):
+                response = await client.get(path, headers={"accept-encoding": encoding})
+                size = len(response.content) if encoding == "identity" else int(response.headers["content-length"])
+                started = time.process_time()
+                for _ in range(REQUESTS):
+                    await client.get(path, headers={"accept-encoding": encoding})
+                cpu = (time.process_time() - started) / REQUESTS * 1000
+                print(f"{path:>9} {encoding:>8}: {cpu:7.2f} ms CPU/request  {size / 1024:8.1f} KiB "
+                      f"({response.headers.get('content-encoding', 'identity')})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
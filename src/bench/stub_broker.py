@@ -0,0 +1,466 @@
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+from tinkoff.invest import (
+    AccessLevel,
+    Account,
+    BrokerReportResponse,
+    CancelOrderResponse,
+    CancelStopOrderResponse,
+    Currency,
+    CurrencyResponse,
+    CurrenciesResponse,
+    Dividend,
+    GenerateBrokerReportResponse,
+    GetAccountsResponse,
+    GetCandlesResponse,
+    GetDividendsResponse,
+    GetInfoResponse,
+    GetLastPricesResponse,
+    GetLastTradesResponse,
+    GetMarginAttributesResponse,
+    GetOperationsByCursorResponse,
+    GetOrderBookResponse,
+    GetOrdersResponse,
+    GetStopOrdersResponse,
+    GetUserTariffResponse,
+    HistoricCandle,
+    Instrument,
+    InstrumentResponse,
+    LastPrice,
+    MoneyValue,
+    Operation,
+    OperationItem,
+    OperationState,
+    OperationType,
+    OperationsResponse,
+    Order,
+    OrderExecutionReportStatus,
+    OrderState,
+    OrderTrade,
+    OrderTrades,
+    PortfolioResponse,
+    PositionsResponse,
+    PositionsSecurities,
+    PostOrderResponse,
+    PostStopOrderResponse,
+    Quotation,
+    Share,
+    ShareResponse,
+    SharesResponse,
+    StopOrder,
+    StreamLimit,
+    Trade,
+    TradeDirection,
+    TradingDay,
+    TradingSchedule,
+    TradingSchedulesResponse,
+    TradesStreamResponse,
+    UnaryLimit,
+    WithdrawLimitsResponse
+)
+from grpc import StatusCode
+from tinkoff.invest.exceptions import AioRequestError
+
+
+def _quotation(value: float) -> Quotation:
+    units = int(value)
+    return Quotation(units=units, nano=int(round((value - units) * 10 ** 9)))
+
+
+class StubLimits:
+    """Per-service sliding window that rejects calls over the limit like the real broker."""
+
+    def __init__(self, limit_per_minute: int | None = None, window: float = 60.0):
+        self.limit_per_minute = limit_per_minute
+        self.window = window
+        self.calls = dict()
+        self.rejected = 0
+
+    def check(self, service: str):
+        if self.limit_per_minute is None:
+            return
+        now = time.monotonic()
+        calls = self.calls.setdefault(service, deque())
+        while calls and now - calls[0] >= self.window:
+            calls.popleft()
+        if len(calls) >= self.limit_per_minute:
+            self.rejected += 1
+            raise AioRequestError(StatusCode.RESOURCE_EXHAUSTED, "rate limit exceeded", None)
+        calls.append(now)
+
+
+class StubService:
+    grpc_name = ""
+
+    def __init__(self, latency: float, limits: StubLimits | None = None):
+        self.latency = latency
+        self.limits = limits or StubLimits()
+        self.calls = 0
+        self.fail_rate = 0.0
+        self.slow_rate = 0.0
+
+    async def _respond(self, response):
+        self.limits.check(self.grpc_name)
+        self.calls += 1
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise AioRequestError(StatusCode.UNAVAILABLE, "injected failure", None)
+        if self.slow_rate and random.random() < self.slow_rate:
+            # a slow tail call, as seen during market open
+            await asyncio.sleep(self.latency * 10)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return response
+
+
+def make_share(i: int) -> Share:
+    return Share(figi=f"BBG{i:09d}", ticker=f"T{i:04d}", class_code="TQBR", isin=f"RU{i:010d}", lot=10,
+                 currency="rub", name=f"Share {i}", exchange="MOEX", country_of_risk_name="Russia",
+                 sector="it", buy_available_flag=True, sell_available_flag=True, api_trade_available_flag=True,
+                 min_price_increment=Quotation(units=0, nano=10000000), uid=f"uid-{i:08d}")
+
+
+def make_currency(i: int) -> Currency:
+    return Currency(figi=f"CUR{i:09d}", ticker=f"C{i:03d}RUB_TOM", class_code="CETS", lot=1000,
+                    currency="rub", name=f"Currency {i}", exchange="FX", buy_available_flag=True,
+                    sell_available_flag=True, api_trade_available_flag=True, min_price_increment=Quotation(units=0, nano=2500000),
+                    uid=f"cur-uid-{i:08d}")
+
+
+class StubInstrumentsService(StubService):
+    grpc_name = "InstrumentsService"
+
+    def __init__(self, latency: float, limits: StubLimits | None = None, shares: int = 2000, currencies: int = 20):
+        super().__init__(latency, limits)
+        self._shares = [make_share(i) for i in range(shares)]
+        self._currencies = [make_currency(i) for i in range(currencies)]
+
+    async def shares(self, **kwargs):
+        return await self._respond(SharesResponse(instruments=self._shares))
+
+    async def currencies(self, **kwargs):
+        return await self._respond(CurrenciesResponse(instruments=self._currencies))
+
+    async def share_by(self, *, id=None, class_code=None, **kwargs):
+        share = next((s for s in self._shares if s.ticker == id or s.figi == id), self._shares[0])
+        return await self._respond(ShareResponse(instrument=share))
+
+    async def currency_by(self, *, id=None, **kwargs):
+        currency = next((c for c in self._currencies if c.figi == id), self._currencies[0])
+        return await self._respond(CurrencyResponse(instrument=currency))
+
+    async def get_instrument_by(self, *, id=None, **kwargs):
+        share = next((s for s in self._shares if s.figi == id), self._shares[0])
+        return await self._respond(InstrumentResponse(instrument=Instrument(
+            figi=share.figi, ticker=share.ticker, class_code=share.class_code, isin=share.isin, lot=share.lot,
+            currency=share.currency, name=share.name, exchange=share.exchange,
+            country_of_risk_name=share.country_of_risk_name, instrument_type="share", uid=share.uid,
+            buy_available_flag=True, sell_available_flag=True, min_price_increment=share.min_price_increment)))
+
+    async def trading_schedules(self, *, exchange=None, from_=None, to=None, **kwargs):
+        # round-the-clock sessions, so pre-trade checks pass whenever a benchmark runs
+        days = list()
+        day = from_.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < to:
+            days.append(TradingDay(date=day, is_trading_day=True, start_time=day, end_time=day + timedelta(days=1)))
+            day += timedelta(days=1)
+        return await self._respond(TradingSchedulesResponse(exchanges=[TradingSchedule(exchange=exchange, days=days)]))
+
+    async def get_dividends(self, *, figi=None, from_=None, to=None, **kwargs):
+        dividends = [Dividend(dividend_net=_money(10 + i), close_price=_money(200 + i), declared_date=from_ +
+                              timedelta(days=90 * i), dividend_type="Regular", regularity="Quarter",
+                              yield_value=_quotation(2.5)) for i in range(4)]
+        return await self._respond(GetDividendsResponse(dividends=dividends))
+
+
+class StubMarketDataService(StubService):
+    grpc_name = "MarketDataService"
+
+    async def get_last_prices(self, *, figi=None, **kwargs):
+        now = datetime.now(timezone.utc)
+        prices = [LastPrice(figi=f, price=_quotation(random.uniform(1, 5000)), time=now) for f in figi or []]
+        return await self._respond(GetLastPricesResponse(last_prices=prices))
+
+    async def get_order_book(self, *, figi=None, depth=20, **kwargs):
+        bids = [Order(price=_quotation(100 - i * 0.01), quantity=10 + i) for i in range(depth)]
+        asks = [Order(price=_quotation(100.01 + i * 0.01), quantity=10 + i) for i in range(depth)]
+        return await self._respond(GetOrderBookResponse(
+            figi=figi, depth=depth, bids=bids, asks=asks, last_price=_quotation(100), close_price=_quotation(99.5),
+            limit_up=_quotation(110), limit_down=_quotation(90)))
+
+    async def get_last_trades(self, *, figi=None, from_=None, to=None, **kwargs):
+        # roughly one trade every few seconds over the requested window
+        trades = [Trade(figi=figi, direction=TradeDirection.TRADE_DIRECTION_BUY if i % 2 else
+                        TradeDirection.TRADE_DIRECTION_SELL, price=_quotation(100 + (i % 20) * 0.01),
+                        quantity=1 + i % 5, time=to - timedelta(seconds=4 * i)) for i in range(450)]
+        return await self._respond(GetLastTradesResponse(trades=trades))
+
+    async def get_candles(self, *, figi=None, from_=None, to=None, interval=None, **kwargs):
+        from market_data.candles import INTERVALS
+
+        step = next(duration for api_interval, duration, _ in INTERVALS.values() if api_interval == interval)
+        candles, time, price = list(), from_, 100.0
+        while time < to:
+            candles.append(HistoricCandle(open=_quotation(price), high=_quotation(price + 1), low=_quotation(price - 1),
+                                          close=_quotation(price + 0.5), volume=1000, time=time, is_complete=True))
+            time += step
+            price += 0.1
+        return await self._respond(GetCandlesResponse(candles=candles))
+
+
+def make_operation_item(i: int, now: datetime) -> OperationItem:
+    buy = i % 2 == 0
+    price = 100 + i % 50
+    quantity = 1 + i % 10
+    payment = -price * quantity if buy else price * quantity
+    return OperationItem(cursor=str(i), broker_account_id="2000000000", id=f"op-{i}", parent_operation_id="",
+                         name=f"Share {i % 100}", date=now - timedelta(minutes=i),
+                         type=OperationType.OPERATION_TYPE_BUY if buy else OperationType.OPERATION_TYPE_SELL,
+                         description="", state=OperationState.OPERATION_STATE_EXECUTED,
+                         instrument_uid=f"uid-{i % 100:08d}", figi=f"BBG{i % 100:09d}", instrument_type="share",
+                         instrument_kind=None, payment=MoneyValue(currency="rub", units=payment, nano=0),
+                         price=MoneyValue(currency="rub", units=price, nano=0),
+                         commission=MoneyValue(currency="rub", units=-1, nano=0), quantity=quantity,
+                         quantity_rest=0, quantity_done=quantity)
+
+
+class StubOperationsService(StubService):
+    grpc_name = "OperationsService"
+
+    def __init__(self, latency: float, limits: StubLimits | None = None, operations: int = 5000):
+        super().__init__(latency, limits)
+        now = datetime.now(timezone.utc)
+        self._operations = [make_operation_item(i, now) for i in range(operations)]
+
+    async def get_portfolio(self, *, account_id=None, **kwargs):
+        return await self._respond(PortfolioResponse(
+            total_amount_shares=_money(150000.5), total_amount_bonds=_money(0), total_amount_etf=_money(20000),
+            total_amount_currencies=_money(5000.25), total_amount_futures=_money(0),
+            expected_yield=_quotation(3.5), positions=[], account_id=account_id))
+
+    async def get_positions(self, *, account_id=None, **kwargs):
+        return await self._respond(PositionsResponse(
+            money=[_money(5000.25), _money(120.5, "usd")], blocked=[_money(0)],
+            securities=[PositionsSecurities(figi=f"BBG{i:09d}", blocked=0, balance=10 * (i + 1)) for i in range(20)],
+            limits_loading_in_progress=False, futures=[]))
+
+    async def get_withdraw_limits(self, *, account_id=None, **kwargs):
+        return await self._respond(WithdrawLimitsResponse(money=[_money(5000.25), _money(120.5, "usd")],
+                                                          blocked=[], blocked_guarantee=[]))
+
+    async def get_operations(self, *, account_id=None, from_=None, to=None, **kwargs):
+        operations = [Operation(id=item.id, parent_operation_id="", currency=item.payment.currency,
+                                payment=item.payment, price=item.price, state=item.state,
+                                quantity=item.quantity, quantity_rest=0, figi=item.figi,
+                                instrument_type=item.instrument_type, date=item.date, type=item.name,
+                                operation_type=item.type, trades=[])
+                      for item in self._operations]
+        return await self._respond(OperationsResponse(operations=operations))
+
+    async def get_broker_report(self, *, generate_broker_report_request=None, **kwargs):
+        return await self._respond(BrokerReportResponse(
+            generate_broker_report_response=GenerateBrokerReportResponse(task_id="report-task-1")))
+
+    async def get_operations_by_cursor(self, request):
+        start = int(request.cursor or 0)
+        end = start + (request.limit or 1000)
+        items = self._operations[start:end]
+        has_next = end < len(self._operations)
+        return await self._respond(GetOperationsByCursorResponse(has_next=has_next,
+                                                                 next_cursor=str(end) if has_next else "",
+                                                                 items=items))
+
+
+class StubOrdersService(StubService):
+    grpc_name = "OrdersService"
+
+    def __init__(self, latency: float, limits: StubLimits | None = None):
+        super().__init__(latency, limits)
+        self.posted = dict()
+        self.active = dict()
+        self.done = dict()
+        self.trades = 0
+        self.streams = set()
+
+    async def post_order(self, *, figi=None, quantity=1, price=None, direction=None, account_id=None,
+                         order_type=None, order_id=None, **kwargs):
+        # the broker deduplicates by order_id, so a repeated request returns the first order
+        response = self.posted.get(order_id)
+        if response is None:
+            broker_id = f"broker-{len(self.posted)}"
+            status = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW
+            response = PostOrderResponse(order_id=broker_id, execution_report_status=status,
+                                         lots_requested=quantity, lots_executed=0, figi=figi, direction=direction,
+                                         order_type=order_type, initial_order_price=_money(100),
+                                         executed_order_price=_money(0), total_order_amount=_money(100 * quantity),
+                                         initial_commission=_money(0.05), executed_commission=_money(0),
+                                         initial_security_price=_money(100), message="", aci_value=_money(0),
+                                         initial_order_price_pt=_quotation(0))
+            self.posted[order_id] = response
+            self.active[broker_id] = OrderState(
+                order_id=broker_id, execution_report_status=status, lots_requested=quantity, lots_executed=0,
+                initial_order_price=_money(100), executed_order_price=_money(0),
+                total_order_amount=_money(100 * quantity), average_position_price=_money(0),
+                initial_commission=_money(0.05), executed_commission=_money(0), figi=figi, direction=direction,
+                initial_security_price=_money(100), stages=[], service_commission=_money(0), currency="rub",
+                order_type=order_type, order_date=datetime.now(timezone.utc))
+        return await self._respond(response)
+
+    async def get_order_state(self, *, account_id=None, order_id=None, **kwargs):
+        state = self.active.get(order_id) or self.done.get(order_id)
+        if state is None:
+            await self._respond(None)
+            raise AioRequestError(StatusCode.NOT_FOUND, "order not found", None)
+        return await self._respond(state)
+
+    async def get_orders(self, *, account_id=None, **kwargs):
+        return await self._respond(GetOrdersResponse(orders=list(self.active.values())))
+
+    async def cancel_order(self, *, account_id=None, order_id=None, **kwargs):
+        if self.active.pop(order_id, None) is None:
+            await self._respond(None)
+            raise AioRequestError(StatusCode.NOT_FOUND, "order not found", None)
+        return await self._respond(CancelOrderResponse(time=datetime.now(timezone.utc)))
+
+    def fill(self, order_id: str, quantity: int, price: float = 100.0):
+        """Executes ``quantity`` lots of an active order and reports the trade on the trades stream."""
+        state = self.active[order_id]
+        state.lots_executed = min(state.lots_requested, state.lots_executed + quantity)
+        filled = state.lots_executed == state.lots_requested
+        state.execution_report_status = (OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL if filled else
+                                         OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL)
+        if filled:
+            self.done[order_id] = self.active.pop(order_id)
+        self.trades += 1
+        trade = OrderTrade(date_time=datetime.now(timezone.utc), price=_quotation(price), quantity=quantity,
+                           trade_id=f"trade-{self.trades}")
+        for queue in self.streams:
+            queue.put_nowait(TradesStreamResponse(order_trades=OrderTrades(
+                order_id=order_id, created_at=datetime.now(timezone.utc), direction=state.direction,
+                figi=state.figi, trades=[trade], account_id="")))
+
+
+class StubOrdersStreamService:
+    def __init__(self, orders: StubOrdersService):
+        self.orders = orders
+
+    async def trades_stream(self, accounts=None):
+        queue = asyncio.Queue()
+        self.orders.streams.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.orders.streams.discard(queue)
+
+
+class StubStopOrdersService(StubService):
+    grpc_name = "StopOrdersService"
+
+    def __init__(self, latency: float, limits: StubLimits | None = None):
+        super().__init__(latency, limits)
+        self.active = dict()
+
+    async def post_stop_order(self, *, figi=None, quantity=1, direction=None, account_id=None, **kwargs):
+        stop_order_id = f"stop-{len(self.active)}-{random.getrandbits(32):08x}"
+        self.active[stop_order_id] = StopOrder(stop_order_id=stop_order_id, lots_requested=quantity, figi=figi,
+                                               direction=direction, currency="rub",
+                                               create_date=datetime.now(timezone.utc), price=_money(100),
+                                               stop_price=_money(95))
+        return await self._respond(PostStopOrderResponse(stop_order_id=stop_order_id))
+
+    async def get_stop_orders(self, *, account_id=None, **kwargs):
+        return await self._respond(GetStopOrdersResponse(stop_orders=list(self.active.values())))
+
+    async def cancel_stop_order(self, *, account_id=None, stop_order_id=None, **kwargs):
+        if self.active.pop(stop_order_id, None) is None:
+            await self._respond(None)
+            raise AioRequestError(StatusCode.NOT_FOUND, "stop order not found", None)
+        return await self._respond(CancelStopOrderResponse(time=datetime.now(timezone.utc)))
+
+
+def _money(value: float, currency: str = "rub") -> MoneyValue:
+    quotation = _quotation(value)
+    return MoneyValue(currency=currency, units=quotation.units, nano=quotation.nano)
+
+
+STUB_METHODS = {
+    "InstrumentsService": ("Shares", "Currencies", "ShareBy", "CurrencyBy", "GetInstrumentBy", "TradingSchedules",
+                           "GetDividends"),
+    "MarketDataService": ("GetLastPrices", "GetOrderBook", "GetLastTrades", "GetCandles"),
+    "OperationsService": ("GetOperations", "GetPortfolio", "GetPositions", "GetWithdrawLimits", "GetBrokerReport",
+                          "GetOperationsByCursor"),
+    "OrdersService": ("PostOrder", "GetOrderState", "GetOrders", "CancelOrder"),
+    "StopOrdersService": ("PostStopOrder", "GetStopOrders", "CancelStopOrder"),
+    "UsersService": ("GetAccounts", "GetInfo", "GetUserTariff", "GetMarginAttributes"),
+}
+
+
+class StubUsersService(StubService):
+    grpc_name = "UsersService"
+
+    def __init__(self, latency: float, limits: StubLimits | None = None, accounts: int = 8):
+        super().__init__(latency, limits)
+        self._accounts = [Account(id=f"20000000{i:02d}", name=f"Account {i}",
+                                  access_level=AccessLevel.ACCOUNT_ACCESS_LEVEL_FULL_ACCESS,
+                                  opened_date=datetime(2020, 1, 1, tzinfo=timezone.utc)) for i in range(accounts)]
+
+    async def get_accounts(self, **kwargs):
+        return await self._respond(GetAccountsResponse(accounts=self._accounts))
+
+    async def get_info(self, **kwargs):
+        return await self._respond(GetInfoResponse(prem_status=False, qual_status=False, qualified_for_work_with=[],
+                                                   tariff="investor"))
+
+    async def get_margin_attributes(self, *, account_id=None, **kwargs):
+        return await self._respond(GetMarginAttributesResponse(
+            liquid_portfolio=_money(175000.75), starting_margin=_money(40000), minimal_margin=_money(20000),
+            funds_sufficiency_level=_quotation(4.37), amount_of_missing_funds=_money(-135000.75),
+            corrected_margin=_money(40000)))
+
+    async def get_user_tariff(self, **kwargs):
+        limit = self.limits.limit_per_minute or 1000
+        prefix = "tinkoff.public.invest.api.contract.v1"
+        return await self._respond(GetUserTariffResponse(
+            unary_limits=[UnaryLimit(limit_per_minute=limit, methods=[f"{prefix}.{service}/{method}" for method in methods])
+                          for service, methods in STUB_METHODS.items()],
+            stream_limits=[StreamLimit(limit=2, streams=[f"{prefix}.MarketDataStreamService/MarketDataStream"])]))
+
+
+class StubServices:
+    """In-process stand-in for ``AsyncServices`` with a fixed per-call latency.
+
+    Payload sizes follow a typical account: 2000 shares, 5000 operations, a few hundred trades per half hour.
+    """
+
+    def __init__(self, latency: float = 0.05, limit_per_minute: int | None = None, window: float = 60.0,
+                 fail_rate: float = 0.0, slow_rate: float = 0.0):
+        self.limits = StubLimits(limit_per_minute, window)
+        self.instruments = StubInstrumentsService(latency, self.limits)
+        self.market_data = StubMarketDataService(latency, self.limits)
+        self.operations = StubOperationsService(latency, self.limits)
+        self.orders = StubOrdersService(latency, self.limits)
+        self.stop_orders = StubStopOrdersService(latency, self.limits)
+        self.orders_stream = StubOrdersStreamService(self.orders)
+        self.users = StubUsersService(latency, self.limits)
+        for service in (self.instruments, self.market_data, self.operations, self.orders, self.stop_orders,
+                        self.users):
+            service.fail_rate, service.slow_rate = fail_rate, slow_rate
+
+
+class StubClientPool:
+    """Hands out one client for every token, for components that take the app's client pool."""
+
+    def __init__(self, client):
+        self.client = client
+
+    @asynccontextmanager
+    async def lease(self, token: str):
+        yield self.client
+
+    async def close(self):
+        pass
@@ -0,0 +1,150 @@
+"""Per-route load benchmark against the in-process stub broker.
+
+Run from ``src``: ``python -m bench.suite [--requests N] [--concurrency N] [--latency S] [--only PREFIX]``.
+Results go to ``bench/results/<commit>.json``; compare two runs with ``python -m bench.diff OLD NEW``.
+Response caching is disabled unless ``--cache`` is given, so every request exercises the broker path.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./bench.db")
+
+from fastapi_cache import FastAPICache  # noqa: E402
+
+from bench.load import run_load  # noqa: E402
+from bench.stub_broker import StubClientPool, StubServices  # noqa: E402
+from common import config  # noqa: E402
+from common.broker import BrokerClient  # noqa: E402
+from common.dependencies import get_client  # noqa: E402
+from main import app  # noqa: E402
+
+RESULTS = Path(__file__).parent / "results"
+ACCOUNT = "2000000000"
+FIGI = "BBG000000042"
+
+
+@dataclass
+class Route:
+    router: str
+    path: str
+    method: str = "GET"
+    json: dict | None = None
+    # share of the requested load; multi-megabyte responses run fewer requests to keep the suite short
+    scale: float = 1.0
+
+    @property
+    def name(self) -> str:
+        return f"{self.method} {self.path}"
+
+
+ROUTES = [
+    Route("instruments", "/user_instruments/trading_schedules?exch=MOEX"),
+    Route("instruments", "/user_instruments/currencies"),
+    Route("instruments", "/user_instruments/currency_by?id=CUR000000003"),
+    Route("instruments", "/user_instruments/share_by?ticker=T0042&class_code=TQBR"),
+    Route("instruments", "/user_instruments/shares"),
+    Route("instruments", f"/user_instruments/instrument_by?figi={FIGI}"),
+    Route("instruments", f"/user_instruments/dividends?figi={FIGI}"),
+    Route("instruments", "/user_instruments/accounts"),
+    Route("instruments", "/user_instruments/margin_attributes"),
+    Route("instruments", "/user_instruments/user_tariff"),
+    Route("instruments", "/user_instruments/user_info"),
+    Route("operations", "/operation_market/operations", scale=0.05),
+    Route("operations", "/operation_market/operations/cursor?limit=1000", scale=0.2),
+    Route("operations", "/operation_market/operations/stream", scale=0.05),
+    Route("operations", "/operation_market/ledger/status"),
+    Route("operations", "/operation_market/ledger/operations", scale=0.2),
+    Route("operations", "/operation_market/ledger/turnover", scale=0.2),
+    Route("operations", "/operation_market/ledger/commissions"),
+    Route("operations", "/operation_market/portfolio"),
+    Route("operations", "/operation_market/accounts_overview", scale=0.2),
+    Route("operations", "/operation_market/positions"),
+    Route("operations", "/operation_market/broker_report"),
+    Route("operations", "/operation_market/withdraw_limits"),
+    Route("operations", f"/operation_market/candles?figi={FIGI}&interval=hour&from=2023-01-01T00:00:00Z"
+                        f"&to=2023-03-01T00:00:00Z"),
+    Route("operations", f"/operation_market/last_prices?figi={FIGI}"),
+    Route("operations", "/operation_market/last_prices/batch?" + "&".join(f"figi=BBG{i:09d}" for i in range(300))),
+    Route("operations", "/operation_market/last_prices/batch", "POST",
+          {"figi": [f"BBG{i:09d}" for i in range(2000)]}, scale=0.2),
+    Route("operations", f"/operation_market/close_prices?figi={FIGI}"),
+    Route("operations", f"/operation_market/order_book?figi={FIGI}&depth=20"),
+    Route("orders", "/orders/post_order", "POST",
+          {"figi": FIGI, "quantity": 1, "price": 100.5, "direction": "Buy", "account_id": ACCOUNT,
+           "order_type": "Limit", "order_id": "bench-order"}),
+    Route("orders", "/orders/bulk/post_orders", "POST",
+          {"batch_id": "bench-batch", "orders": [{"figi": f"BBG{i:09d}", "quantity": 1, "price": 100.5,
+                                                  "direction": "Buy", "order_type": "Limit"} for i in range(20)]},
+          scale=0.2),
+    Route("orders", "/orders/order_state?order_id=broker-0"),
+    Route("orders", "/orders/get"),
+    Route("orders", "/orders/get_stop_order"),
+]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run_suite(requests: int, concurrency: int, latency: float, only: str | None, cache: bool) -> dict:
+    stub = StubServices(latency=latency)
+    client = BrokerClient(stub, "bench-token")
+    app.dependency_overrides[get_client] = lambda: client
+    headers = {"token": "bench-token", "account-id": ACCOUNT}
+
+    results = dict()
+    async with app.router.lifespan_context(app):
+        FastAPICache.init(FastAPICache.get_backend(), prefix=config.CACHE_PREFIX, enable=cache)
+        app.state.order_trackers.client_pool = StubClientPool(client)
+        # the ledger routes read a synced local copy; sync it up front so they measure queries, not the sync
+        await app.state.operations_ledger.sync(client, ACCOUNT)
+        for route in ROUTES:
+            if only and not route.path.startswith(only) and route.router != only:
+                continue
+            count = max(int(requests * route.scale), 10)
+            result = await run_load(app, route.path, requests=count, concurrency=min(concurrency, count),
+                                    headers=headers, method=route.method, json=route.json)
+            result["router"] = route.router
+            results[route.name] = result
+            print(f"{route.name[:70]:<70} {result['rps']:8.1f} rps  p50={result['p50_ms']:7.1f}ms  "
+                  f"p95={result['p95_ms']:7.1f}ms  p99={result['p99_ms']:7.1f}ms  errors={result['errors']}")
+    app.dependency_overrides.pop(get_client, None)
+
+    return {
+        "meta": {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "python": platform.python_version(), "requests": requests, "concurrency": concurrency,
+                 "latency": latency, "cache": cache},
+        "routes": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="stub broker latency per call, seconds")
+    parser.add_argument("--only", help="router name or path prefix to run")
+    parser.add_argument("--cache", action="store_true", help="keep response caching enabled")
+    parser.add_argument("--output", type=Path, help="defaults to bench/results/<commit>.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_suite(args.requests, args.concurrency, args.latency, args.only, args.cache))
+    output = args.output or RESULTS / f"{report['meta']['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
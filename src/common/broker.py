@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+from common.call_policy import (
+    HEDGED_METHODS,
+    BrokerUnavailable,
+    StaleCache,
+    breaker_for,
+    can_retry,
+    hedged,
+    is_breaker_failure,
+    status_code,
+    with_retries
+)
+from common.metrics import BROKER_ERRORS, BROKER_IN_FLIGHT, BROKER_LATENCY, RATE_LIMIT_WAIT
+from common.rate_limit import PRIORITY_DEFAULT, PRIORITY_ORDERS, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# AsyncServices attribute -> gRPC service name used in tariff limits
+SERVICES = {
+    "instruments": "InstrumentsService",
+    "market_data": "MarketDataService",
+    "operations": "OperationsService",
+    "orders": "OrdersService",
+    "stop_orders": "StopOrdersService",
+    "users": "UsersService",
+    "sandbox": "SandboxService",
+}
+
+PRIORITIES = {"orders": PRIORITY_ORDERS, "stop_orders": PRIORITY_ORDERS}
+
+# services whose non-"get_" methods change state and must never be shared between callers
+MUTATING_SERVICES = ("orders", "stop_orders", "sandbox")
+
+coalesced = Counter()
+
+_method_names = dict()
+
+
+def is_coalescable(service: str, method: str) -> bool:
+    return service not in MUTATING_SERVICES or method.startswith("get_")
+
+
+def _call_key(grpc_name: str, args: tuple, kwargs: dict) -> str:
+    return f"{grpc_name}|{args!r}|{sorted(kwargs.items())!r}"
+
+
+def _consume(task: asyncio.Task):
+    # every waiter may have gone away; read the outcome so it is not reported as never retrieved
+    if not task.cancelled():
+        task.exception()
+
+
+def grpc_method(service: str, method: str) -> str:
+    # ("market_data", "get_last_prices") -> "MarketDataService/GetLastPrices"
+    key = (service, method)
+    name = _method_names.get(key)
+    if name is None:
+        name = _method_names[key] = f'{SERVICES[service]}/{"".join(p.capitalize() for p in method.split("_"))}'
+    return name
+
+
+class ServiceProxy:
+    def __init__(self, broker: "BrokerClient", name: str, service):
+        self._broker = broker
+        self._name = name
+        self._service = service
+        self._methods = dict()
+
+    def __getattr__(self, method: str):
+        bound = self._methods.get(method)
+        if bound is None:
+            target = getattr(self._service, method)
+            if not callable(target) or method.startswith("_"):
+                return target
+            bound = self._methods[method] = self._broker.bind(self._name, method, target)
+        return bound
+
+
+class BrokerClient:
+    """Wraps ``AsyncServices`` so every unary call goes through the client-side scheduler.
+
+    Concurrent identical read calls share one in-flight request. Calls are retried when that is safe, guarded by
+    a per-method circuit breaker, and reads fall back to their last good response while the broker is failing.
+    Streaming services are passed through untouched.
+    """
+
+    def __init__(self, services: AsyncServices, token: str, limiter: RateLimiter | None = None):
+        self.services = services
+        self.token = token
+        self.limiter = limiter
+        self._proxies = dict()
+        self._in_flight = dict()
+        self._stale = StaleCache()
+
+    def __getattr__(self, name: str):
+        proxy = self._proxies.get(name)
+        if proxy is None:
+            service = getattr(self.services, name)
+            if name not in SERVICES:
+                return service
+            proxy = self._proxies[name] = ServiceProxy(self, name, service)
+        return proxy
+
+    def bind(self, service: str, method: str, target):
+        grpc_name = grpc_method(service, method)
+        priority = PRIORITIES.get(service, PRIORITY_DEFAULT)
+        read_only = is_coalescable(service, method)
+        breaker = breaker_for(grpc_name)
+        latency, in_flight, wait = (BROKER_LATENCY.labels(grpc_name), BROKER_IN_FLIGHT.labels(grpc_name),
+                                    RATE_LIMIT_WAIT.labels(grpc_name))
+
+        async def scheduled(*args, **kwargs):
+            if self.limiter is not None:
+                await self.limiter.seed(self.token, self.services.users)
+                wait.observe(await self.limiter.acquire(self.token, grpc_name, priority))
+            started = time.perf_counter()
+            in_flight.inc()
+            try:
+                return await target(*args, **kwargs)
+            except Exception as e:
+                code = status_code(e)
+                BROKER_ERRORS.labels(grpc_name, code.name if code is not None else type(e).__name__).inc()
+                raise
+            finally:
+                in_flight.dec()
+                latency.observe(time.perf_counter() - started)
+
+        async def guarded(args, kwargs):
+            breaker.before_call()
+
+            async def call():
+                if grpc_name in HEDGED_METHODS:
+                    return await hedged(lambda: scheduled(*args, **kwargs))
+                return await scheduled(*args, **kwargs)
+
+            try:
+                if can_retry(method, kwargs, read_only):
+                    result = await with_retries(call)
+                else:
+                    result = await call()
+            except Exception as e:
+                breaker.on_failure(e)
+                raise
+            except BaseException:
+                breaker.on_cancel()
+                raise
+            breaker.on_success()
+            return result
+
+        if not read_only:
+            async def write(*args, **kwargs):
+                return await guarded(args, kwargs)
+
+            return write
+
+        async def read(key: str, args, kwargs):
+            try:
+                result = await guarded(args, kwargs)
+            except Exception as e:
+                if not isinstance(e, BrokerUnavailable) and not is_breaker_failure(e):
+                    raise
+                stale = self._stale.get(key)
+                if stale is None:
+                    raise
+                logger.warning("Serving a stale %s response: %s", grpc_name, e)
+                return stale
+            self._stale.put(key, result)
+            return result
+
+        async def single_flight(*args, **kwargs):
+            key = _call_key(grpc_name, args, kwargs)
+            if not config.BROKER_COALESCE_ENABLED:
+                return await read(key, args, kwargs)
+            task = self._in_flight.get(key)
+            if task is None:
+                task = self._in_flight[key] = asyncio.ensure_future(read(key, args, kwargs))
+                task.add_done_callback(lambda done: self._in_flight.pop(key, None))
+                task.add_done_callback(_consume)
+            else:
+                coalesced[grpc_name] += 1
+            # shielded so one disconnecting caller does not cancel the call for the others
+            return await asyncio.shield(task)
+
+        return single_flight
@@ -0,0 +1,97 @@
+import hashlib
+import logging
+from collections import Counter
+from typing import Optional, Tuple
+
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.decorator import cache
+from fastapi_cache.types import Backend
+from starlette.requests import Request
+
+from common import config
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(value: str | None) -> str:
+    if not value:
+        return "-"
+    return hashlib.sha256(value.encode()).hexdigest()[:16]
+
+
+def scoped_key_builder(func, namespace: str = "", *, request: Optional[Request] = None, response=None,
+                       args=(), kwargs=None) -> str:
+    # the token and account are hashed into the key so users never share entries
+    if request is None:
+        scope, query = "-", _digest(repr(sorted((kwargs or {}).items(), key=lambda item: item[0])))
+    else:
+        scope = _digest(f'{request.headers.get("token")}|{request.headers.get("account-id")}')
+        query = _digest(str(sorted(request.query_params.multi_items())))
+    return f"{namespace}:{func.__name__}:{scope}:{query}"
+
+
+def cached(policy: str):
+    return cache(expire=config.CACHE_TTL[policy], namespace=policy, key_builder=scoped_key_builder)
+
+
+class CountingBackend(Backend):
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.hits = Counter()
+        self.misses = Counter()
+
+    @staticmethod
+    def _policy(key: str) -> str:
+        # keys look like "<prefix>:<policy>:<func>:<scope>:<query>"
+        parts = key.split(":")
+        return parts[1] if len(parts) > 1 else key
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        ttl, value = await self.backend.get_with_ttl(key)
+        if value is None:
+            self.misses[self._policy(key)] += 1
+        else:
+            self.hits[self._policy(key)] += 1
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.backend.get(key)
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        await self.backend.set(key, value, expire)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        return await self.backend.clear(namespace, key)
+
+    def stats(self) -> dict:
+        policies = sorted(set(self.hits) | set(self.misses))
+        return {policy: {"hits": self.hits[policy], "misses": self.misses[policy]} for policy in policies}
+
+
+async def connect_redis():
+    if not config.REDIS_URL:
+        return None
+    try:
+        from redis import asyncio as aioredis
+
+        redis = aioredis.from_url(config.REDIS_URL)
+        await redis.ping()
+        return redis
+    except Exception:
+        logger.exception("Redis at %s is unavailable, falling back to per-process state", config.REDIS_URL)
+        return None
+
+
+def create_backend(redis=None) -> Backend:
+    if redis is not None:
+        from fastapi_cache.backends.redis import RedisBackend
+
+        return RedisBackend(redis)
+    return InMemoryBackend()
+
+
+async def init_cache(redis=None) -> CountingBackend:
+    backend = CountingBackend(create_backend(redis))
+    FastAPICache.init(backend, prefix=config.CACHE_PREFIX)
+    return backend
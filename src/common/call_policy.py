@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+import grpc
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from common import config
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED,
+                   grpc.StatusCode.RESOURCE_EXHAUSTED)
+# codes that say the broker itself is degraded; RESOURCE_EXHAUSTED is left out as it is one token's quota
+BREAKER_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED, grpc.StatusCode.INTERNAL,
+                 grpc.StatusCode.UNKNOWN)
+
+HTTP_STATUSES = {
+    grpc.StatusCode.INVALID_ARGUMENT: 400,
+    grpc.StatusCode.UNAUTHENTICATED: 401,
+    grpc.StatusCode.PERMISSION_DENIED: 403,
+    grpc.StatusCode.NOT_FOUND: 404,
+    grpc.StatusCode.FAILED_PRECONDITION: 409,
+    grpc.StatusCode.RESOURCE_EXHAUSTED: 429,
+    grpc.StatusCode.UNAVAILABLE: 503,
+    grpc.StatusCode.DEADLINE_EXCEEDED: 504,
+}
+
+# mutating methods that are safe to repeat because the broker deduplicates them by this argument
+IDEMPOTENCY_KEYS = {"post_order": "order_id", "replace_order": "idempotency_key"}
+
+HEDGED_METHODS = ("MarketDataService/GetOrderBook", "MarketDataService/GetLastPrices")
+
+
+class BrokerUnavailable(Exception):
+    def __init__(self, method: str, retry_after: float):
+        super().__init__(f"{method} is failing, calls are suspended for {retry_after:.0f}s")
+        self.method = method
+        self.retry_after = retry_after
+
+
+def status_code(error: BaseException) -> grpc.StatusCode | None:
+    # the SDK wraps grpc errors into AioRequestError with a ``code`` attribute; raw grpc errors expose ``code()``
+    code = getattr(error, "code", None)
+    if callable(code):
+        code = code()
+    return code if isinstance(code, grpc.StatusCode) else None
+
+
+def http_status(error: BaseException) -> int:
+    return HTTP_STATUSES.get(status_code(error), 502)
+
+
+def is_retryable(error: BaseException) -> bool:
+    return status_code(error) in RETRYABLE_CODES
+
+
+def is_breaker_failure(error: BaseException) -> bool:
+    return status_code(error) in BREAKER_CODES
+
+
+def can_retry(method: str, kwargs: dict, read_only: bool) -> bool:
+    if read_only:
+        return True
+    key = IDEMPOTENCY_KEYS.get(method)
+    return key is not None and bool(kwargs.get(key))
+
+
+async def with_retries(call, attempts: int = config.BROKER_RETRY_ATTEMPTS):
+    retrying = AsyncRetrying(stop=stop_after_attempt(attempts),
+                             wait=wait_random_exponential(multiplier=config.BROKER_RETRY_BACKOFF,
+                                                          max=config.BROKER_RETRY_BACKOFF_MAX),
+                             retry=retry_if_exception(is_retryable), reraise=True)
+    async for attempt in retrying:
+        with attempt:
+            return await call()
+
+
+async def hedged(call, delay: float = config.BROKER_HEDGE_DELAY):
+    """Start a second identical call if the first is slower than ``delay``; the first to succeed wins."""
+    first = asyncio.ensure_future(call())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    pending = {first, asyncio.ensure_future(call())}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: int = config.BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = config.BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self._probing):
+            raise BrokerUnavailable(self.name, max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0))
+        if state == "half-open":
+            # let exactly one call through to find out whether the broker has recovered
+            self._probing = True
+
+    def on_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def on_failure(self, error: BaseException):
+        if not is_breaker_failure(error):
+            self._probing = False
+            return
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            if self.opened_at is None or self._probing:
+                logger.warning("Circuit for %s opened after %d failures", self.name, self.failures)
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def on_cancel(self):
+        # a cancelled call says nothing about the broker, so the next call probes instead
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
+
+
+breakers: Dict[str, CircuitBreaker] = dict()
+
+
+def breaker_for(method: str) -> CircuitBreaker:
+    breaker = breakers.get(method)
+    if breaker is None:
+        breaker = breakers[method] = CircuitBreaker(method)
+    return breaker
+
+
+class StaleCache:
+    """Last good response per call, served when the broker is failing."""
+
+    def __init__(self, max_size: int = config.BROKER_STALE_CACHE_SIZE, max_age: float = config.BROKER_STALE_MAX_AGE):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self.served = 0
+
+    def put(self, key: str, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.max_age:
+            return None
+        self.served += 1
+        return entry[1]
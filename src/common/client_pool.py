@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import grpc
+from tinkoff.invest import AsyncClient
+
+from common import config
+from common.broker import BrokerClient
+from common.rate_limit import RateLimiter
+
+
+class PooledClient:
+    def __init__(self, token: str, limiter: RateLimiter | None = None):
+        self.token = token
+        self.limiter = limiter
+        self.client = AsyncClient(token, target=config.TINKOFF_TARGET, app_name=config.APP_NAME)
+        self.services: BrokerClient | None = None
+        self.last_used = time.monotonic()
+        # requests and streams currently holding the client; it is only closed once they are done
+        self.leases = 0
+        self.retired = False
+
+    async def open(self) -> BrokerClient:
+        self.services = BrokerClient(await self.client.__aenter__(), self.token, self.limiter)
+        return self.services
+
+    def is_healthy(self) -> bool:
+        channel = getattr(self.client, "_channel", None)
+        if channel is None:
+            return True
+        state = channel.get_state(try_to_connect=False)
+        return state not in (grpc.ChannelConnectivity.TRANSIENT_FAILURE, grpc.ChannelConnectivity.SHUTDOWN)
+
+    async def close(self):
+        await self.client.__aexit__(None, None, None)
+
+
+class ClientPool:
+    def __init__(self, max_size: int = config.CLIENT_POOL_MAX_SIZE,
+                 idle_timeout: float = config.CLIENT_POOL_IDLE_TIMEOUT,
+                 sweep_interval: float = config.CLIENT_POOL_SWEEP_INTERVAL, limiter: RateLimiter | None = None):
+        self.limiter = limiter
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self._clients: OrderedDict[str, PooledClient] = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._last_sweep = time.monotonic()
+
+    @asynccontextmanager
+    async def lease(self, token: str) -> AsyncIterator[BrokerClient]:
+        # holds the client open until the request or stream using it is done
+        pooled = await self._checkout(token)
+        pooled.leases += 1
+        try:
+            yield pooled.services
+        finally:
+            pooled.leases -= 1
+            pooled.last_used = time.monotonic()
+            if pooled.retired and not pooled.leases:
+                await self._close(pooled)
+
+    async def _checkout(self, token: str) -> PooledClient:
+        now = time.monotonic()
+        pooled = self._clients.get(token)
+        if pooled is not None and pooled.is_healthy() and now - self._last_sweep <= self.sweep_interval:
+            self._clients.move_to_end(token)
+            pooled.last_used = now
+            return pooled
+
+        async with self._lock:
+            if now - self._last_sweep > self.sweep_interval:
+                await self._evict_idle(now)
+
+            pooled = self._clients.get(token)
+            if pooled is not None and not pooled.is_healthy():
+                await self._retire(self._clients.pop(token))
+                pooled = None
+
+            if pooled is None:
+                while len(self._clients) >= self.max_size:
+                    # only clients nobody holds are evicted; with every client in use the pool grows past max_size
+                    # until leases are released
+                    idle = next((key for key, client in self._clients.items() if not client.leases), None)
+                    if idle is None:
+                        break
+                    await self._close(self._clients.pop(idle))
+                pooled = PooledClient(token, self.limiter)
+                await pooled.open()
+                self._clients[token] = pooled
+
+            self._clients.move_to_end(token)
+            pooled.last_used = now
+            return pooled
+
+    async def _evict_idle(self, now: float):
+        expired = [token for token, pooled in self._clients.items()
+                   if not pooled.leases and now - pooled.last_used > self.idle_timeout]
+        for token in expired:
+            await self._close(self._clients.pop(token))
+        self._last_sweep = now
+
+    async def _retire(self, pooled: PooledClient):
+        # a broken channel is replaced straight away, but closed only after its current users are done
+        if pooled.leases:
+            pooled.retired = True
+        else:
+            await self._close(pooled)
+
+    @staticmethod
+    async def _close(pooled: PooledClient):
+        try:
+            await pooled.close()
+        except Exception:
+            pass
+
+    async def close(self):
+        async with self._lock:
+            while self._clients:
+                _, pooled = self._clients.popitem()
+                await self._close(pooled)
+
+    def __len__(self):
+        return len(self._clients)
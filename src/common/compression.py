@@ -0,0 +1,127 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from common import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# server-sent events must reach the client message by message, so they are never compressed
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+
+
+class GzipEncoder:
+    name = "gzip"
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(config.GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=config.BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+def negotiate(accept_encoding: str):
+    accepted = dict()
+    for token in accept_encoding.lower().split(","):
+        name, _, params = token.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    candidates = [GzipEncoder] if brotli is None else [BrotliEncoder, GzipEncoder]
+    # the first of equally weighted encodings wins, so brotli is preferred when the client does not choose
+    best = max(candidates, key=lambda encoder: accepted.get(encoder.name, 0.0))
+    return best if accepted.get(best.name, 0.0) > 0 else None
+
+
+class CompressionMiddleware:
+    """gzip or brotli, negotiated from Accept-Encoding, for responses above a minimum size."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = config.COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        encoder = None
+        if scope["type"] == "http":
+            encoder = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoder is None:
+            await self.app(scope, receive, send)
+            return
+        await CompressionResponder(self.app, self.minimum_size, encoder)(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, minimum_size: int, encoder):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoder_class = encoder
+        self.encoder = None
+        self.start: Message | None = None
+        self.passthrough = False
+        self.send = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            self.passthrough = ("content-encoding" in headers or
+                                headers.get("content-type", "").startswith(UNCOMPRESSED_TYPES))
+            self.start = message
+            if self.passthrough:
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+        if self.start is not None:
+            start, self.start = self.start, None
+            if not more_body and len(body) < self.minimum_size:
+                await self.send(start)
+                await self.send(message)
+                self.passthrough = True
+                return
+            self.encoder = self.encoder_class()
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = self.encoder.name
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                body = self.encoder.finish(body)
+                headers["Content-Length"] = str(len(body))
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            await self.send(start)
+
+        body = self.encoder.compress(body) if more_body else self.encoder.finish(body)
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
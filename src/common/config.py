@@ -0,0 +1,111 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+APP_NAME = os.environ.get("APP_NAME", "islam")
+
+CLIENT_POOL_MAX_SIZE = int(os.environ.get("CLIENT_POOL_MAX_SIZE", 64))
+CLIENT_POOL_IDLE_TIMEOUT = float(os.environ.get("CLIENT_POOL_IDLE_TIMEOUT", 300))
+CLIENT_POOL_SWEEP_INTERVAL = float(os.environ.get("CLIENT_POOL_SWEEP_INTERVAL", 30))
+
+TINKOFF_TARGET = os.environ.get("TINKOFF_TARGET") or None
+
+CATALOG_TTL = float(os.environ.get("CATALOG_TTL", 6 * 60 * 60))
+CATALOG_RETRY_DELAY = float(os.environ.get("CATALOG_RETRY_DELAY", 60))
+CATALOG_REFRESH_TOKEN = os.environ.get("CATALOG_REFRESH_TOKEN") or None
+
+REDIS_URL = os.environ.get("REDIS_URL") or None
+CACHE_PREFIX = os.environ.get("CACHE_PREFIX", "tinkoff-cache")
+CACHE_TTL = {
+    "trading_schedules": int(os.environ.get("CACHE_TTL_TRADING_SCHEDULES", 60 * 60)),
+    "dividends": int(os.environ.get("CACHE_TTL_DIVIDENDS", 6 * 60 * 60)),
+    "user_tariff": int(os.environ.get("CACHE_TTL_USER_TARIFF", 60 * 60)),
+    "user_info": int(os.environ.get("CACHE_TTL_USER_INFO", 10 * 60)),
+    "accounts": int(os.environ.get("CACHE_TTL_ACCOUNTS", 5 * 60)),
+    "last_prices": int(os.environ.get("CACHE_TTL_LAST_PRICES", 2)),
+    "close_prices": int(os.environ.get("CACHE_TTL_CLOSE_PRICES", 5)),
+    "order_book": int(os.environ.get("CACHE_TTL_ORDER_BOOK", 1)),
+}
+
+LAST_PRICES_CHUNK_SIZE = int(os.environ.get("LAST_PRICES_CHUNK_SIZE", 300))
+LAST_PRICES_CONCURRENCY = int(os.environ.get("LAST_PRICES_CONCURRENCY", 8))
+
+MARKET_HUB_ORDER_BOOK_DEPTH = int(os.environ.get("MARKET_HUB_ORDER_BOOK_DEPTH", 20))
+MARKET_HUB_LISTENER_QUEUE = int(os.environ.get("MARKET_HUB_LISTENER_QUEUE", 256))
+MARKET_HUB_RECONNECT_DELAY = float(os.environ.get("MARKET_HUB_RECONNECT_DELAY", 1))
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///./tinkoff_service.db")
+
+CANDLES_FETCH_CONCURRENCY = int(os.environ.get("CANDLES_FETCH_CONCURRENCY", 4))
+# GetCandles windows backfilled and stored together before the next batch is fetched (90 days of minute candles)
+CANDLES_MAX_WINDOWS = int(os.environ.get("CANDLES_MAX_WINDOWS", 90))
+
+OPERATIONS_PAGE_LIMIT = int(os.environ.get("OPERATIONS_PAGE_LIMIT", 1000))
+
+LEDGER_INITIAL_DAYS = int(os.environ.get("LEDGER_INITIAL_DAYS", 3 * 365))
+LEDGER_SYNC_OVERLAP = float(os.environ.get("LEDGER_SYNC_OVERLAP", 24 * 60 * 60))
+LEDGER_SYNC_INTERVAL = float(os.environ.get("LEDGER_SYNC_INTERVAL", 5 * 60))
+LEDGER_OWNER_TTL = float(os.environ.get("LEDGER_OWNER_TTL", 5 * 60))
+
+ACCOUNTS_FANOUT_CONCURRENCY = int(os.environ.get("ACCOUNTS_FANOUT_CONCURRENCY", 32))
+
+ANALYTICS_BASE_CURRENCY = os.environ.get("ANALYTICS_BASE_CURRENCY", "rub")
+ANALYTICS_RETURNS_DAYS = int(os.environ.get("ANALYTICS_RETURNS_DAYS", 365))
+ANALYTICS_CANDLES_CONCURRENCY = int(os.environ.get("ANALYTICS_CANDLES_CONCURRENCY", 8))
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_DEFAULT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_DEFAULT_PER_MINUTE", 100))
+RATE_LIMIT_DEFAULT_STREAMS = int(os.environ.get("RATE_LIMIT_DEFAULT_STREAMS", 6))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 0.2))
+# delay before retrying a failed tariff lookup, doubled on every further failure up to the maximum
+RATE_LIMIT_SEED_RETRY = float(os.environ.get("RATE_LIMIT_SEED_RETRY", 5))
+RATE_LIMIT_SEED_RETRY_MAX = float(os.environ.get("RATE_LIMIT_SEED_RETRY_MAX", 5 * 60))
+
+BROKER_COALESCE_ENABLED = os.environ.get("BROKER_COALESCE_ENABLED", "1") == "1"
+
+BROKER_RETRY_ATTEMPTS = int(os.environ.get("BROKER_RETRY_ATTEMPTS", 3))
+BROKER_RETRY_BACKOFF = float(os.environ.get("BROKER_RETRY_BACKOFF", 0.1))
+BROKER_RETRY_BACKOFF_MAX = float(os.environ.get("BROKER_RETRY_BACKOFF_MAX", 2))
+BROKER_HEDGE_DELAY = float(os.environ.get("BROKER_HEDGE_DELAY", 0.15))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", 30))
+BROKER_STALE_CACHE_SIZE = int(os.environ.get("BROKER_STALE_CACHE_SIZE", 256))
+BROKER_STALE_MAX_AGE = float(os.environ.get("BROKER_STALE_MAX_AGE", 10 * 60))
+
+# how long a websocket client without credential headers has to send them in its first message
+WEBSOCKET_AUTH_TIMEOUT = float(os.environ.get("WEBSOCKET_AUTH_TIMEOUT", 10))
+
+# required in the admin-token header by the stats and profiler endpoints, which are off while it is unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "0") == "1"
+PROFILER_INTERVAL = float(os.environ.get("PROFILER_INTERVAL", 0.001))
+
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get("COMPRESSION_MINIMUM_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+# dynamic responses are compressed per request, so a fast quality beats the best ratio
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 4))
+
+# gunicorn workers; each runs its own event loop, client pool and market data hubs
+WORKERS = int(os.environ.get("WORKERS", 1))
+WARMUP_TOKENS = [token for token in os.environ.get("WARMUP_TOKENS", "").split(",") if token] or \
+    ([CATALOG_REFRESH_TOKEN] if CATALOG_REFRESH_TOKEN else [])
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", 30))
+SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", 20))
+
+ORDER_BOOK_HISTORY = int(os.environ.get("ORDER_BOOK_HISTORY", 1000))
+
+BULK_ORDERS_MAX = int(os.environ.get("BULK_ORDERS_MAX", 100))
+BULK_ORDERS_CONCURRENCY = int(os.environ.get("BULK_ORDERS_CONCURRENCY", 8))
+
+ORDER_TRACKER_RECONCILE_INTERVAL = float(os.environ.get("ORDER_TRACKER_RECONCILE_INTERVAL", 30))
+ORDER_TRACKER_RECONNECT_DELAY = float(os.environ.get("ORDER_TRACKER_RECONNECT_DELAY", 1))
+ORDER_TRACKER_IDLE_TIMEOUT = float(os.environ.get("ORDER_TRACKER_IDLE_TIMEOUT", 10 * 60))
+ORDER_TRACKER_RETENTION = float(os.environ.get("ORDER_TRACKER_RETENTION", 60 * 60))
+ORDER_TRACKER_LISTENER_QUEUE = int(os.environ.get("ORDER_TRACKER_LISTENER_QUEUE", 256))
+ORDER_TRACKER_WAIT_MAX = float(os.environ.get("ORDER_TRACKER_WAIT_MAX", 60))
+
+# round limit prices to the instrument's price step instead of rejecting them
+PRE_TRADE_ROUND_PRICES = os.environ.get("PRE_TRADE_ROUND_PRICES", "1") == "1"
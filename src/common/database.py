@@ -0,0 +1,24 @@
+from sqlalchemy import MetaData
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from common import config
+
+metadata = MetaData()
+
+engine: AsyncEngine = create_async_engine(config.DATABASE_URL)
+
+
+def upsert(table, index_elements: list, update_columns: list | None = None):
+    # both supported backends share the ON CONFLICT syntax, only the construct differs
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(table)
+    if not update_columns:
+        return statement.on_conflict_do_nothing(index_elements=index_elements)
+    return statement.on_conflict_do_update(index_elements=index_elements,
+                                           set_={column: statement.excluded[column] for column in update_columns})
+
+
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
@@ -0,0 +1,88 @@
+import asyncio
+import hmac
+from typing import AsyncIterator, Tuple
+
+from fastapi import Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+
+
+async def get_client(request: Request, token: str | None = Header(default=None)) -> AsyncIterator[AsyncServices]:
+    if not token:
+        raise HTTPException(status_code=401, detail="Token header is required")
+    async with request.app.state.client_pool.lease(token) as client:
+        yield client
+
+
+def get_client_pool(request: Request):
+    return request.app.state.client_pool
+
+
+def _filled(value) -> bool:
+    return isinstance(value, str) and bool(value)
+
+
+async def accept_websocket(websocket: WebSocket, with_account: bool = False) -> Tuple[str, str | None] | None:
+    """Accepts the socket and returns its token and account id, or closes it with 4401 when they are missing.
+
+    Credentials come from the token and account-id headers or, for clients that cannot set headers, from a first
+    JSON message ``{"token": ..., "account_id": ...}``. They are never read from the query string, which ends up
+    in access logs.
+    """
+    await websocket.accept()
+    token, account_id = websocket.headers.get("token"), websocket.headers.get("account-id")
+    if not token or (with_account and not account_id):
+        try:
+            message = await asyncio.wait_for(websocket.receive_json(), config.WEBSOCKET_AUTH_TIMEOUT)
+        except WebSocketDisconnect:
+            return None
+        except (asyncio.TimeoutError, ValueError):
+            message = None
+        if isinstance(message, dict):
+            token, account_id = token or message.get("token"), account_id or message.get("account_id")
+    if not _filled(token) or (with_account and not _filled(account_id)):
+        await websocket.close(code=4401)
+        return None
+    return token, account_id
+
+
+def require_admin(admin_token: str | None = Header(default=None)):
+    # stats cover every token and account served by the worker, so they are not for API users
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not admin_token or not hmac.compare_digest(admin_token.encode(), config.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="admin-token header is invalid")
+
+
+def get_catalog(request: Request):
+    return request.app.state.instrument_catalog
+
+
+def get_market_hubs(request: Request):
+    return request.app.state.market_hubs
+
+
+def get_candle_store(request: Request):
+    return request.app.state.candle_store
+
+
+def get_ledger(request: Request):
+    return request.app.state.operations_ledger
+
+
+async def track_in_flight(request: Request):
+    async with request.app.state.in_flight.track():
+        yield
+
+
+def get_order_trackers(request: Request):
+    return request.app.state.order_trackers
+
+
+def get_pre_trade(request: Request):
+    return request.app.state.pre_trade
+
+
+def get_robots(request: Request):
+    return request.app.state.robots
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+class InFlight:
+    """Counts requests that must not be cut off by a shutdown, such as order placement."""
+
+    def __init__(self):
+        self.count = 0
+        self.draining = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @asynccontextmanager
+    async def track(self):
+        if self.draining:
+            # the load balancer retries on another worker
+            raise HTTPException(status_code=503, detail="Shutting down", headers={"Retry-After": "1"})
+        self.count += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self.count -= 1
+            if not self.count:
+                self._idle.set()
+
+    async def drain(self, timeout: float):
+        self.draining = True
+        if self.count:
+            logger.info("Waiting for %d in-flight requests", self.count)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%d requests still in flight after %.0fs, shutting down anyway", self.count, timeout)
@@ -0,0 +1,88 @@
+import time
+from contextvars import ContextVar
+
+import fastapi.routing
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"],
+                            buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled", ["method"])
+SERIALIZATION_LATENCY = Histogram("http_response_serialization_seconds",
+                                  "Response model validation and encoding time", ["route"], buckets=LATENCY_BUCKETS)
+
+BROKER_LATENCY = Histogram("broker_call_duration_seconds", "Broker call latency per attempt", ["method"],
+                           buckets=LATENCY_BUCKETS)
+BROKER_IN_FLIGHT = Gauge("broker_calls_in_flight", "Broker calls waiting for a response", ["method"])
+BROKER_ERRORS = Counter("broker_call_errors_total", "Failed broker calls by gRPC status", ["method", "code"])
+RATE_LIMIT_WAIT = Histogram("broker_rate_limit_wait_seconds", "Time spent queued by the client-side scheduler",
+                            ["method"], buckets=LATENCY_BUCKETS)
+PRE_TRADE_REJECTIONS = Counter("pre_trade_rejections_total", "Orders rejected before reaching the broker",
+                               ["reason"])
+
+_scope: ContextVar[Scope | None] = ContextVar("metrics_scope", default=None)
+
+
+def route_of(scope: Scope) -> str:
+    # the template keeps label cardinality bounded; unmatched paths share one label
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+        token = _scope.set(scope)
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        # the route is only known once the router has matched, so the gauge is labelled by method alone
+        in_flight = REQUESTS_IN_FLIGHT.labels(scope["method"])
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            _scope.reset(token)
+            REQUEST_LATENCY.labels(scope["method"], route_of(scope), str(status)).observe(
+                time.perf_counter() - started)
+
+
+def _timed_serialize_response(serialize_response):
+    async def wrapper(**kwargs):
+        started = time.perf_counter()
+        try:
+            return await serialize_response(**kwargs)
+        finally:
+            scope = _scope.get()
+            SERIALIZATION_LATENCY.labels(route_of(scope) if scope is not None else "unknown").observe(
+                time.perf_counter() - started)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def install(app):
+    app.add_middleware(MetricsMiddleware)
+    # FastAPI has no hook around response model serialization, so its module-level helper is wrapped
+    if not getattr(fastapi.routing.serialize_response, "timed", False):
+        fastapi.routing.serialize_response = _timed_serialize_response(fastapi.routing.serialize_response)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,65 +1,292 @@
 from __future__ import annotations
 
-import math
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Iterable, Sequence
 
-from dataclasses import dataclass
+import numpy as np
 from tinkoff.invest import MoneyValue, Quotation
 
+from common.quotation import NANO, nano_to_quotation, to_nano_array
+
+
+def _nano(value: int | float | Decimal | Quotation | MoneyValue | Money) -> int:
+    match value:
+        case Money():
+            return value._nano
+        case int():
+            return value * NANO
+        case float():
+            return int((Decimal(repr(value)) * NANO).to_integral_value(ROUND_HALF_EVEN))
+        case Decimal():
+            return int((value * NANO).to_integral_value(ROUND_HALF_EVEN))
+        case Quotation() | MoneyValue():
+            return value.units * NANO + value.nano
+        case _:
+            raise ValueError(f'{type(value)} is not supported as initial value for Money')
+
+
+def _combined(currency: str, other: str) -> str:
+    # an untagged amount takes the currency of the one it is combined with; two different tags never mix
+    if currency and other and currency != other:
+        raise ValueError(f'Cannot combine {currency} with {other}')
+    return currency or other
+
+
+def _div_round(numerator: int, denominator: int, rounding: str) -> int:
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    quotient, remainder = divmod(numerator, denominator)
+    if not remainder or rounding == 'floor':
+        return quotient
+    if rounding == 'ceil':
+        return quotient + 1
+    twice = 2 * remainder
+    if twice > denominator or (twice == denominator and quotient % 2):
+        return quotient + 1
+    return quotient
+
 
-@dataclass(init=False, order=True)
 class Money:
-    units: int
-    nano: int
-    MOD: int = 10 ** 9
+    """Immutable amount stored as a single int of nano-units plus a currency tag.
 
-    def __init__(self, value: int | float | Quotation | MoneyValue, nano: int = None):
-        if nano:
+    Arithmetic and ordering accept an untagged amount alongside a tagged one and refuse two different currencies.
+    Equality is exact: ``Money(1)`` and ``Money(1, currency='rub')`` are different values, and only untagged
+    amounts compare equal to ints.
+    """
+
+    __slots__ = ('_nano', 'currency')
+
+    MOD = NANO
+
+    def __init__(self, value: int | float | Decimal | Quotation | MoneyValue | Money = 0, nano: int | None = None,
+                 currency: str = ''):
+        if nano is not None:
             assert isinstance(value, int), 'if nano is present, value must be int'
             assert isinstance(nano, int), 'nano must be int'
-            self.units = value
-            self.nano = nano
+            total = value * NANO + nano
+        elif value.__class__ is MoneyValue:
+            total = value.units * NANO + value.nano
+            currency = currency or value.currency
         else:
-            match value:
-                case int() as value:
-                    self.units = value
-                    self.nano = 0
-                case float() as value:
-                    self.units = int(math.floor(value))
-                    self.nano = int((value - math.floor(value)) * self.MOD)
-                case Quotation() | MoneyValue() as value:
-                    self.units = value.units
-                    self.nano = value.nano
-                case _:
-                    raise ValueError(f'{type(value)} is not supported as initial value for Money')
+            total = _nano(value)
+            if value.__class__ is Money:
+                currency = currency or value.currency
+        _set_nano(self, total)
+        _set_currency(self, currency)
+
+    @classmethod
+    def from_nano(cls, nano: int, currency: str = '') -> Money:
+        money = _new(cls)
+        _set_nano(money, nano)
+        _set_currency(money, currency)
+        return money
+
+    @classmethod
+    def sum(cls, values: Iterable[Money | Quotation | MoneyValue], currency: str = '') -> Money:
+        total = 0
+        for value in values:
+            if value.__class__ is Money:
+                total += value._nano
+                tag = value.currency
+            else:
+                total += value.units * NANO + value.nano
+                tag = value.currency if value.__class__ is MoneyValue else ''
+            if tag and tag != currency:
+                currency = _combined(currency, tag)
+        return cls.from_nano(total, currency)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Money is immutable')
+
+    @property
+    def nano_total(self) -> int:
+        return self._nano
+
+    @property
+    def units(self) -> int:
+        units = abs(self._nano) // NANO
+        return -units if self._nano < 0 else units
+
+    @property
+    def nano(self) -> int:
+        return self._nano - self.units * NANO
 
     def __float__(self):
-        return self.units + self.nano / self.MOD
+        return self._nano / NANO
 
     def to_float(self):
         return float(self)
 
+    def to_decimal(self) -> Decimal:
+        return Decimal(self._nano) / NANO
+
     def to_quotation(self):
-        return Quotation(self.units, self.nano)
+        return nano_to_quotation(self._nano)
+
+    def to_money_value(self, currency: str | None = None):
+        quotation = nano_to_quotation(self._nano)
+        return MoneyValue(currency or self.currency, quotation.units, quotation.nano)
 
-    def to_money_value(self, currency: str):
-        return MoneyValue(currency, self.units, self.nano)
+    def _currency_with(self, other: Money) -> str:
+        return _combined(self.currency, other.currency)
 
     def __add__(self, other: Money) -> Money:
-        print(self.units + other.units + (self.nano + other.nano) // self.MOD)
-        print((self.nano + other.nano) % self.MOD)
-        return Money(
-            self.units + other.units + (self.nano + other.nano) // self.MOD,
-            (self.nano + other.nano) % self.MOD
-        )
+        if other.__class__ is not Money:
+            if other == 0:
+                return self
+            return NotImplemented
+        currency = self.currency
+        if currency != other.currency:
+            currency = self._currency_with(other)
+        money = _new(Money)
+        _set_nano(money, self._nano + other._nano)
+        _set_currency(money, currency)
+        return money
+
+    __radd__ = __add__
 
     def __neg__(self) -> Money:
-        return Money(-self.units, -self.nano)
+        return Money.from_nano(-self._nano, self.currency)
+
+    def __abs__(self) -> Money:
+        return self if self._nano >= 0 else -self
 
     def __sub__(self, other: Money) -> Money:
-        return self + -other
+        if other.__class__ is not Money:
+            return NotImplemented
+        return Money.from_nano(self._nano - other._nano, self._currency_with(other))
 
     def __mul__(self, other: int) -> Money:
-        return Money(self.units * other + (self.nano * other) // self.MOD, (self.nano * other) % self.MOD)
+        if not isinstance(other, int):
+            return NotImplemented
+        return Money.from_nano(self._nano * other, self.currency)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other: int | Money):
+        # Money / Money is a plain ratio, Money / int splits the amount (banker's rounding to 1 nano)
+        if isinstance(other, Money):
+            self._currency_with(other)
+            return self._nano / other._nano
+        return Money.from_nano(_div_round(self._nano, other, 'half_even'), self.currency)
+
+    def __floordiv__(self, other: int | Money):
+        if isinstance(other, Money):
+            self._currency_with(other)
+            return self._nano // other._nano
+        return Money.from_nano(self._nano // other, self.currency)
+
+    def round_to(self, increment: Money | Quotation | MoneyValue, rounding: str = 'half_even') -> Money:
+        """Round to a multiple of a price increment; rounding is half_even, floor or ceil."""
+        step = _nano(increment)
+        if step <= 0:
+            return self
+        return Money.from_nano(_div_round(self._nano, step, rounding) * step, self.currency)
+
+    def is_multiple_of(self, increment: Money | Quotation | MoneyValue) -> bool:
+        step = _nano(increment)
+        return step <= 0 or self._nano % step == 0
+
+    def __eq__(self, other):
+        if other.__class__ is Money:
+            return self._nano == other._nano and self.currency == other.currency
+        if isinstance(other, int):
+            return not self.currency and self._nano == other * NANO
+        return NotImplemented
+
+    def __lt__(self, other: Money) -> bool:
+        self._currency_with(other)
+        return self._nano < other._nano
+
+    def __le__(self, other: Money) -> bool:
+        self._currency_with(other)
+        return self._nano <= other._nano
+
+    def __gt__(self, other: Money) -> bool:
+        self._currency_with(other)
+        return self._nano > other._nano
+
+    def __ge__(self, other: Money) -> bool:
+        self._currency_with(other)
+        return self._nano >= other._nano
+
+    def __hash__(self):
+        # whole untagged amounts equal the int of their units, so they hash like it
+        if not self.currency and not self._nano % NANO:
+            return hash(self._nano // NANO)
+        return hash((self._nano, self.currency))
+
+    def __bool__(self):
+        return self._nano != 0
 
     def __str__(self) -> str:
         return f'<Money units={self.units} nano={self.nano}>'
+
+    def __repr__(self) -> str:
+        return f'Money({self.to_decimal()}, currency={self.currency!r})'
+
+
+# slot descriptors write past the immutability guard without object.__setattr__ lookups
+_new = object.__new__
+_set_nano = Money.__dict__['_nano'].__set__
+_set_currency = Money.__dict__['currency'].__set__
+
+
+def _common_currency(currency: str, tags: Iterable[str]) -> str:
+    for tag in set(tags):
+        if tag:
+            currency = _combined(currency, tag)
+    return currency
+
+
+class MoneyArray:
+    """Int64 nano-unit column for bulk sums over many amounts of one currency."""
+
+    __slots__ = ('nano', 'currency')
+
+    def __init__(self, nano: np.ndarray, currency: str = ''):
+        self.nano = np.asarray(nano, dtype=np.int64)
+        self.currency = currency
+
+    @classmethod
+    def from_values(cls, values: Sequence[Quotation | MoneyValue], currency: str = '') -> MoneyArray:
+        if values and isinstance(values[0], MoneyValue):
+            currency = _common_currency(currency, (value.currency for value in values))
+        return cls(to_nano_array(values), currency)
+
+    @classmethod
+    def from_money(cls, values: Sequence[Money], currency: str = '') -> MoneyArray:
+        nano = np.fromiter((value._nano for value in values), dtype=np.int64, count=len(values))
+        return cls(nano, _common_currency(currency, (value.currency for value in values)))
+
+    def __len__(self):
+        return len(self.nano)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return Money.from_nano(int(self.nano[item]), self.currency)
+        return MoneyArray(self.nano[item], self.currency)
+
+    def sum(self) -> Money:
+        return Money.from_nano(int(self.nano.sum()), self.currency)
+
+    def cumsum(self) -> MoneyArray:
+        return MoneyArray(np.cumsum(self.nano), self.currency)
+
+    def to_float(self) -> np.ndarray:
+        return self.nano / NANO
+
+    def __add__(self, other: MoneyArray) -> MoneyArray:
+        return MoneyArray(self.nano + other.nano, _combined(self.currency, other.currency))
+
+    def __sub__(self, other: MoneyArray) -> MoneyArray:
+        return MoneyArray(self.nano - other.nano, _combined(self.currency, other.currency))
+
+    def __neg__(self) -> MoneyArray:
+        return MoneyArray(-self.nano, self.currency)
+
+    def __mul__(self, other) -> MoneyArray:
+        # integer quantities only, so the result stays exact
+        return MoneyArray(self.nano * np.asarray(other, dtype=np.int64), self.currency)
+
+    __rmul__ = __mul__
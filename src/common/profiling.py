@@ -0,0 +1,40 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """Runtime toggle for a pyinstrument sampling profiler over the event loop thread."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiler = None
+
+    @property
+    def available(self) -> bool:
+        try:
+            import pyinstrument  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    @property
+    def running(self) -> bool:
+        return self._profiler is not None
+
+    def start(self):
+        from pyinstrument import Profiler
+
+        if self._profiler is None:
+            # started from a handler, so it samples the loop thread and sees every request, not just one task
+            self._profiler = Profiler(interval=self.interval, async_mode="disabled")
+            self._profiler.start()
+            logger.info("Sampling profiler started")
+
+    def stop(self) -> str:
+        if self._profiler is None:
+            return ""
+        profiler, self._profiler = self._profiler, None
+        profiler.stop()
+        logger.info("Sampling profiler stopped")
+        return profiler.output_text(unicode=True, show_all=False)
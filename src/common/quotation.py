@@ -0,0 +1,59 @@
+from decimal import Decimal
+from typing import Sequence
+
+import numpy as np
+from tinkoff.invest import MoneyValue, Quotation
+
+NANO = 1_000_000_000
+
+# units and nano of a Quotation/MoneyValue always share the sign, so plain
+# arithmetic is exact where string formatting dropped signs and zero padding
+
+
+def to_float(value: Quotation | MoneyValue) -> float:
+    return value.units + value.nano / NANO
+
+
+def to_nano(value: Quotation | MoneyValue) -> int:
+    return value.units * NANO + value.nano
+
+
+def to_decimal(value: Quotation | MoneyValue) -> Decimal:
+    return Decimal(value.units) + Decimal(value.nano) / NANO
+
+
+def nano_to_quotation(nano: int) -> Quotation:
+    units = abs(nano) // NANO
+    if nano < 0:
+        units = -units
+    return Quotation(units=units, nano=nano - units * NANO)
+
+
+def to_quotation(value: int | float | Decimal) -> Quotation:
+    if isinstance(value, float):
+        value = Decimal(repr(value))
+    return nano_to_quotation(int(Decimal(value) * NANO))
+
+
+def to_money_value(value: int | float | Decimal, currency: str) -> MoneyValue:
+    quotation = to_quotation(value)
+    return MoneyValue(currency=currency, units=quotation.units, nano=quotation.nano)
+
+
+# pulling the fields out of SDK objects costs about as much as the scalar loop,
+# so the array paths are for callers that keep working on the columns
+def _columns(values: Sequence[Quotation | MoneyValue]) -> tuple:
+    count = len(values)
+    units = np.fromiter((v.units for v in values), dtype=np.int64, count=count)
+    nano = np.fromiter((v.nano for v in values), dtype=np.int64, count=count)
+    return units, nano
+
+
+def to_float_array(values: Sequence[Quotation | MoneyValue]) -> np.ndarray:
+    units, nano = _columns(values)
+    return units + nano / NANO
+
+
+def to_nano_array(values: Sequence[Quotation | MoneyValue]) -> np.ndarray:
+    units, nano = _columns(values)
+    return units * NANO + nano
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Tuple
+
+from common import config
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_ORDERS = 0
+PRIORITY_DEFAULT = 1
+
+DEFAULT_GROUP = "default"
+
+
+def method_key(full_name: str) -> str:
+    # "tinkoff.public.invest.api.contract.v1.InstrumentsService/Shares" -> "InstrumentsService/Shares"
+    return full_name.rsplit(".", 1)[-1]
+
+
+def shape(limit: int, period: float, burst: float) -> Tuple[float, float]:
+    # the broker counts calls per window, and a bucket can spend its capacity plus a full window of refill
+    # inside one window, so the two are split to add up to the limit
+    capacity = max(limit * burst, 1.0)
+    return capacity, max(limit - capacity, 1.0) / period
+
+
+class TokenBucket:
+    def __init__(self, limit_per_minute: int, period: float = 60.0, burst: float = config.RATE_LIMIT_BURST):
+        self.limit = max(limit_per_minute, 1)
+        self.capacity, self.rate = shape(self.limit, period, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = list()
+        self._sequence = itertools.count()
+        self._drainer: asyncio.Task | None = None
+        self.acquired = 0
+        self.waited = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def _take(self) -> float:
+        """Takes a token and returns 0, or returns how long to wait until one is available."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self, priority: int = PRIORITY_DEFAULT) -> float:
+        self.acquired += 1
+        if not self._waiters and await self._take() == 0:
+            return 0.0
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+        await future
+
+        waited = time.monotonic() - started
+        self.waited += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        return waited
+
+    async def _drain(self):
+        while self._waiters:
+            if self._waiters[0][2].done():
+                # cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            wait = await self._take()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        return {"limit_per_minute": self.limit, "tokens": self._tokens_left(), "queue_depth": self.queue_depth,
+                "acquired": self.acquired, "waited": self.waited,
+                "wait_time_avg": self.wait_time_total / self.waited if self.waited else 0.0,
+                "wait_time_max": self.wait_time_max}
+
+    def _tokens_left(self) -> float | None:
+        return round(self.tokens, 2)
+
+
+# refills and takes from a bucket shared by all workers in one round trip; the wait is returned as a string
+# because Redis truncates Lua numbers to integers
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket(TokenBucket):
+    """A bucket whose tokens live in Redis, so every worker process draws from the same budget.
+
+    Queueing and priorities stay local to the process. If Redis fails, the bucket falls back to a local share of
+    the limit until it answers again.
+    """
+
+    def __init__(self, redis, key: str, limit_per_minute: int, period: float = 60.0,
+                 burst: float = config.RATE_LIMIT_BURST, workers: int = 1):
+        super().__init__(max(limit_per_minute // workers, 1), period, burst)
+        self.limit = max(limit_per_minute, 1)
+        self.shared_capacity, self.shared_rate = shape(self.limit, period, burst)
+        self.key = key
+        self.period = period
+        self._script = redis.register_script(TAKE_SCRIPT)
+
+    async def _take(self) -> float:
+        try:
+            wait = await self._script(keys=[self.key], args=[self.shared_capacity, self.shared_rate, time.time(),
+                                                             int(self.period * 2)])
+        except Exception:
+            logger.warning("Shared rate limit %s is unavailable, using the local share", self.key, exc_info=True)
+            return await super()._take()
+        return float(wait)
+
+    def _tokens_left(self) -> float | None:
+        return None
+
+
+class TokenLimits:
+    """Unary buckets and stream slots of one token, shaped by its tariff.
+
+    With several workers and no Redis every process gets an equal share of each limit. Stream slots are always
+    split that way, as every worker holds its own streams.
+    """
+
+    def __init__(self, period: float = 60.0, redis=None, key: str = "", workers: int = 1):
+        self.period = period
+        self.redis = redis
+        self.key = key
+        self.workers = max(workers, 1)
+        self.seeded = False
+        # failed tariff lookups in a row, and when the next one may be made
+        self.seed_failures = 0
+        self.seed_retry_at = 0.0
+        self.groups: Dict[str, TokenBucket] = {DEFAULT_GROUP: self._bucket(DEFAULT_GROUP,
+                                                                           config.RATE_LIMIT_DEFAULT_PER_MINUTE)}
+        self.methods: Dict[str, str] = dict()
+        self.streams: Dict[str, asyncio.Semaphore] = dict()
+        self.stream_groups: Dict[str, str] = dict()
+        self.stream_limits: Dict[str, int] = dict()
+
+    def seed(self, tariff):
+        for i, unary_limit in enumerate(tariff.unary_limits):
+            group = f"unary-{i}"
+            self.groups[group] = self._bucket(group, unary_limit.limit_per_minute)
+            for method in unary_limit.methods:
+                self.methods[method_key(method)] = group
+        for i, stream_limit in enumerate(tariff.stream_limits):
+            group = f"stream-{i}"
+            self._stream_group(group, stream_limit.limit)
+            for stream in stream_limit.streams:
+                self.stream_groups[method_key(stream)] = group
+        self.seeded = True
+
+    def _bucket(self, group: str, limit_per_minute: int) -> TokenBucket:
+        if self.redis is not None:
+            return RedisTokenBucket(self.redis, f"{self.key}:{group}", limit_per_minute, self.period,
+                                    workers=self.workers)
+        return TokenBucket(max(limit_per_minute // self.workers, 1), self.period)
+
+    def _stream_group(self, group: str, limit: int):
+        limit = max(limit // self.workers, 1)
+        self.streams[group] = asyncio.Semaphore(limit)
+        self.stream_limits[group] = limit
+
+    def bucket(self, method: str) -> Tuple[str, TokenBucket]:
+        group = self.methods.get(method, DEFAULT_GROUP)
+        return group, self.groups[group]
+
+    def stream(self, stream: str) -> asyncio.Semaphore:
+        group = self.stream_groups.get(stream)
+        if group is None:
+            group = self.stream_groups[stream] = f"stream-{stream}"
+            self._stream_group(group, config.RATE_LIMIT_DEFAULT_STREAMS)
+        return self.streams[group]
+
+
+class RateLimiter:
+    def __init__(self, period: float = 60.0, redis=None, workers: int = 1):
+        self.period = period
+        self.redis = redis
+        self.workers = workers
+        self._tokens: Dict[str, TokenLimits] = dict()
+        self._seed_locks: Dict[str, asyncio.Lock] = dict()
+
+    def limits(self, token: str) -> TokenLimits:
+        limits = self._tokens.get(token)
+        if limits is None:
+            key = f"{config.CACHE_PREFIX}:rate-limit:{hashlib.sha256(token.encode()).hexdigest()[:16]}"
+            limits = self._tokens[token] = TokenLimits(self.period, self.redis, key, self.workers)
+        return limits
+
+    async def seed(self, token: str, users_service):
+        limits = self.limits(token)
+        if limits.seeded or time.monotonic() < limits.seed_retry_at:
+            return
+        async with self._seed_locks.setdefault(token, asyncio.Lock()):
+            if limits.seeded or time.monotonic() < limits.seed_retry_at:
+                return
+            try:
+                limits.seed(await users_service.get_user_tariff())
+            except Exception as e:
+                # calls keep the conservative default bucket until a retry, backing off while the lookup fails
+                delay = min(config.RATE_LIMIT_SEED_RETRY * 2 ** limits.seed_failures, config.RATE_LIMIT_SEED_RETRY_MAX)
+                limits.seed_failures += 1
+                limits.seed_retry_at = time.monotonic() + delay
+                if limits.seed_failures == 1:
+                    logger.warning("Could not load tariff limits, using the default limits: %r", e)
+                else:
+                    logger.debug("Tariff limits still unavailable after %d attempts: %r", limits.seed_failures, e)
+                return
+            if limits.seed_failures:
+                logger.info("Tariff limits loaded after %d failed attempts", limits.seed_failures)
+
+    async def acquire(self, token: str, method: str, priority: int = PRIORITY_DEFAULT) -> float:
+        _, bucket = self.limits(token).bucket(method)
+        return await bucket.acquire(priority)
+
+    @asynccontextmanager
+    async def stream_slot(self, token: str, stream: str):
+        semaphore = self.limits(token).stream(stream)
+        async with semaphore:
+            yield
+
+    def stats(self) -> dict:
+        response = dict()
+        for i, limits in enumerate(self._tokens.values()):
+            response[f"token-{i}"] = {
+                "unary": {group: bucket.stats() for group, bucket in limits.groups.items()},
+                "streams": {group: {"limit": limits.stream_limits[group],
+                                    "open": limits.stream_limits[group] - semaphore._value}
+                            for group, semaphore in limits.streams.items()},
+            }
+        return response
@@ -0,0 +1,10 @@
+import os
+
+# read by ``gunicorn -c gunicorn_conf.py main:app``; WORKERS also tells the app how to split per-process limits
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WORKERS", 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.environ.get("WORKER_TIMEOUT", 60))
+# leaves room for the lifespan shutdown to drain in-flight orders (SHUTDOWN_DRAIN_TIMEOUT)
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", 20)) + 10))
+keepalive = int(os.environ.get("KEEPALIVE", 5))
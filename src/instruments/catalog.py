@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+from common.quotation import to_nano
+from common.responses import COLUMNS, ROWS, dumps, to_columns
+from instruments.schemas import AvailableCurrenciesResponse, AvailableShare
+
+logger = logging.getLogger(__name__)
+
+FORMATS = (ROWS, COLUMNS)
+
+
+def share_from_instrument(inst) -> AvailableShare:
+    return AvailableShare.construct(name=inst.name, ticker=inst.ticker, figi=inst.figi, uid=inst.uid,
+                          class_code=inst.class_code, exchange=inst.exchange, currency=inst.currency,
+                          country_name=inst.country_of_risk_name, buy_available=inst.buy_available_flag,
+                          sell_available=inst.sell_available_flag, sector=inst.sector)
+
+
+def currency_from_instrument(inst) -> AvailableCurrenciesResponse:
+    return AvailableCurrenciesResponse.construct(name=inst.name, figi=inst.figi, ticker=inst.ticker,
+                                       sell_available=inst.sell_available_flag, buy_available=inst.buy_available_flag)
+
+
+@dataclass(frozen=True)
+class TradingRules:
+    """What an order for an instrument must respect, checked before it is sent."""
+    figi: str
+    exchange: str
+    lot: int
+    # in nano units, so multiples are checked exactly
+    min_price_increment: int
+    buy_available: bool
+    sell_available: bool
+    api_trade_available: bool
+
+
+def rules_from_instrument(inst) -> TradingRules:
+    return TradingRules(figi=inst.figi, exchange=inst.exchange, lot=inst.lot,
+                        min_price_increment=to_nano(inst.min_price_increment),
+                        buy_available=inst.buy_available_flag, sell_available=inst.sell_available_flag,
+                        api_trade_available=inst.api_trade_available_flag)
+
+
+def dump_models(models: list, model, format: str) -> bytes:
+    return dumps(to_columns(models, model.__fields__) if format == COLUMNS else models)
+
+
+class InstrumentCatalog:
+    def __init__(self, ttl: float = config.CATALOG_TTL):
+        self.ttl = ttl
+        self.loaded_at: float | None = None
+        self.shares: List[AvailableShare] = list()
+        self.currencies: List[AvailableCurrenciesResponse] = list()
+        self.shares_json = {format: b"[]" for format in FORMATS}
+        self.currencies_json = {format: b"[]" for format in FORMATS}
+        self._shares_by_figi: Dict[str, AvailableShare] = dict()
+        self._shares_by_ticker: Dict[Tuple[str, str], AvailableShare] = dict()
+        self._shares_by_uid: Dict[str, AvailableShare] = dict()
+        self._currencies_by_figi: Dict[str, AvailableCurrenciesResponse] = dict()
+        self._rules_by_figi: Dict[str, TradingRules] = dict()
+        self._lock = asyncio.Lock()
+        self._retry_at = 0.0
+
+    @property
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    async def ensure_loaded(self, client: AsyncServices) -> bool:
+        """Loads a stale catalog and returns whether there is one to read from.
+
+        A failed load keeps the previous catalog and is not retried for ``CATALOG_RETRY_DELAY``; callers look up
+        what the catalog cannot answer in the broker.
+        """
+        if self.is_stale and time.monotonic() >= self._retry_at:
+            async with self._lock:
+                if self.is_stale and time.monotonic() >= self._retry_at:
+                    try:
+                        await self._load(client)
+                    except Exception as error:
+                        self._retry_at = time.monotonic() + config.CATALOG_RETRY_DELAY
+                        logger.warning("Instrument catalog load failed, retrying in %.0fs: %r",
+                                       config.CATALOG_RETRY_DELAY, error)
+        return self.loaded_at is not None
+
+    async def refresh(self, client: AsyncServices):
+        async with self._lock:
+            await self._load(client)
+
+    async def _load(self, client: AsyncServices):
+        shares, currencies = await asyncio.gather(client.instruments.shares(instrument_status=1),
+                                                  client.instruments.currencies(instrument_status=1))
+        self._build(shares.instruments, currencies.instruments)
+        self.loaded_at = time.monotonic()
+        logger.info("Instrument catalog loaded: %d shares, %d currencies", len(self.shares), len(self.currencies))
+
+    def _build(self, share_instruments, currency_instruments):
+        shares_by_figi, shares_by_ticker, shares_by_uid = dict(), dict(), dict()
+        shares = list()
+        for inst in share_instruments:
+            share = share_from_instrument(inst)
+            shares.append(share)
+            shares_by_figi[inst.figi] = share
+            shares_by_ticker[(inst.ticker, inst.class_code)] = share
+            shares_by_uid[inst.uid] = share
+
+        currencies = [currency_from_instrument(inst) for inst in currency_instruments]
+
+        # swap whole structures at once so concurrent readers never see a half-built index
+        self.shares = shares
+        self.shares_json = {format: dump_models(shares, AvailableShare, format) for format in FORMATS}
+        self.currencies = currencies
+        self.currencies_json = {format: dump_models(currencies, AvailableCurrenciesResponse, format) for format in FORMATS}
+        self._shares_by_figi, self._shares_by_ticker, self._shares_by_uid = shares_by_figi, shares_by_ticker, shares_by_uid
+        self._currencies_by_figi = {currency.figi: currency for currency in currencies}
+        self._rules_by_figi = {inst.figi: rules_from_instrument(inst)
+                               for instruments in (share_instruments, currency_instruments) for inst in instruments}
+
+    def share_by_figi(self, figi: str) -> AvailableShare | None:
+        return self._shares_by_figi.get(figi)
+
+    def share_by_ticker(self, ticker: str, class_code: str) -> AvailableShare | None:
+        return self._shares_by_ticker.get((ticker, class_code))
+
+    def share_by_uid(self, uid: str) -> AvailableShare | None:
+        return self._shares_by_uid.get(uid)
+
+    def currency_by_figi(self, figi: str) -> AvailableCurrenciesResponse | None:
+        return self._currencies_by_figi.get(figi)
+
+    def rules(self, figi: str) -> TradingRules | None:
+        return self._rules_by_figi.get(figi)
+
+    async def run_refresh(self, client_pool, token: str):
+        while True:
+            # a catalog warmed up at startup is not reloaded straight away
+            if self.is_stale:
+                try:
+                    async with client_pool.lease(token) as client:
+                        await self.refresh(client)
+                except Exception:
+                    logger.exception("Instrument catalog refresh failed")
+            await asyncio.sleep(self.ttl)
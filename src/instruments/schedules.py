@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+
+logger = logging.getLogger(__name__)
+
+Session = Tuple[datetime, datetime]
+
+# windows of a trading day in which orders are accepted, auctions included; unset times come back as the epoch
+SESSION_FIELDS = (("premarket_start_time", "premarket_end_time"),
+                  ("opening_auction_start_time", "closing_auction_end_time"),
+                  ("start_time", "end_time"),
+                  ("evening_opening_auction_start_time", "evening_end_time"),
+                  ("evening_start_time", "evening_end_time"))
+EPOCH = datetime(1970, 1, 2, tzinfo=timezone.utc)
+
+
+def _windows(day):
+    for start_field, end_field in SESSION_FIELDS:
+        yield getattr(day, start_field, None), getattr(day, end_field, None)
+    # typed intervals cover session kinds without fields of their own, such as weekend trading; every kind counts
+    # as open, so a session type added by the broker never blocks orders it would accept
+    for interval in getattr(day, "intervals", None) or ():
+        window = getattr(interval, "interval", None)
+        yield getattr(window, "start_ts", None), getattr(window, "end_ts", None)
+
+
+def _sessions(days) -> List[Session]:
+    sessions = set()
+    for day in days:
+        # weekend sessions can come on days that are not regular trading days, so their windows are kept too
+        for start, end in _windows(day):
+            if start and end and start > EPOCH and end > start:
+                sessions.add((start, end))
+    return sorted(sessions)
+
+
+class TradingSchedules:
+    """Trading sessions per exchange for the next week, refreshed on the ``trading_schedules`` cache TTL."""
+
+    def __init__(self, ttl: float = config.CACHE_TTL["trading_schedules"], horizon: timedelta = timedelta(days=7)):
+        self.ttl = ttl
+        self.horizon = horizon
+        self._sessions: Dict[str, Tuple[float, List[Session]]] = dict()
+        self._locks: Dict[str, asyncio.Lock] = dict()
+
+    async def sessions(self, client: AsyncServices, exchange: str) -> List[Session] | None:
+        """Sessions of ``exchange``, or None when the schedule could not be loaded."""
+        entry = self._sessions.get(exchange)
+        if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+            return entry[1]
+        async with self._locks.setdefault(exchange, asyncio.Lock()):
+            entry = self._sessions.get(exchange)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                return entry[1]
+            now = datetime.now(timezone.utc)
+            try:
+                response = await client.instruments.trading_schedules(exchange=exchange, from_=now - timedelta(days=1),
+                                                                      to=now + self.horizon)
+            except Exception:
+                logger.exception("Could not load the trading schedule of %s", exchange)
+                return entry[1] if entry is not None else None
+            sessions = _sessions(day for schedule in response.exchanges for day in schedule.days)
+            self._sessions[exchange] = (time.monotonic(), sessions)
+            return sessions
+
+
+def is_open(sessions: List[Session], now: datetime) -> bool:
+    return any(start <= now < end for start, end in sessions)
+
+
+def next_open(sessions: List[Session], now: datetime) -> datetime | None:
+    return next((start for start, _ in sessions if start > now), None)
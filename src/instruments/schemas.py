@@ -30,6 +30,7 @@ class AvailableShare(BaseModel):
     country_name: str
     buy_available: bool
     sell_available: bool
+    sector: Optional[str] = None
 
 
 class ShareDividend(BaseModel):
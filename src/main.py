@@ -1,19 +1,167 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
+from tinkoff.invest.exceptions import RequestError
+
+from common import config
+from common.broker import coalesced
+from common.cache import connect_redis, init_cache
+from common.call_policy import BrokerUnavailable, breakers, http_status
+from common.client_pool import ClientPool
+from common.compression import CompressionMiddleware
+from common.database import init_db
+from common.dependencies import require_admin
+from common.drain import InFlight
+from common.metrics import install as install_metrics, metrics_response
+from common.profiling import SamplingProfiler
+from common.rate_limit import RateLimiter
+from instruments.catalog import InstrumentCatalog
+from instruments.schedules import TradingSchedules
+from market_data.candles import CandleStore
+from market_data.hub import MarketDataHubs
+from operations.ledger import OperationsLedger
 from operations.router import router as user_router
 from instruments.router import router as instruments_router
 from orders.router import router as orders_router
-from robot.router import router as robot_router
+from orders.pre_trade import PreTradeCheck
+from orders.tracker import OrderTrackers
+from robot.router import robot_router as robot_runtime_router, router as robot_router
+from robot.runtime import RobotManager
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_up(app: FastAPI):
+    # runs before the worker accepts traffic, so the first requests find open channels and a loaded catalog
+    for token in config.WARMUP_TOKENS:
+        try:
+            async with app.state.client_pool.lease(token) as client:
+                await asyncio.wait_for(app.state.instrument_catalog.ensure_loaded(client), config.WARMUP_TIMEOUT)
+        except Exception:
+            logger.exception("Warm-up failed, continuing with a cold start")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    redis = await connect_redis()
+    app.state.cache_backend = await init_cache(redis)
+    app.state.rate_limiter = RateLimiter(redis=redis, workers=config.WORKERS) if config.RATE_LIMIT_ENABLED else None
+    app.state.client_pool = ClientPool(limiter=app.state.rate_limiter)
+    app.state.instrument_catalog = InstrumentCatalog()
+    app.state.pre_trade = PreTradeCheck(app.state.instrument_catalog, TradingSchedules())
+    app.state.market_hubs = MarketDataHubs(app.state.rate_limiter)
+    app.state.candle_store = CandleStore()
+    app.state.operations_ledger = OperationsLedger()
+    app.state.order_trackers = OrderTrackers(app.state.client_pool, app.state.rate_limiter)
+    app.state.robots = RobotManager(app.state.market_hubs, app.state.order_trackers, app.state.client_pool,
+                                    app.state.pre_trade)
+    app.state.in_flight = InFlight()
+    await warm_up(app)
+    app.state.ready = True
+    background = list()
+    if config.CATALOG_REFRESH_TOKEN:
+        background.append(asyncio.create_task(
+            app.state.instrument_catalog.run_refresh(app.state.client_pool, config.CATALOG_REFRESH_TOKEN)))
+    yield
+    app.state.ready = False
+    # robots stop first so they place no orders while requests drain
+    await app.state.robots.close()
+    await app.state.in_flight.drain(config.SHUTDOWN_DRAIN_TIMEOUT)
+    for task in background:
+        task.cancel()
+    await app.state.market_hubs.close()
+    await app.state.order_trackers.close()
+    await app.state.operations_ledger.close()
+    await app.state.client_pool.close()
+    if redis is not None:
+        await redis.close()
+
 
 app = FastAPI(
-    title="Tinkoff Service"
+    title="Tinkoff Service",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
+app.add_middleware(CompressionMiddleware)
+install_metrics(app)
+profiler = SamplingProfiler(config.PROFILER_INTERVAL)
 
 
 @app.get("/")
 def get_hello():
     return "Tinkoff Service"
 
+
+@app.get("/health")
+def get_health():
+    ready = getattr(app.state, "ready", False)
+    content = {"ready": ready, "worker": os.getpid(), "in_flight": app.state.in_flight.count if ready else 0}
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+
+@app.get("/cache/stats", dependencies=[Depends(require_admin)])
+def get_cache_stats():
+    return app.state.cache_backend.stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return metrics_response()
+
+
+def _profiler():
+    if not config.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    if not profiler.available:
+        raise HTTPException(status_code=501, detail="pyinstrument is not installed")
+    return profiler
+
+
+@app.post("/debug/profiler/start", dependencies=[Depends(require_admin)])
+async def start_profiler():
+    _profiler().start()
+    return {"running": True}
+
+
+@app.post("/debug/profiler/stop", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def stop_profiler():
+    return _profiler().stop()
+
+
+@app.get("/rate_limits/stats", dependencies=[Depends(require_admin)])
+def get_rate_limit_stats():
+    if app.state.rate_limiter is None:
+        return dict()
+    return app.state.rate_limiter.stats()
+
+
+@app.get("/order_trackers/stats", dependencies=[Depends(require_admin)])
+def get_order_tracker_stats():
+    return app.state.order_trackers.stats()
+
+
+@app.get("/broker/stats", dependencies=[Depends(require_admin)])
+def get_broker_stats():
+    return {"coalesced": dict(coalesced), "breakers": {name: breaker.stats() for name, breaker in breakers.items()}}
+
+
+@app.exception_handler(BrokerUnavailable)
+async def broker_unavailable_handler(request: Request, exc: BrokerUnavailable):
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(max(int(exc.retry_after), 1))})
+
+
+@app.exception_handler(RequestError)
+async def broker_error_handler(request: Request, exc: RequestError):
+    return JSONResponse(status_code=http_status(exc), content={"detail": f"{exc.code.name}: {exc.details}"})
+
 app.include_router(user_router)
 app.include_router(instruments_router)
 app.include_router(orders_router)
 app.include_router(robot_router)
+app.include_router(robot_runtime_router)
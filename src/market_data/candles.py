@@ -0,0 +1,163 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy import BigInteger, Column, DateTime, Float, String, Table, and_, delete, select
+from tinkoff.invest import CandleInterval
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+from common.quotation import to_float
+from common.database import engine, metadata, upsert
+
+# interval name -> (API enum, candle duration, widest range a single GetCandles call accepts)
+INTERVALS = {
+    "1min": (CandleInterval.CANDLE_INTERVAL_1_MIN, timedelta(minutes=1), timedelta(days=1)),
+    "5min": (CandleInterval.CANDLE_INTERVAL_5_MIN, timedelta(minutes=5), timedelta(days=1)),
+    "15min": (CandleInterval.CANDLE_INTERVAL_15_MIN, timedelta(minutes=15), timedelta(days=1)),
+    "hour": (CandleInterval.CANDLE_INTERVAL_HOUR, timedelta(hours=1), timedelta(weeks=1)),
+    "day": (CandleInterval.CANDLE_INTERVAL_DAY, timedelta(days=1), timedelta(days=365)),
+}
+
+candles = Table(
+    "candles", metadata,
+    Column("figi", String, primary_key=True),
+    Column("interval", String, primary_key=True),
+    Column("time", DateTime, primary_key=True),
+    Column("open", Float, nullable=False),
+    Column("high", Float, nullable=False),
+    Column("low", Float, nullable=False),
+    Column("close", Float, nullable=False),
+    Column("volume", BigInteger, nullable=False),
+)
+
+candle_coverage = Table(
+    "candle_coverage", metadata,
+    Column("figi", String, primary_key=True),
+    Column("interval", String, primary_key=True),
+    Column("start", DateTime, primary_key=True),
+    Column("end", DateTime, nullable=False),
+)
+
+Range = Tuple[datetime, datetime]
+
+
+def _utc_naive(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def missing_ranges(covered: List[Range], start: datetime, end: datetime) -> List[Range]:
+    missing, cursor = list(), start
+    for covered_start, covered_end in sorted(covered):
+        if covered_end <= cursor:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > cursor:
+            missing.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < end:
+        missing.append((cursor, end))
+    return missing
+
+
+def merge_ranges(ranges: List[Range]) -> List[Range]:
+    merged = list()
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def split_range(start: datetime, end: datetime, window: timedelta) -> List[Range]:
+    windows = list()
+    while start < end:
+        windows.append((start, min(start + window, end)))
+        start += window
+    return windows
+
+
+class CandleStore:
+    def __init__(self, concurrency: int = config.CANDLES_FETCH_CONCURRENCY):
+        self.concurrency = concurrency
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = dict()
+
+    async def get(self, client: AsyncServices, figi: str, interval: str, from_: datetime, to: datetime) -> dict:
+        if interval not in INTERVALS:
+            raise ValueError(f"Unsupported interval {interval}, expected one of {', '.join(INTERVALS)}")
+        start, end = _utc_naive(from_), min(_utc_naive(to), datetime.utcnow())
+
+        lock = self._locks.setdefault((figi, interval), asyncio.Lock())
+        async with lock:
+            await self._backfill(client, figi, interval, start, end)
+
+        async with engine.connect() as conn:
+            rows = (await conn.execute(
+                select(candles.c.time, candles.c.open, candles.c.high, candles.c.low, candles.c.close,
+                       candles.c.volume)
+                .where(and_(candles.c.figi == figi, candles.c.interval == interval,
+                            candles.c.time >= start, candles.c.time < end))
+                .order_by(candles.c.time))).all()
+
+        columns = {"time": [], "open": [], "high": [], "low": [], "close": [], "volume": []}
+        for row in rows:
+            columns["time"].append(row.time.replace(tzinfo=timezone.utc))
+            columns["open"].append(row.open)
+            columns["high"].append(row.high)
+            columns["low"].append(row.low)
+            columns["close"].append(row.close)
+            columns["volume"].append(row.volume)
+        return columns
+
+    async def _coverage(self, figi: str, interval: str) -> List[Range]:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(select(candle_coverage.c.start, candle_coverage.c.end).where(
+                and_(candle_coverage.c.figi == figi, candle_coverage.c.interval == interval)))).all()
+        return [(row.start, row.end) for row in rows]
+
+    async def _backfill(self, client: AsyncServices, figi: str, interval: str, start: datetime, end: datetime):
+        covered = await self._coverage(figi, interval)
+        gaps = missing_ranges(covered, start, end)
+        if not gaps:
+            return
+
+        api_interval, duration, window = INTERVALS[interval]
+        windows = [w for gap in gaps for w in split_range(gap[0], gap[1], window)]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(window_start: datetime, window_end: datetime):
+            async with semaphore:
+                response = await client.market_data.get_candles(
+                    figi=figi, interval=api_interval,
+                    from_=window_start.replace(tzinfo=timezone.utc), to=window_end.replace(tzinfo=timezone.utc))
+            return response.candles
+
+        # long ranges are fetched and stored a batch of windows at a time, so a year of minute candles is never held
+        # in memory at once and an interrupted backfill keeps what it already downloaded
+        for offset in range(0, len(windows), config.CANDLES_MAX_WINDOWS):
+            batch = windows[offset:offset + config.CANDLES_MAX_WINDOWS]
+            results = await asyncio.gather(*(fetch(*w) for w in batch))
+
+            rows = [{"figi": figi, "interval": interval, "time": _utc_naive(candle.time),
+                     "open": to_float(candle.open), "high": to_float(candle.high), "low": to_float(candle.low),
+                     "close": to_float(candle.close), "volume": candle.volume}
+                    for result in results for candle in result]
+
+            # the still-forming candle must be fetched again next time, so coverage stops before it
+            complete_until = datetime.utcnow() - duration
+            fetched = [(s, min(e, complete_until)) for s, e in batch if min(e, complete_until) > s]
+            covered = merge_ranges(covered + fetched)
+
+            async with engine.begin() as conn:
+                if rows:
+                    await conn.execute(upsert(candles, ["figi", "interval", "time"],
+                                              ["open", "high", "low", "close", "volume"]), rows)
+                await conn.execute(delete(candle_coverage).where(
+                    and_(candle_coverage.c.figi == figi, candle_coverage.c.interval == interval)))
+                if covered:
+                    await conn.execute(candle_coverage.insert(), [
+                        {"figi": figi, "interval": interval, "start": s, "end": e} for s, e in covered])
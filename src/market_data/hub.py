@@ -0,0 +1,218 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Set
+
+import numpy as np
+from tinkoff.invest import (
+    AsyncClient,
+    LastPriceInstrument,
+    MarketDataRequest,
+    OrderBookInstrument,
+    SubscribeLastPriceRequest,
+    SubscribeOrderBookRequest,
+    SubscribeTradesRequest,
+    SubscriptionAction,
+    TradeInstrument
+)
+
+from common import config
+from common.quotation import to_float, to_nano_array
+from common.rate_limit import RateLimiter
+from market_data.order_book import Levels, OrderBook
+
+logger = logging.getLogger(__name__)
+
+MARKET_DATA_STREAM = "MarketDataStreamService/MarketDataStream"
+
+
+
+def _levels(orders) -> tuple:
+    return (to_nano_array([order.price for order in orders]),
+            np.fromiter((order.quantity for order in orders), dtype=np.int64, count=len(orders)))
+
+
+class InstrumentState:
+    def __init__(self, figi: str, depth: int):
+        self.figi = figi
+        self.depth = depth
+        self.refs = 0
+        self.book = OrderBook(figi, depth)
+        self.limit_up: float | None = None
+        self.limit_down: float | None = None
+        self.last_price: float | None = None
+        self.last_price_time: datetime | None = None
+        self.last_trade: dict | None = None
+        self.listeners: Set[asyncio.Queue] = set()
+
+    @property
+    def has_book(self) -> bool:
+        return self.book.time is not None
+
+    @property
+    def book_time(self) -> datetime | None:
+        return self.book.time
+
+    @property
+    def bids(self) -> Levels:
+        return self.book.bids.levels(self.depth)
+
+    @property
+    def asks(self) -> Levels:
+        return self.book.asks.levels(self.depth)
+
+    def snapshot(self) -> dict:
+        return {"type": "snapshot", "figi": self.figi, "bids": self.bids, "asks": self.asks,
+                "book_time": self.book_time, "last_price": self.last_price,
+                "last_price_time": self.last_price_time, "last_trade": self.last_trade}
+
+    def publish(self, message: dict):
+        for queue in self.listeners:
+            if queue.full():
+                # slow consumer: drop its oldest message rather than stall the stream
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+
+class MarketDataHub:
+    def __init__(self, token: str, depth: int = config.MARKET_HUB_ORDER_BOOK_DEPTH,
+                 limiter: RateLimiter | None = None):
+        self.token = token
+        self.limiter = limiter
+        self.depth = depth
+        self.instruments: Dict[str, InstrumentState] = dict()
+        self._requests: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    def get(self, figi: str) -> InstrumentState | None:
+        return self.instruments.get(figi)
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def subscribe(self, figi: str) -> asyncio.Queue:
+        state = self.instruments.get(figi)
+        if state is None:
+            state = self.instruments[figi] = InstrumentState(figi, self.depth)
+            self._requests.put_nowait(self._request(figi, SubscriptionAction.SUBSCRIPTION_ACTION_SUBSCRIBE))
+        state.refs += 1
+        queue = asyncio.Queue(maxsize=config.MARKET_HUB_LISTENER_QUEUE)
+        queue.put_nowait(state.snapshot())
+        state.listeners.add(queue)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, figi: str, queue: asyncio.Queue):
+        state = self.instruments.get(figi)
+        if state is None:
+            return
+        state.listeners.discard(queue)
+        state.refs -= 1
+        if state.refs <= 0:
+            del self.instruments[figi]
+            self._requests.put_nowait(self._request(figi, SubscriptionAction.SUBSCRIPTION_ACTION_UNSUBSCRIBE))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _request(self, figi: str, action: SubscriptionAction) -> List[MarketDataRequest]:
+        return [
+            MarketDataRequest(subscribe_order_book_request=SubscribeOrderBookRequest(
+                subscription_action=action, instruments=[OrderBookInstrument(figi=figi, depth=self.depth)])),
+            MarketDataRequest(subscribe_trades_request=SubscribeTradesRequest(
+                subscription_action=action, instruments=[TradeInstrument(figi=figi)])),
+            MarketDataRequest(subscribe_last_price_request=SubscribeLastPriceRequest(
+                subscription_action=action, instruments=[LastPriceInstrument(figi=figi)])),
+        ]
+
+    async def _request_iterator(self):
+        while True:
+            for request in await self._requests.get():
+                yield request
+
+    async def _run(self):
+        while True:
+            try:
+                if self.limiter is None:
+                    await self._stream()
+                else:
+                    # wait for a free stream slot of the tariff instead of having the broker reject the stream
+                    async with self.limiter.stream_slot(self.token, MARKET_DATA_STREAM):
+                        await self._stream()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Market data stream failed, reconnecting")
+            await asyncio.sleep(config.MARKET_HUB_RECONNECT_DELAY)
+            # a fresh stream knows nothing about earlier subscriptions
+            self._requests = asyncio.Queue()
+            for figi in self.instruments:
+                self._requests.put_nowait(self._request(figi, SubscriptionAction.SUBSCRIPTION_ACTION_SUBSCRIBE))
+
+    async def _stream(self):
+        async with AsyncClient(self.token, target=config.TINKOFF_TARGET, app_name=config.APP_NAME) as client:
+            async for response in client.market_data_stream.market_data_stream(self._request_iterator()):
+                self._dispatch(response)
+
+    def _dispatch(self, response):
+        if response.orderbook:
+            self._on_order_book(response.orderbook)
+        elif response.trade:
+            self._on_trade(response.trade)
+        elif response.last_price:
+            self._on_last_price(response.last_price)
+
+    def _on_order_book(self, book):
+        state = self.instruments.get(book.figi)
+        if state is None:
+            return
+        bids, asks = state.book.on_snapshot(*_levels(book.bids), *_levels(book.asks), book.time)
+        delta = {"type": "orderbook", "figi": book.figi, "time": book.time, "bids": bids, "asks": asks}
+        state.limit_up, state.limit_down = to_float(book.limit_up), to_float(book.limit_down)
+        if delta["bids"] or delta["asks"]:
+            state.publish(delta)
+
+    def _on_trade(self, trade):
+        state = self.instruments.get(trade.figi)
+        if state is None:
+            return
+        state.last_trade = {"price": to_float(trade.price), "quantity": trade.quantity,
+                            "direction": trade.direction, "time": trade.time}
+        state.publish({"type": "trade", "figi": trade.figi, **state.last_trade})
+
+    def _on_last_price(self, last_price):
+        state = self.instruments.get(last_price.figi)
+        if state is None:
+            return
+        state.last_price, state.last_price_time = to_float(last_price.price), last_price.time
+        state.publish({"type": "last_price", "figi": last_price.figi, "price": state.last_price,
+                       "time": state.last_price_time})
+
+
+class MarketDataHubs:
+    def __init__(self, limiter: RateLimiter | None = None):
+        self.limiter = limiter
+        self._hubs: Dict[str, MarketDataHub] = dict()
+
+    def find(self, token: str | None) -> MarketDataHub | None:
+        return self._hubs.get(token) if token else None
+
+    def acquire(self, token: str) -> MarketDataHub:
+        hub = self._hubs.get(token)
+        if hub is None:
+            hub = self._hubs[token] = MarketDataHub(token, limiter=self.limiter)
+        return hub
+
+    async def release(self, token: str):
+        hub = self._hubs.get(token)
+        if hub is not None and not len(hub):
+            del self._hubs[token]
+            await hub.close()
+
+    async def close(self):
+        for hub in self._hubs.values():
+            await hub.close()
+        self._hubs.clear()
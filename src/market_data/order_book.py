@@ -0,0 +1,187 @@
+from datetime import datetime
+from typing import List, Tuple
+
+import numpy as np
+
+from common import config
+from common.quotation import NANO
+
+# prices are kept in nano units so levels compare exactly; floats are only produced on the way out
+Levels = List[Tuple[float, int]]
+
+
+class BookSide:
+    """Price levels of one side, best first, as parallel int64 arrays of nano prices and lots."""
+
+    def __init__(self, descending: bool):
+        self.descending = descending
+        self.prices = np.empty(0, dtype=np.int64)
+        self.quantities = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def _position(self, price: int) -> int:
+        # searchsorted wants ascending keys, so bids are searched by negated price
+        if self.descending:
+            return int(np.searchsorted(-self.prices, -price))
+        return int(np.searchsorted(self.prices, price))
+
+    def replace(self, prices: np.ndarray, quantities: np.ndarray) -> List[Tuple[int, int]]:
+        """Swaps in a full snapshot and returns the levels that changed, removed ones with quantity 0."""
+        keep = quantities > 0
+        prices, quantities = prices[keep], quantities[keep]
+        order = np.argsort(-prices if self.descending else prices, kind="stable")
+        old = dict(zip(self.prices.tolist(), self.quantities.tolist()))
+        self.prices, self.quantities = prices[order], quantities[order]
+        changed = [(price, quantity) for price, quantity in zip(self.prices.tolist(), self.quantities.tolist())
+                   if old.pop(price, None) != quantity]
+        return changed + [(price, 0) for price in old]
+
+    def update(self, price: int, quantity: int):
+        """Sets one level; a quantity of 0 removes it."""
+        i = self._position(price)
+        exists = i < len(self.prices) and self.prices[i] == price
+        if quantity <= 0:
+            if exists:
+                self.prices, self.quantities = np.delete(self.prices, i), np.delete(self.quantities, i)
+        elif exists:
+            self.quantities[i] = quantity
+        else:
+            self.prices, self.quantities = np.insert(self.prices, i, price), np.insert(self.quantities, i, quantity)
+
+    def best(self) -> int | None:
+        return int(self.prices[0]) if len(self.prices) else None
+
+    def levels(self, depth: int) -> Levels:
+        return list(zip((self.prices[:depth] / NANO).tolist(), self.quantities[:depth].tolist()))
+
+    def volume(self, levels: int) -> int:
+        return int(self.quantities[:levels].sum())
+
+    def vwap(self, size: int) -> float | None:
+        """Average price of taking ``size`` lots from this side, or None if the visible depth is too thin."""
+        if size <= 0 or not len(self.prices):
+            return None
+        filled = np.cumsum(self.quantities)
+        if filled[-1] < size:
+            return None
+        last = int(np.searchsorted(filled, size))
+        taken = self.quantities[:last + 1].astype(np.float64)
+        taken[-1] -= filled[last] - size
+        # float64 products, as nano price times lots overflows int64 for large orders
+        return float(np.dot(self.prices[:last + 1].astype(np.float64), taken) / size / NANO)
+
+
+class BookHistory:
+    """Ring buffer of the last ``capacity`` snapshots, ``depth`` levels per side."""
+
+    def __init__(self, capacity: int, depth: int):
+        self.capacity = capacity
+        self.depth = depth
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.bid_prices = np.zeros((capacity, depth), dtype=np.int64)
+        self.bid_quantities = np.zeros((capacity, depth), dtype=np.int64)
+        self.ask_prices = np.zeros((capacity, depth), dtype=np.int64)
+        self.ask_quantities = np.zeros((capacity, depth), dtype=np.int64)
+        self.next = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, time: datetime, bids: BookSide, asks: BookSide):
+        i = self.next
+        self.times[i] = time.timestamp()
+        for prices, quantities, side in ((self.bid_prices, self.bid_quantities, bids),
+                                         (self.ask_prices, self.ask_quantities, asks)):
+            n = min(len(side), self.depth)
+            prices[i, :n], quantities[i, :n] = side.prices[:n], side.quantities[:n]
+            prices[i, n:], quantities[i, n:] = 0, 0
+        self.next = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _window(self, seconds: float | None) -> np.ndarray:
+        # row indices oldest first
+        rows = (np.arange(self.count) + self.next - self.count) % self.capacity
+        if seconds is not None and self.count:
+            rows = rows[self.times[rows] >= self.times[rows[-1]] - seconds]
+        return rows
+
+    def summary(self, seconds: float | None = None, levels: int = 1) -> dict:
+        rows = self._window(seconds)
+        bid, ask = self.bid_prices[rows, 0], self.ask_prices[rows, 0]
+        two_sided = (bid > 0) & (ask > 0)
+        rows, bid, ask = rows[two_sided], bid[two_sided], ask[two_sided]
+        if not len(rows):
+            return {"snapshots": 0}
+        mid = (bid + ask) / 2 / NANO
+        bid_volume = self.bid_quantities[rows, :levels].sum(axis=1)
+        ask_volume = self.ask_quantities[rows, :levels].sum(axis=1)
+        total = bid_volume + ask_volume
+        imbalance = np.divide(bid_volume - ask_volume, total, out=np.zeros(len(rows)), where=total > 0)
+        return {"snapshots": int(len(rows)), "seconds": float(self.times[rows[-1]] - self.times[rows[0]]),
+                "mid_first": float(mid[0]), "mid_last": float(mid[-1]), "mid_min": float(mid.min()),
+                "mid_max": float(mid.max()), "mid_std": float(mid.std()),
+                "spread_avg": float(((ask - bid) / NANO).mean()), "imbalance_avg": float(imbalance.mean())}
+
+
+class OrderBook:
+    """Local book of one instrument, fed by the market data stream."""
+
+    def __init__(self, figi: str, depth: int, history: int = config.ORDER_BOOK_HISTORY):
+        self.figi = figi
+        self.depth = depth
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.time: datetime | None = None
+        self.history = BookHistory(history, depth)
+
+    def on_snapshot(self, bid_prices: np.ndarray, bid_quantities: np.ndarray, ask_prices: np.ndarray,
+                    ask_quantities: np.ndarray, time: datetime) -> Tuple[Levels, Levels]:
+        """Replaces both sides and returns the changed bid and ask levels in price units."""
+        bids = self.bids.replace(bid_prices, bid_quantities)
+        asks = self.asks.replace(ask_prices, ask_quantities)
+        self._on_change(time)
+        return ([(price / NANO, quantity) for price, quantity in bids],
+                [(price / NANO, quantity) for price, quantity in asks])
+
+    def on_level(self, direction: str, price: int, quantity: int, time: datetime):
+        (self.bids if direction == "Buy" else self.asks).update(price, quantity)
+        self._on_change(time)
+
+    def _on_change(self, time: datetime):
+        self.time = time
+        self.history.append(time, self.bids, self.asks)
+
+    @property
+    def mid(self) -> float | None:
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return (bid + ask) / 2 / NANO
+
+    @property
+    def spread(self) -> float | None:
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return (ask - bid) / NANO
+
+    def vwap(self, direction: str, size: int) -> float | None:
+        # a buy takes liquidity from the asks, a sell from the bids
+        return (self.asks if direction == "Buy" else self.bids).vwap(size)
+
+    def imbalance(self, levels: int = 1) -> float | None:
+        bid_volume, ask_volume = self.bids.volume(levels), self.asks.volume(levels)
+        total = bid_volume + ask_volume
+        return (bid_volume - ask_volume) / total if total else None
+
+    def metrics(self, depth: int, size: int | None = None, levels: int = 1, window: float | None = None) -> dict:
+        response = {"figi": self.figi, "time": self.time, "bids": self.bids.levels(depth),
+                    "asks": self.asks.levels(depth), "mid": self.mid, "spread": self.spread,
+                    "imbalance": self.imbalance(levels), "history": self.history.summary(window, levels)}
+        if size is not None:
+            response["vwap_buy"] = self.vwap("Buy", size)
+            response["vwap_sell"] = self.vwap("Sell", size)
+        return response
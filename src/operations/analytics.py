@@ -0,0 +1,269 @@
+import asyncio
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+from common.quotation import NANO, to_float
+from instruments.catalog import InstrumentCatalog
+from market_data.candles import CandleStore
+from operations.ledger import BUY_TYPES, SELL_TYPES, OperationsLedger
+from operations.schemas import (
+    AccountAnalytics,
+    AccountReturns,
+    CurrencyExposure,
+    CurrencyPnl,
+    Exposure,
+    InstrumentAnalytics
+)
+
+INCOME_TYPES = ("OPERATION_TYPE_DIVIDEND", "OPERATION_TYPE_COUPON", "OPERATION_TYPE_DIVIDEND_TAX",
+                "OPERATION_TYPE_BOND_TAX")
+EXTERNAL_FLOW_TYPES = ("OPERATION_TYPE_INPUT", "OPERATION_TYPE_OUTPUT", "OPERATION_TYPE_INPUT_SWIFT",
+                       "OPERATION_TYPE_OUTPUT_SWIFT", "OPERATION_TYPE_INPUT_ACQUIRING",
+                       "OPERATION_TYPE_OUTPUT_ACQUIRING")
+
+# daily candles of these are quoted in money per piece; anything else is valued at its current price
+CANDLE_VALUED_TYPES = ("share", "etf", "currency")
+
+DAYS_PER_YEAR = 365
+
+
+def _fifo_loop(buy: np.ndarray, quantity: np.ndarray, amount: np.ndarray) -> tuple:
+    # lots are [signed quantity, unit price]; a trade first closes lots of the opposite side, oldest first
+    lots, realized = deque(), 0.0
+    for is_buy, remaining, value in zip(buy.tolist(), quantity.tolist(), amount.tolist()):
+        if not remaining:
+            continue
+        sign, price = (1 if is_buy else -1), value / remaining
+        while remaining and lots and lots[0][0] * sign < 0:
+            lot = lots[0]
+            take = min(remaining, abs(lot[0]))
+            realized += take * (lot[1] - price) * sign
+            lot[0] += sign * take
+            remaining -= take
+            if not lot[0]:
+                lots.popleft()
+        if remaining:
+            lots.append([sign * remaining, price])
+    return sum(lot[0] for lot in lots), sum(lot[0] * lot[1] for lot in lots), realized
+
+
+def fifo(codes: np.ndarray, buy: np.ndarray, quantity: np.ndarray, amount: np.ndarray, groups: int) -> tuple:
+    """FIFO over trades sorted by instrument code, then date; ``amount`` is the money paid or received.
+
+    Returns held quantity, cost basis of what is held and realized P&L, each indexed by code.
+    """
+    buy_quantity = np.where(buy, quantity, 0)
+    bought = np.concatenate(([0], np.cumsum(buy_quantity)))
+    sold = np.concatenate(([0], np.cumsum(quantity - buy_quantity)))
+    cost = np.concatenate(([0.0], np.cumsum(np.where(buy, amount, 0.0))))
+    starts = np.searchsorted(codes, np.arange(groups))
+    ends = np.searchsorted(codes, np.arange(groups), side="right")
+
+    # on an instrument that is never short, the n-th unit sold is the n-th unit bought, and the cost of the first
+    # x units bought (counted across all instruments in code order) is piecewise linear in x, so every sell is
+    # costed by interpolation; instruments that do go short are settled lot by lot below
+    bought_before, sold_before = bought[starts], sold[starts]
+    sold_after = bought_before[codes] + sold[1:] - sold_before[codes]
+    short = np.zeros(groups, dtype=bool)
+    short[codes[bought[1:] - bought_before[codes] < sold[1:] - sold_before[codes]]] = True
+    points = buy_quantity > 0
+    xp = np.concatenate(([0], bought[1:][points]))
+    fp = np.concatenate(([0.0], cost[1:][points]))
+    sell_cost = np.interp(sold_after, xp, fp) - np.interp(sold_after - quantity + buy_quantity, xp, fp)
+    pnl = np.where(buy | (quantity == 0), 0.0, amount - sell_cost)
+
+    realized = np.bincount(codes, weights=pnl, minlength=groups)
+    held = (bought[ends] - bought_before) - (sold[ends] - sold_before)
+    basis = (np.interp(bought[ends], xp, fp) -
+             np.interp(bought_before + sold[ends] - sold_before, xp, fp))
+    held = held.astype(np.float64)
+    for code in np.flatnonzero(short):
+        rows = slice(starts[code], ends[code])
+        held[code], basis[code], realized[code] = _fifo_loop(buy[rows], quantity[rows], amount[rows])
+    return held, basis, realized
+
+
+def daily_values(trade_day: np.ndarray, codes: np.ndarray, delta: np.ndarray, cash_day: np.ndarray,
+                 payment: np.ndarray, flow: np.ndarray, held: np.ndarray, cash: float, closes: np.ndarray) -> tuple:
+    """Account value at each day's close and the chained time-weighted return up to it.
+
+    Holdings and cash are walked back from today's, so operations before the window are not needed.
+    ``closes`` is days by instruments; ``flow`` is money deposited (positive) or withdrawn.
+    """
+    days, groups = closes.shape
+    moves = np.zeros((days, groups))
+    np.add.at(moves, (trade_day, codes), delta)
+    # what is held at the end of day t is today's position less everything traded after t
+    holdings = held - (moves.sum(axis=0) - np.cumsum(moves, axis=0))
+    payments = np.bincount(cash_day, weights=payment, minlength=days)
+    balance = cash - (payments.sum() - np.cumsum(payments))
+    values = (holdings * closes).sum(axis=1) + balance
+
+    flows = np.bincount(cash_day, weights=flow, minlength=days)
+    returns = np.zeros(days)
+    previous = values[:-1]
+    valid = previous > 0
+    returns[1:][valid] = (values[1:][valid] - flows[1:][valid]) / previous[valid] - 1
+    return values, np.cumprod(1 + returns) - 1
+
+
+async def _closes(client: AsyncServices, store: CandleStore, figis: List[str], candle_valued: np.ndarray,
+                  current: np.ndarray, start: datetime, days: int) -> np.ndarray:
+    closes = np.tile(current, (days, 1))
+    first_day = np.datetime64(start.date(), "D")
+    semaphore = asyncio.Semaphore(config.ANALYTICS_CANDLES_CONCURRENCY)
+    # the candle store refetches days not yet a full day old, so reading up to yesterday keeps every request after
+    # the first off the API; yesterday takes the close before it and today is valued at the current price
+    yesterday = start + timedelta(days=days - 2)
+
+    async def fetch(figi: str):
+        async with semaphore:
+            return await store.get(client, figi, "day", start, yesterday)
+
+    wanted = np.flatnonzero(candle_valued).tolist()
+    results = await asyncio.gather(*(fetch(figis[i]) for i in wanted), return_exceptions=True)
+    for i, columns in zip(wanted, results):
+        if isinstance(columns, Exception) or not columns["close"]:
+            continue
+        candle_days = (np.array([t.date() for t in columns["time"]], dtype="datetime64[D]") - first_day).astype(int)
+        # each day takes the last close at or before it; days before the first candle take the first close
+        position = np.clip(np.searchsorted(candle_days, np.arange(days), side="right") - 1, 0, None)
+        closes[:-1, i] = np.asarray(columns["close"], dtype=np.float64)[position[:-1]]
+    return closes
+
+
+def _last_by_code(codes: np.ndarray, groups: int) -> np.ndarray:
+    last = np.full(groups, -1)
+    np.maximum.at(last, codes, np.arange(len(codes)))
+    return last
+
+
+async def account_analytics(client: AsyncServices, ledger: OperationsLedger, catalog: InstrumentCatalog,
+                            store: CandleStore, account_id: str, currency: str = config.ANALYTICS_BASE_CURRENCY,
+                            days: int = config.ANALYTICS_RETURNS_DAYS) -> AccountAnalytics:
+    """P&L by instrument from the ledger's FIFO, exposures from current positions and returns in ``currency``.
+
+    Amounts are not converted between currencies, so totals and exposures are reported per currency.
+    """
+    columns, portfolio, positions, _ = await asyncio.gather(
+        ledger.columns(account_id), client.operations.get_portfolio(account_id=account_id),
+        client.operations.get_positions(account_id=account_id), catalog.ensure_loaded(client))
+    operation_type, payment = columns["type"], columns["payment_nano"] / NANO
+    quantity = columns["quantity_done"]
+
+    held_figis = [sec.figi for sec in positions.securities]
+    figis, inverse = np.unique(np.concatenate((columns["figi"], np.array(held_figis, dtype=object))).astype(str),
+                               return_inverse=True)
+    groups, codes, held_codes = len(figis), inverse[:len(quantity)], inverse[len(quantity):]
+
+    buy = np.isin(operation_type, BUY_TYPES)
+    trade = (buy | np.isin(operation_type, SELL_TYPES)) & (quantity > 0)
+    order = np.flatnonzero(trade)[np.argsort(codes[trade], kind="stable")]
+    fifo_held, basis, realized = fifo(codes[order], buy[order], quantity[order], np.abs(payment[order]), groups)
+    income = np.bincount(codes, weights=np.where(np.isin(operation_type, INCOME_TYPES), payment, 0.0),
+                         minlength=groups)
+    commission = np.bincount(codes, weights=np.where(trade, columns["commission_nano"] / NANO, 0.0),
+                             minlength=groups)
+    counts = np.bincount(codes, minlength=groups)
+    last = _last_by_code(codes, groups)
+
+    held = np.zeros(groups)
+    np.add.at(held, held_codes, [sec.balance + sec.blocked for sec in positions.securities])
+    prices, broker_basis, position_types = dict(), dict(), dict()
+    for position in portfolio.positions:
+        prices[position.figi] = to_float(position.current_price)
+        broker_basis[position.figi] = to_float(position.average_position_price_fifo) * to_float(position.quantity)
+        position_types[position.figi] = position.instrument_type
+    missing = [figi for figi in held_figis if figi not in prices]
+    if missing:
+        for price in (await client.market_data.get_last_prices(figi=missing)).last_prices:
+            prices[price.figi] = to_float(price.price)
+
+    instruments = list()
+    currencies, types = np.empty(groups, dtype=object), np.empty(groups, dtype=object)
+    current = np.full(groups, np.nan)
+    for code, figi in enumerate(figis):
+        if not figi:
+            continue
+        share = catalog.share_by_figi(figi)
+        types[code] = (columns["instrument_type"][last[code]] if last[code] >= 0 else
+                       position_types.get(figi, "share" if share is not None else ""))
+        currencies[code] = (columns["currency"][last[code]] if last[code] >= 0 else
+                            share.currency if share is not None else "")
+        price = prices.get(figi)
+        current[code] = price if price is not None else np.nan
+        # the ledger only reaches back so far; a position opened before it falls back to the broker's basis
+        complete = fifo_held[code] == held[code]
+        cost_basis = float(basis[code]) if complete else broker_basis.get(figi)
+        market_value = held[code] * price if price is not None else None
+        unrealized = market_value - cost_basis if market_value is not None and cost_basis is not None else None
+        instruments.append(InstrumentAnalytics.construct(
+            figi=figi, ticker=share.ticker if share else None, name=share.name if share else None,
+            instrument_type=types[code], sector=share.sector if share else None, currency=currencies[code],
+            quantity=float(held[code]), cost_basis=cost_basis,
+            average_price=cost_basis / held[code] if cost_basis is not None and held[code] else None,
+            price=price, market_value=market_value, realized_pnl=float(realized[code]), unrealized_pnl=unrealized,
+            income=float(income[code]), commission=float(commission[code]), operations=int(counts[code]),
+            complete=bool(complete)))
+
+    totals = defaultdict(lambda: defaultdict(float))
+    sectors = defaultdict(float)
+    for item in instruments:
+        total = totals[item.currency]
+        total["realized_pnl"] += item.realized_pnl
+        total["unrealized_pnl"] += item.unrealized_pnl or 0.0
+        total["income"] += item.income
+        total["commission"] += item.commission
+        total["market_value"] += item.market_value or 0.0
+        if item.market_value:
+            sectors[(item.sector or item.instrument_type or "unknown", item.currency)] += item.market_value
+    cash = {money.currency.lower(): to_float(money) for money in positions.money}
+    # sector weights are shares of the securities held in the same currency; long and short positions can net to
+    # zero, and then there is no weight to report
+    exposures = [Exposure(key=key, currency=ccy, value=value,
+                          weight=value / totals[ccy]["market_value"] if totals[ccy]["market_value"] else None)
+                 for (key, ccy), value in sorted(sectors.items(), key=lambda item: -abs(item[1]))]
+    currency_exposure = list()
+    for ccy in sorted(set(totals) | set(cash)):
+        securities = totals[ccy]["market_value"] if ccy in totals else 0.0
+        currency_exposure.append(CurrencyExposure(currency=ccy, securities=securities, cash=cash.get(ccy, 0.0),
+                                                  total=securities + cash.get(ccy, 0.0)))
+
+    returns = await _returns(client, store, columns, codes, buy, trade, payment, figis, currencies, types, current,
+                             held, cash.get(currency, 0.0), currency, days)
+    return AccountAnalytics(account_id=account_id, operations=len(quantity), instruments=instruments,
+                            totals=[CurrencyPnl(currency=ccy, **values) for ccy, values in sorted(totals.items())],
+                            sectors=exposures, currencies=currency_exposure, returns=returns)
+
+
+async def _returns(client: AsyncServices, store: CandleStore, columns: Dict[str, np.ndarray], codes: np.ndarray,
+                   buy: np.ndarray, trade: np.ndarray, payment: np.ndarray, figis: np.ndarray,
+                   currencies: np.ndarray, types: np.ndarray, current: np.ndarray, held: np.ndarray, cash: float,
+                   currency: str, days: int) -> AccountReturns:
+    start = (datetime.utcnow() - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    day = (columns["date"].astype("datetime64[D]") - np.datetime64(start.date(), "D")).astype(int)
+    rows = (day >= 0) & (columns["currency"] == currency)
+
+    # only instruments priced in the chosen currency are valued; others stay out of the account value
+    valued = np.flatnonzero((currencies == currency) & ~np.isnan(current))
+    column = np.full(len(figis), -1)
+    column[valued] = np.arange(len(valued))
+    moves = rows & trade & (column[codes] >= 0)
+    delta = np.where(buy, columns["quantity_done"], -columns["quantity_done"])
+    flow = np.where(np.isin(columns["type"], EXTERNAL_FLOW_TYPES), payment, 0.0)
+
+    candle_valued = np.isin(types[valued], CANDLE_VALUED_TYPES)
+    closes = await _closes(client, store, figis[valued].tolist(), candle_valued, current[valued], start, days)
+    values, twr = daily_values(day[moves], column[codes[moves]], delta[moves], day[rows], payment[rows], flow[rows],
+                               held[valued], cash, closes)
+    dates = np.datetime64(start.date(), "D") + np.arange(days)
+    annualized = None
+    if days > 1 and twr[-1] > -1:
+        annualized = float((1 + twr[-1]) ** (DAYS_PER_YEAR / (days - 1)) - 1)
+    return AccountReturns(currency=currency, date=dates.tolist(), value=values.tolist(), twr=twr.tolist(),
+                          total=float(twr[-1]), annualized=annualized)
@@ -0,0 +1,46 @@
+from datetime import datetime
+from typing import AsyncIterator, List
+
+from tinkoff.invest import GetOperationsByCursorRequest, OperationState, OperationType
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+from common.quotation import to_float
+from operations.schemas import OperationItem
+
+
+def parse_operation_types(names: List[str] | None) -> List[OperationType]:
+    types = list()
+    for name in names or []:
+        name = name.upper()
+        if not name.startswith("OPERATION_TYPE_"):
+            name = f"OPERATION_TYPE_{name}"
+        types.append(OperationType[name])
+    return types
+
+
+def operation_item(item) -> OperationItem:
+    return OperationItem.construct(cursor=item.cursor, id=item.id, parent_operation_id=item.parent_operation_id,
+                                   date=item.date, type=OperationType(item.type).name,
+                                   state=OperationState(item.state).name, description=item.description,
+                                   figi=item.figi, instrument_uid=item.instrument_uid,
+                                   instrument_type=item.instrument_type, currency=item.payment.currency,
+                                   payment=to_float(item.payment), price=to_float(item.price),
+                                   commission=to_float(item.commission), quantity=item.quantity,
+                                   quantity_done=item.quantity_done)
+
+
+def operations_request(account_id: str, from_: datetime, to: datetime, cursor: str = "",
+                       limit: int = config.OPERATIONS_PAGE_LIMIT, instrument_id: str = "",
+                       operation_types: List[OperationType] | None = None) -> GetOperationsByCursorRequest:
+    return GetOperationsByCursorRequest(account_id=account_id, instrument_id=instrument_id or "", from_=from_, to=to,
+                                        cursor=cursor or "", limit=limit, operation_types=operation_types or [])
+
+
+async def iter_operation_pages(client: AsyncServices, request: GetOperationsByCursorRequest) -> AsyncIterator:
+    while True:
+        page = await client.operations.get_operations_by_cursor(request)
+        yield page
+        if not page.has_next or not page.next_cursor:
+            return
+        request.cursor = page.next_cursor
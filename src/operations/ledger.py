@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import numpy as np
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, String, Table, and_, case, cast, func, select
+from tinkoff.invest import OperationState, OperationType
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+from common.database import engine, metadata, upsert
+from common.quotation import NANO, to_nano
+from operations.history import iter_operation_pages, operations_request
+from operations.schemas import Commission, LedgerOperation, LedgerSyncStatus, Turnover
+
+logger = logging.getLogger(__name__)
+
+BUY_TYPES = ("OPERATION_TYPE_BUY", "OPERATION_TYPE_BUY_CARD", "OPERATION_TYPE_BUY_MARGIN")
+SELL_TYPES = ("OPERATION_TYPE_SELL", "OPERATION_TYPE_SELL_CARD", "OPERATION_TYPE_SELL_MARGIN")
+
+ledger_operations = Table(
+    "ledger_operations", metadata,
+    Column("account_id", String, primary_key=True),
+    Column("id", String, primary_key=True),
+    Column("date", DateTime, nullable=False),
+    Column("type", String, nullable=False),
+    Column("state", String, nullable=False),
+    Column("description", String, nullable=False),
+    Column("figi", String, nullable=False),
+    Column("instrument_uid", String, nullable=False),
+    Column("instrument_type", String, nullable=False),
+    Column("currency", String, nullable=False),
+    Column("payment_nano", BigInteger, nullable=False),
+    Column("price_nano", BigInteger, nullable=False),
+    Column("commission_nano", BigInteger, nullable=False),
+    Column("quantity", Integer, nullable=False),
+    Column("quantity_done", Integer, nullable=False),
+    Index("ix_ledger_operations_date", "account_id", "date"),
+    Index("ix_ledger_operations_figi", "account_id", "figi", "date"),
+    Index("ix_ledger_operations_type", "account_id", "type", "date"),
+)
+
+ledger_sync_state = Table(
+    "ledger_sync_state", metadata,
+    Column("account_id", String, primary_key=True),
+    Column("synced_to", DateTime, nullable=False),
+)
+
+UPDATE_COLUMNS = ["date", "type", "state", "description", "figi", "instrument_uid", "instrument_type", "currency",
+                  "payment_nano", "price_nano", "commission_nano", "quantity", "quantity_done"]
+
+
+def _utc_naive(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _row(account_id: str, item) -> dict:
+    return {"account_id": account_id, "id": item.id, "date": _utc_naive(item.date),
+            "type": OperationType(item.type).name, "state": OperationState(item.state).name,
+            "description": item.description, "figi": item.figi, "instrument_uid": item.instrument_uid,
+            "instrument_type": item.instrument_type, "currency": item.payment.currency,
+            "payment_nano": to_nano(item.payment), "price_nano": to_nano(item.price),
+            "commission_nano": to_nano(item.commission), "quantity": item.quantity,
+            "quantity_done": item.quantity_done}
+
+
+class OperationsLedger:
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = dict()
+        self._tasks: Dict[str, asyncio.Task] = dict()
+        # account id -> (synced_to, columns); a sync moves synced_to, which invalidates the copy
+        self._columns: Dict[str, tuple] = dict()
+        # (token digest, account id) -> when the token was last seen holding the account
+        self._owners: Dict[tuple, float] = dict()
+
+    async def is_owner(self, client: AsyncServices, token: str, account_id: str) -> bool:
+        """Whether the account is one of the token's; ledger rows are only served to the account's owner."""
+        now = time.monotonic()
+        digest = hashlib.sha256(token.encode()).digest()
+        checked = self._owners.get((digest, account_id))
+        if checked is not None and now - checked < config.LEDGER_OWNER_TTL:
+            return True
+        accounts = (await client.users.get_accounts()).accounts
+        self._owners = {key: checked for key, checked in self._owners.items()
+                        if key[0] != digest and now - checked < config.LEDGER_OWNER_TTL}
+        for account in accounts:
+            self._owners[(digest, account.id)] = now
+        return (digest, account_id) in self._owners
+
+    async def synced_to(self, account_id: str) -> datetime | None:
+        async with engine.connect() as conn:
+            return (await conn.execute(select(ledger_sync_state.c.synced_to).where(
+                ledger_sync_state.c.account_id == account_id))).scalar()
+
+    async def sync(self, client: AsyncServices, account_id: str) -> int:
+        lock = self._locks.setdefault(account_id, asyncio.Lock())
+        async with lock:
+            started = datetime.utcnow()
+            synced_to = await self.synced_to(account_id)
+            if synced_to is None:
+                from_ = started - timedelta(days=config.LEDGER_INITIAL_DAYS)
+            else:
+                # re-read a short overlap so operations that changed state since the last run are updated
+                from_ = synced_to - timedelta(seconds=config.LEDGER_SYNC_OVERLAP)
+
+            request = operations_request(account_id, from_.replace(tzinfo=timezone.utc),
+                                         started.replace(tzinfo=timezone.utc))
+            count = 0
+            async for page in iter_operation_pages(client, request):
+                rows = [_row(account_id, item) for item in page.items]
+                if rows:
+                    async with engine.begin() as conn:
+                        await conn.execute(upsert(ledger_operations, ["account_id", "id"], UPDATE_COLUMNS), rows)
+                    count += len(rows)
+
+            async with engine.begin() as conn:
+                await conn.execute(upsert(ledger_sync_state, ["account_id"], ["synced_to"]),
+                                   [{"account_id": account_id, "synced_to": started}])
+            logger.info("Ledger for %s synced: %d operations since %s", account_id, count, from_)
+            return count
+
+    async def _sync_leased(self, client_pool, token: str, account_id: str) -> int:
+        # the request that started the sync releases its client when it returns, so the task leases its own
+        async with client_pool.lease(token) as client:
+            return await self.sync(client, account_id)
+
+    def sync_in_background(self, client_pool, token: str, account_id: str) -> bool:
+        task = self._tasks.get(account_id)
+        if task is not None and not task.done():
+            return False
+        task = self._tasks[account_id] = asyncio.create_task(self._sync_leased(client_pool, token, account_id))
+        task.add_done_callback(self._log_failure)
+        return True
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Ledger sync failed", exc_info=task.exception())
+
+    async def ensure_fresh(self, client_pool, token: str, account_id: str) -> datetime | None:
+        synced_to = await self.synced_to(account_id)
+        if synced_to is None or datetime.utcnow() - synced_to > timedelta(seconds=config.LEDGER_SYNC_INTERVAL):
+            self.sync_in_background(client_pool, token, account_id)
+        return synced_to
+
+    async def status(self, account_id: str) -> LedgerSyncStatus:
+        task = self._tasks.get(account_id)
+        async with engine.connect() as conn:
+            count = (await conn.execute(select(func.count()).select_from(ledger_operations).where(
+                ledger_operations.c.account_id == account_id))).scalar()
+        return LedgerSyncStatus(account_id=account_id, synced_to=await self.synced_to(account_id), operations=count,
+                                running=task is not None and not task.done())
+
+    @staticmethod
+    def _filters(account_id: str, from_: datetime | None, to: datetime | None, figi: str | None = None,
+                 types: List[str] | None = None) -> list:
+        table = ledger_operations
+        filters = [table.c.account_id == account_id]
+        if from_ is not None:
+            filters.append(table.c.date >= _utc_naive(from_))
+        if to is not None:
+            filters.append(table.c.date < _utc_naive(to))
+        if figi:
+            filters.append(table.c.figi == figi)
+        if types:
+            filters.append(table.c.type.in_(types))
+        return filters
+
+    async def operations(self, account_id: str, from_: datetime | None = None, to: datetime | None = None,
+                         figi: str | None = None, types: List[str] | None = None, limit: int | None = None,
+                         offset: int = 0) -> List[LedgerOperation]:
+        table = ledger_operations
+        query = (select(table).where(and_(*self._filters(account_id, from_, to, figi, types)))
+                 .order_by(table.c.date.desc()).offset(offset))
+        if limit is not None:
+            query = query.limit(limit)
+        async with engine.connect() as conn:
+            rows = (await conn.execute(query)).all()
+        # rows come typed from our own table, so the models skip validation
+        return [LedgerOperation.construct(id=row.id, date=row.date.replace(tzinfo=timezone.utc), type=row.type,
+                                          state=row.state, description=row.description, figi=row.figi,
+                                          instrument_uid=row.instrument_uid, instrument_type=row.instrument_type,
+                                          currency=row.currency, payment=row.payment_nano / NANO,
+                                          price=row.price_nano / NANO, commission=row.commission_nano / NANO,
+                                          quantity=row.quantity, quantity_done=row.quantity_done)
+                for row in rows]
+
+    async def columns(self, account_id: str) -> Dict[str, np.ndarray]:
+        """Executed operations in date order as arrays, for analytics over the whole history."""
+        synced_to = await self.synced_to(account_id)
+        cached = self._columns.get(account_id)
+        if cached is not None and cached[0] == synced_to:
+            return cached[1]
+        table = ledger_operations
+        # dates come back as text and are parsed by numpy in one go, far faster than row by row
+        query = (select(cast(table.c.date, String), table.c.type, table.c.figi, table.c.instrument_type,
+                        table.c.currency, table.c.payment_nano, table.c.commission_nano, table.c.quantity_done)
+                 .where(table.c.account_id == account_id, table.c.state == "OPERATION_STATE_EXECUTED")
+                 .order_by(table.c.date))
+        async with engine.connect() as conn:
+            rows = (await conn.execute(query)).all()
+        values = list(zip(*rows)) if rows else [()] * 8
+        columns = {"date": np.array(values[0], dtype="datetime64[us]")}
+        for name, column in zip(("type", "figi", "instrument_type", "currency"), values[1:5]):
+            columns[name] = np.array(column, dtype=object)
+        for name, column in zip(("payment_nano", "commission_nano", "quantity_done"), values[5:]):
+            columns[name] = np.array(column, dtype=np.int64)
+        self._columns[account_id] = (synced_to, columns)
+        return columns
+
+    async def turnover(self, account_id: str, from_: datetime | None = None, to: datetime | None = None,
+                       figi: str | None = None) -> List[Turnover]:
+        table = ledger_operations
+        is_buy, is_sell = table.c.type.in_(BUY_TYPES), table.c.type.in_(SELL_TYPES)
+        query = (select(table.c.figi, table.c.currency,
+                        func.sum(case((is_buy, -table.c.payment_nano), else_=0)).label("buy_amount"),
+                        func.sum(case((is_sell, table.c.payment_nano), else_=0)).label("sell_amount"),
+                        func.sum(case((is_buy, table.c.quantity_done), else_=0)).label("buy_quantity"),
+                        func.sum(case((is_sell, table.c.quantity_done), else_=0)).label("sell_quantity"),
+                        func.count().label("operations"))
+                 .where(and_(*self._filters(account_id, from_, to, figi, list(BUY_TYPES + SELL_TYPES))))
+                 .group_by(table.c.figi, table.c.currency)
+                 .order_by(table.c.figi))
+        async with engine.connect() as conn:
+            rows = (await conn.execute(query)).all()
+        return [Turnover(figi=row.figi, currency=row.currency, buy_amount=row.buy_amount / NANO,
+                         sell_amount=row.sell_amount / NANO, buy_quantity=row.buy_quantity,
+                         sell_quantity=row.sell_quantity, operations=row.operations)
+                for row in rows]
+
+    async def commissions(self, account_id: str, from_: datetime | None = None,
+                          to: datetime | None = None) -> List[Commission]:
+        table = ledger_operations
+        query = (select(table.c.currency, func.sum(table.c.commission_nano).label("amount"),
+                        func.count().label("operations"))
+                 .where(and_(table.c.commission_nano != 0, *self._filters(account_id, from_, to)))
+                 .group_by(table.c.currency))
+        async with engine.connect() as conn:
+            rows = (await conn.execute(query)).all()
+        return [Commission(currency=row.currency, amount=row.amount / NANO, operations=row.operations)
+                for row in rows]
+
+    async def close(self):
+        for task in self._tasks.values():
+            task.cancel()
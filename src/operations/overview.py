@@ -0,0 +1,91 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, List
+
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+from common.money import Money
+from common.quotation import to_float
+from operations.schemas import (
+    AccountOverview,
+    AccountsOverview,
+    CurrencyAmount,
+    CurrencyTotals,
+    PositionsSecurities
+)
+
+PORTFOLIO_TOTALS = ("total_amount_shares", "total_amount_bonds", "total_amount_etf", "total_amount_currencies",
+                    "total_amount_futures")
+
+
+def by_currency(values) -> Dict[str, Money]:
+    amounts: Dict[str, Money] = defaultdict(Money)
+    for value in values:
+        if value is not None and value.currency:
+            currency = value.currency.lower()
+            amounts[currency] = amounts[currency] + Money(value.units, value.nano)
+    return amounts
+
+
+def currency_amounts(amounts: Dict[str, Money]) -> List[CurrencyAmount]:
+    return [CurrencyAmount(currency=currency, amount=float(amount)) for currency, amount in sorted(amounts.items())]
+
+
+async def accounts_overview(client: AsyncServices,
+                            concurrency: int = config.ACCOUNTS_FANOUT_CONCURRENCY) -> AccountsOverview:
+    accounts = (await client.users.get_accounts()).accounts
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(method, account_id: str):
+        async with semaphore:
+            return await method(account_id=account_id)
+
+    calls = list()
+    for account in accounts:
+        calls.append(call(client.operations.get_portfolio, account.id))
+        calls.append(call(client.operations.get_positions, account.id))
+        calls.append(call(client.operations.get_withdraw_limits, account.id))
+    results = await asyncio.gather(*calls, return_exceptions=True)
+
+    totals = defaultdict(lambda: defaultdict(Money))
+    response = list()
+    for i, account in enumerate(accounts):
+        portfolio, positions, withdraw = results[3 * i:3 * i + 3]
+        overview = AccountOverview(account_id=account.id, name=account.name)
+
+        if isinstance(portfolio, Exception):
+            overview.errors.append(f"portfolio: {portfolio}")
+        else:
+            amounts = by_currency(getattr(portfolio, name, None) for name in PORTFOLIO_TOTALS)
+            overview.portfolio = currency_amounts(amounts)
+            overview.expected_yield = to_float(portfolio.expected_yield)
+            for currency, amount in amounts.items():
+                totals[currency]["portfolio"] += amount
+
+        if isinstance(positions, Exception):
+            overview.errors.append(f"positions: {positions}")
+        else:
+            money, blocked = by_currency(positions.money), by_currency(positions.blocked)
+            overview.money, overview.blocked = currency_amounts(money), currency_amounts(blocked)
+            overview.securities = [PositionsSecurities(figi=sec.figi, blocked_position=sec.blocked, balance=sec.balance)
+                                   for sec in positions.securities]
+            for currency, amount in money.items():
+                totals[currency]["money"] += amount
+            for currency, amount in blocked.items():
+                totals[currency]["blocked"] += amount
+
+        if isinstance(withdraw, Exception):
+            overview.errors.append(f"withdraw_limits: {withdraw}")
+        else:
+            limits = by_currency(withdraw.money)
+            overview.withdraw_limit = currency_amounts(limits)
+            for currency, amount in limits.items():
+                totals[currency]["withdraw_limit"] += amount
+
+        response.append(overview)
+
+    return AccountsOverview(accounts=response, totals=[
+        CurrencyTotals(currency=currency, portfolio=float(amounts["portfolio"]), money=float(amounts["money"]),
+                       blocked=float(amounts["blocked"]), withdraw_limit=float(amounts["withdraw_limit"]))
+        for currency, amounts in sorted(totals.items())])
@@ -1,17 +1,33 @@
+import asyncio
 import time
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from fastapi.responses import StreamingResponse
 from operations.schemas import *
 
 from tinkoff.invest import (
     AccessLevel,
     AccountStatus,
     AccountType,
-    Client,
     InstrumentIdType,
+    OperationType,
     TradeDirection,
     GenerateBrokerReportRequest
 )
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+from common.cache import cached
+from common.dependencies import get_candle_store, get_catalog, get_client, get_client_pool, get_ledger, get_market_hubs
+from common.quotation import to_float
+from common.responses import ResponseFormat, dumps, fast_response
+from instruments.catalog import InstrumentCatalog
+from market_data.candles import CandleStore
+from market_data.hub import MarketDataHubs
+from operations.analytics import account_analytics
+from operations.history import iter_operation_pages, operation_item, operations_request, parse_operation_types
+from operations.ledger import OperationsLedger
+from operations.overview import accounts_overview, by_currency, currency_amounts
 
 router = APIRouter(
     prefix='/operation_market',
@@ -20,133 +36,303 @@ router = APIRouter(
 
 
 @router.get("/operations", response_model=List[AccountOperation])
-def get_operations(token: str | None = Header(default=None),
-                   account_id: str | None = Header(default=None)):
+async def get_operations(format: str = ResponseFormat, client: AsyncServices = Depends(get_client),
+                         account_id: str | None = Header(default=None), token: str | None = Header(default=None),
+                         ledger: OperationsLedger = Depends(get_ledger), client_pool=Depends(get_client_pool)):
     from_ = datetime.now() - timedelta(days=365)
     to = datetime.now()
-    with Client(token=token, app_name="islam") as client:
-        operations = client.operations.get_operations(account_id=account_id, from_=from_, to=to).operations
+    # accounts of other tokens are left to the broker to refuse
+    if account_id and await ledger.is_owner(client, token, account_id) \
+            and await ledger.ensure_fresh(client_pool, token, account_id) is not None:
+        response = [AccountOperation.construct(currency=oper.currency, date=oper.date, id=oper.id,
+                                               instrument_type=oper.instrument_type, payment=oper.payment,
+                                               price=oper.price, quantity=oper.quantity, type=oper.type)
+                    for oper in await ledger.operations(account_id, from_=from_, to=to)]
+        return fast_response(response, format, AccountOperation)
+
+    operations = (await client.operations.get_operations(account_id=account_id, from_=from_, to=to)).operations
+
+    response = list()
+    for oper in operations:
+        payment_val = to_float(oper.payment)
+        price_val = to_float(oper.price)
+        oper_data = AccountOperation.construct(currency=oper.currency, date=oper.date, id=oper.id,
+                                               instrument_type=oper.instrument_type, payment=payment_val,
+                                               price=price_val, quantity=oper.quantity,
+                                               type=OperationType(oper.operation_type).name)
+        response.append(oper_data)
+    return fast_response(response, format, AccountOperation)
+
+
+def _require_account(account_id: str | None) -> str:
+    if not account_id:
+        raise HTTPException(status_code=400, detail="account_id header is required")
+    return account_id
+
+
+async def owned_account(client: AsyncServices = Depends(get_client), account_id: str | None = Header(default=None),
+                        token: str | None = Header(default=None),
+                        ledger: OperationsLedger = Depends(get_ledger)) -> str:
+    account_id = _require_account(account_id)
+    if not await ledger.is_owner(client, token, account_id):
+        raise HTTPException(status_code=403, detail="The account does not belong to this token")
+    return account_id
+
+
+def _history_request(account_id: str | None, from_: datetime | None, to: datetime | None, cursor: str, limit: int,
+                     instrument_id: str, operation_type: List[str] | None):
+    account_id = _require_account(account_id)
+    try:
+        operation_types = parse_operation_types(operation_type)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown operation type {e}")
+    to = to or datetime.utcnow()
+    from_ = from_ or to - timedelta(days=365)
+    return operations_request(account_id, from_, to, cursor=cursor, limit=limit, instrument_id=instrument_id,
+                              operation_types=operation_types)
+
+
+@router.get("/operations/cursor", response_model=OperationsPage)
+async def get_operations_page(from_: datetime | None = Query(default=None, alias="from"), to: datetime | None = None,
+                              cursor: str = "", limit: int = Query(default=100, gt=0, le=1000),
+                              instrument_id: str = "", operation_type: List[str] | None = Query(default=None),
+                              client: AsyncServices = Depends(get_client),
+                              account_id: str | None = Header(default=None)):
+    request = _history_request(account_id, from_, to, cursor, limit, instrument_id, operation_type)
+    page = await client.operations.get_operations_by_cursor(request)
+    return fast_response(OperationsPage.construct(items=[operation_item(item) for item in page.items],
+                                                  next_cursor=page.next_cursor, has_next=page.has_next))
+
+
+@router.get("/operations/stream")
+async def stream_operations(from_: datetime | None = Query(default=None, alias="from"), to: datetime | None = None,
+                            instrument_id: str = "", operation_type: List[str] | None = Query(default=None),
+                            client: AsyncServices = Depends(get_client),
+                            account_id: str | None = Header(default=None)):
+    request = _history_request(account_id, from_, to, "", config.OPERATIONS_PAGE_LIMIT, instrument_id,
+                               operation_type)
+
+    async def lines():
+        async for page in iter_operation_pages(client, request):
+            yield b"".join(dumps(operation_item(item)) + b"\n" for item in page.items)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/ledger/sync", response_model=LedgerSyncStatus)
+async def sync_ledger(account_id: str = Depends(owned_account), token: str | None = Header(default=None),
+                      ledger: OperationsLedger = Depends(get_ledger), client_pool=Depends(get_client_pool)):
+    ledger.sync_in_background(client_pool, token, account_id)
+    return await ledger.status(account_id)
+
+
+@router.get("/ledger/status", response_model=LedgerSyncStatus)
+async def get_ledger_status(account_id: str = Depends(owned_account), ledger: OperationsLedger = Depends(get_ledger)):
+    return await ledger.status(account_id)
+
+
+@router.get("/ledger/operations", response_model=List[LedgerOperation])
+async def get_ledger_operations(from_: datetime | None = Query(default=None, alias="from"), to: datetime | None = None,
+                                figi: str | None = None, operation_type: List[str] | None = Query(default=None),
+                                limit: int = Query(default=1000, gt=0, le=100000), offset: int = Query(default=0, ge=0),
+                                format: str = ResponseFormat, account_id: str = Depends(owned_account),
+                                token: str | None = Header(default=None),
+                                ledger: OperationsLedger = Depends(get_ledger), client_pool=Depends(get_client_pool)):
+    try:
+        types = [t.name for t in parse_operation_types(operation_type)]
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown operation type {e}")
+    await ledger.ensure_fresh(client_pool, token, account_id)
+    operations = await ledger.operations(account_id, from_=from_, to=to, figi=figi, types=types, limit=limit,
+                                         offset=offset)
+    return fast_response(operations, format, LedgerOperation)
+
+
+@router.get("/ledger/turnover", response_model=List[Turnover])
+async def get_ledger_turnover(from_: datetime | None = Query(default=None, alias="from"), to: datetime | None = None,
+                              figi: str | None = None, account_id: str = Depends(owned_account),
+                              token: str | None = Header(default=None), ledger: OperationsLedger = Depends(get_ledger),
+                              client_pool=Depends(get_client_pool)):
+    await ledger.ensure_fresh(client_pool, token, account_id)
+    return await ledger.turnover(account_id, from_=from_, to=to, figi=figi)
+
 
-        response = list()
-        for oper in operations:
-            payment_val = float(f'{abs(oper.payment.units)}.{abs(oper.payment.nano)}')
-            price_val = float(f'{abs(oper.price.units)}.{abs(oper.price.nano)}')
-            oper_data = AccountOperation(currency=oper.currency, date=oper.date, id=oper.id,
-                                         instrument_type=oper.instrument_type, payment=payment_val,
-                                         price=price_val, quantity=oper.quantity, type=oper.type)
-            response.append(oper_data)
-        return response
+@router.get("/ledger/commissions", response_model=List[Commission])
+async def get_ledger_commissions(from_: datetime | None = Query(default=None, alias="from"), to: datetime | None = None,
+                                 account_id: str = Depends(owned_account), token: str | None = Header(default=None),
+                                 ledger: OperationsLedger = Depends(get_ledger),
+                                 client_pool=Depends(get_client_pool)):
+    await ledger.ensure_fresh(client_pool, token, account_id)
+    return await ledger.commissions(account_id, from_=from_, to=to)
+
+
+@router.get("/analytics", response_model=AccountAnalytics)
+async def get_analytics(currency: str = config.ANALYTICS_BASE_CURRENCY,
+                        days: int = Query(default=config.ANALYTICS_RETURNS_DAYS, gt=1, le=10 * 365),
+                        client: AsyncServices = Depends(get_client), account_id: str = Depends(owned_account),
+                        token: str | None = Header(default=None), ledger: OperationsLedger = Depends(get_ledger),
+                        client_pool=Depends(get_client_pool),
+                        catalog: InstrumentCatalog = Depends(get_catalog),
+                        store: CandleStore = Depends(get_candle_store)):
+    # P&L needs the full history, so the first request waits for the initial sync
+    if await ledger.synced_to(account_id) is None:
+        await ledger.sync(client, account_id)
+    else:
+        await ledger.ensure_fresh(client_pool, token, account_id)
+    return await account_analytics(client, ledger, catalog, store, account_id, currency.lower(), days)
 
 
 @router.get("/portfolio", response_model=AccountPortfolio)
-def get_portfolio(token: str | None = Header(default=None),
-                  account_id: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        portfolio = client.operations.get_portfolio(account_id=account_id)
-        total_amount_shares = float(
-            f'{abs(portfolio.total_amount_shares.units)}.{abs(portfolio.total_amount_shares.nano)}')
-        total_amount_currencies = float(
-            f'{abs(portfolio.total_amount_currencies.units)}.{abs(portfolio.total_amount_currencies.nano)}')
-        expected_yield = float(f'{abs(portfolio.expected_yield.units)}.{abs(portfolio.expected_yield.nano)}')
+async def get_portfolio(client: AsyncServices = Depends(get_client),
+                        account_id: str | None = Header(default=None)):
+    portfolio = await client.operations.get_portfolio(account_id=account_id)
+    total_amount_shares = to_float(portfolio.total_amount_shares)
+    total_amount_currencies = to_float(portfolio.total_amount_currencies)
+    expected_yield = to_float(portfolio.expected_yield)
 
-        return AccountPortfolio(total_amount_shares=total_amount_shares,
-                                total_amount_currencies=total_amount_currencies, expected_yield=expected_yield)
+    return AccountPortfolio(total_amount_shares=total_amount_shares,
+                            total_amount_currencies=total_amount_currencies, expected_yield=expected_yield)
+
+
+@router.get("/accounts_overview", response_model=AccountsOverview)
+async def get_accounts_overview(client: AsyncServices = Depends(get_client)):
+    return await accounts_overview(client)
 
 
 @router.get("/positions", response_model=AccountPositions)
-def get_positions(token: str | None = Header(default=None),
-                  account_id: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        securities = list()
-        positions = client.operations.get_positions(account_id=account_id)
-        for sec in positions.securities:
-            sec_data = PositionsSecurities(figi=sec.figi, blocked_position=sec.blocked, balance=sec.balance)
-            securities.append(sec_data)
-        money = float(f'{abs(positions.money.units)}.{abs(positions.money.nano)}')
-        blocked = float(f'{abs(positions.blocked.units)}.{abs(positions.blocked.nano)}')
-        return AccountPositions(money=money, blocked=blocked, securities=securities)
+async def get_positions(client: AsyncServices = Depends(get_client),
+                        account_id: str | None = Header(default=None)):
+    securities = list()
+    positions = await client.operations.get_positions(account_id=account_id)
+    for sec in positions.securities:
+        sec_data = PositionsSecurities(figi=sec.figi, blocked_position=sec.blocked, balance=sec.balance)
+        securities.append(sec_data)
+    money = currency_amounts(by_currency(positions.money))
+    blocked = currency_amounts(by_currency(positions.blocked))
+    return AccountPositions(money=money, blocked=blocked, securities=securities)
 
 
 @router.get("/broker_report", response_model=str)
-def get_broker_report(token: str | None = Header(default=None),
-                      account_id: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        from_ = datetime.now() - timedelta(days=365)
-        to = datetime.now()
-        request = GenerateBrokerReportRequest(account_id=account_id, from_=from_, to=to)
-        report = client.operations.get_broker_report(generate_broker_report_request=request)
-        return report.generate_broker_report_response.task_id
+async def get_broker_report(client: AsyncServices = Depends(get_client),
+                            account_id: str | None = Header(default=None)):
+    from_ = datetime.now() - timedelta(days=365)
+    to = datetime.now()
+    request = GenerateBrokerReportRequest(account_id=account_id, from_=from_, to=to)
+    report = await client.operations.get_broker_report(generate_broker_report_request=request)
+    return report.generate_broker_report_response.task_id
 
 
 @router.get("/withdraw_limits", response_model=WithdrawLimits)
-def get_withdraw_limits(token: str | None = Header(default=None),
-                        account_id: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        withdraw = client.operations.get_withdraw_limits(account_id=account_id)
-        money = float(f'{abs(withdraw.money.units)}.{abs(withdraw.money.nano)}')
-        blocked = float(f'{abs(withdraw.blocked.units)}.{abs(withdraw.blocked.nano)}')
-        return WithdrawLimits(money=money, blocked=blocked)
+async def get_withdraw_limits(client: AsyncServices = Depends(get_client),
+                              account_id: str | None = Header(default=None)):
+    withdraw = await client.operations.get_withdraw_limits(account_id=account_id)
+    money = currency_amounts(by_currency(withdraw.money))
+    blocked = currency_amounts(by_currency(withdraw.blocked))
+    return WithdrawLimits(money=money, blocked=blocked)
 
 
-@router.get("/candles")
-def get_candles():
-    pass
+@router.get("/candles", response_model=Candles)
+async def get_candles(figi: str, interval: str, from_: datetime = Query(alias="from"), to: datetime | None = None,
+                      client: AsyncServices = Depends(get_client), store: CandleStore = Depends(get_candle_store)):
+    try:
+        columns = await store.get(client, figi, interval, from_, to or datetime.utcnow())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Candles(figi=figi, interval=interval, **columns)
 
 
 @router.get("/last_prices", response_model=List[LastPrice])
-def get_last_prices(figi: str, token: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        last_prices = client.market_data.get_last_prices(figi=[figi])
+@cached("last_prices")
+async def get_last_prices(figi: str, client: AsyncServices = Depends(get_client),
+                          token: str | None = Header(default=None), hubs: MarketDataHubs = Depends(get_market_hubs)):
+    hub = hubs.find(token)
+    state = hub.get(figi) if hub is not None else None
+    if state is not None and state.last_price is not None:
+        return [LastPrice(figi=figi, price=state.last_price, time=state.last_price_time)]
+
+    last_prices = await client.market_data.get_last_prices(figi=[figi])
+
+    response = list()
+    for last in last_prices.last_prices:
+        price = to_float(last.price)
+        last_price_data = LastPrice(figi=last.figi, price=price, time=last.time)
+        response.append(last_price_data)
+    return response
+
 
-        response = list()
-        for last in last_prices.last_prices:
-            price = float(f'{abs(last.price.units)}.{abs(last.price.nano)}')
-            last_price_data = LastPrice(figi=last.figi, price=price, time=last.time)
-            response.append(last_price_data)
-        return response
+async def _fetch_last_prices(client: AsyncServices, figis: List[str]) -> LastPricesColumns:
+    figis = list(dict.fromkeys(figis))
+    chunk_size = config.LAST_PRICES_CHUNK_SIZE
+    semaphore = asyncio.Semaphore(config.LAST_PRICES_CONCURRENCY)
+
+    async def fetch_chunk(chunk: List[str]):
+        async with semaphore:
+            return (await client.market_data.get_last_prices(figi=chunk)).last_prices
+
+    chunks = await asyncio.gather(*(fetch_chunk(figis[i:i + chunk_size]) for i in range(0, len(figis), chunk_size)))
+
+    response = LastPricesColumns(figi=list(), price=list(), time=list())
+    for chunk in chunks:
+        for last in chunk:
+            response.figi.append(last.figi)
+            response.price.append(to_float(last.price))
+            response.time.append(last.time)
+    return response
+
+
+@router.get("/last_prices/batch", response_model=LastPricesColumns)
+@cached("last_prices")
+async def get_last_prices_batch(figi: List[str] = Query(), client: AsyncServices = Depends(get_client)):
+    return await _fetch_last_prices(client, figi)
+
+
+@router.post("/last_prices/batch", response_model=LastPricesColumns)
+async def post_last_prices_batch(request: LastPricesRequest, client: AsyncServices = Depends(get_client)):
+    return await _fetch_last_prices(client, request.figi)
 
 
 @router.get("/close_prices", response_model=List[Trade])
-def get_close_prices(figi: str, token: str | None = Header(default=None)):
+@cached("close_prices")
+async def get_close_prices(figi: str, client: AsyncServices = Depends(get_client)):
     direction = {TradeDirection.TRADE_DIRECTION_BUY: "Buy",
                  TradeDirection.TRADE_DIRECTION_SELL: "Sell",
                  TradeDirection.TRADE_DIRECTION_UNSPECIFIED: "Unspecified"}
-    with Client(token=token, app_name="islam") as client:
-        from_ = datetime.now() - timedelta(minutes=30)
-        to = datetime.now()
-        trades = client.market_data.get_last_trades(figi=figi, from_=from_, to=to).trades
+    from_ = datetime.now() - timedelta(minutes=30)
+    to = datetime.now()
+    trades = (await client.market_data.get_last_trades(figi=figi, from_=from_, to=to)).trades
 
-        response = list()
-        for trade in trades:
-            price = float(f'{abs(trade.price.units)}.{abs(trade.price.nano)}')
-            trade_data = Trade(figi=trade.figi, direction=direction.get(trade.direction), price=price,
-                               quantity=trade.quantity, time=trade.time)
-            response.append(trade_data)
-        return response
+    response = list()
+    for trade in trades:
+        price = to_float(trade.price)
+        trade_data = Trade(figi=trade.figi, direction=direction.get(trade.direction), price=price,
+                           quantity=trade.quantity, time=trade.time)
+        response.append(trade_data)
+    return response
 
 
 @router.get("/order_book", response_model=OrderBook)
-def get_order_book(figi: str, depth: int, token: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        order_book = client.market_data.get_order_book(figi=figi, depth=depth)
-        bids, asks = list(), list()
-
-        for bid in order_book.bids:
-            price = float(f'{abs(bid.price.units)}.{abs(bid.price.nano)}')
-            bid_data = Order(price=price, quantity=bid.quantity)
-            bids.append(bid_data)
-
-        for ask in order_book.asks:
-            price = float(f'{abs(ask.price.units)}.{abs(ask.price.nano)}')
-            ask_data = Order(price=price, quantity=ask.quantity)
-            asks.append(ask_data)
-
-        last_price = float(f'{abs(order_book.last_price.price.units)}.{abs(order_book.last_price.price.nano)}')
-        close_price = float(f'{abs(order_book.close_price.price.units)}.{abs(order_book.close_price.price.nano)}')
-        limit_up = float(f'{abs(order_book.limit_up.price.units)}.{abs(order_book.limit_up.price.nano)}')
-        limit_down = float(f'{abs(order_book.limit_down.price.units)}.{abs(order_book.limit_down.price.nano)}')
-
-        return OrderBook(figi=order_book.figi, depth=order_book.depth, bids=bids, asks=asks, last_price=last_price,
-                         close_price=close_price, limit_up=limit_up, limit_down=limit_down)
+@cached("order_book")
+async def get_order_book(figi: str, depth: int, client: AsyncServices = Depends(get_client),
+                         token: str | None = Header(default=None), hubs: MarketDataHubs = Depends(get_market_hubs)):
+    hub = hubs.find(token)
+    state = hub.get(figi) if hub is not None else None
+    if state is not None and state.has_book and state.last_price is not None and depth <= state.depth:
+        book = state.book
+        return OrderBook(figi=figi, depth=depth,
+                         bids=[Order(price=price, quantity=quantity) for price, quantity in book.bids.levels(depth)],
+                         asks=[Order(price=price, quantity=quantity) for price, quantity in book.asks.levels(depth)],
+                         last_price=state.last_price, limit_up=state.limit_up, limit_down=state.limit_down)
+
+    order_book = await client.market_data.get_order_book(figi=figi, depth=depth)
+    bids = [Order(price=to_float(bid.price), quantity=bid.quantity) for bid in order_book.bids]
+    asks = [Order(price=to_float(ask.price), quantity=ask.quantity) for ask in order_book.asks]
+
+    last_price = to_float(order_book.last_price)
+    close_price = to_float(order_book.close_price)
+    limit_up = to_float(order_book.limit_up)
+    limit_down = to_float(order_book.limit_down)
+
+    return OrderBook(figi=order_book.figi, depth=order_book.depth, bids=bids, asks=asks, last_price=last_price,
+                     close_price=close_price, limit_up=limit_up, limit_down=limit_down)
 
 
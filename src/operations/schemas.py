@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 from typing import List, Optional
 from pydantic import BaseModel
@@ -27,15 +27,20 @@ class PositionsSecurities(BaseModel):
     balance: int
 
 
+class CurrencyAmount(BaseModel):
+    currency: str
+    amount: float
+
+
 class AccountPositions(BaseModel):
-    money: float
-    blocked: float
+    money: List[CurrencyAmount]
+    blocked: List[CurrencyAmount]
     securities: List[PositionsSecurities]
 
 
 class WithdrawLimits(BaseModel):
-    money: float
-    blocked: float
+    money: List[CurrencyAmount]
+    blocked: List[CurrencyAmount]
 
 
 class LastPrice(BaseModel):
@@ -63,6 +68,180 @@ class OrderBook(BaseModel):
     bids: List[Order]
     asks: List[Order]
     last_price: float
-    close_price: float
+    close_price: Optional[float] = None
     limit_up: float
     limit_down: float
+
+
+class LastPricesRequest(BaseModel):
+    figi: List[str]
+
+
+class LastPricesColumns(BaseModel):
+    figi: List[str]
+    price: List[float]
+    time: List[datetime]
+
+
+class Candles(BaseModel):
+    figi: str
+    interval: str
+    time: List[datetime]
+    open: List[float]
+    high: List[float]
+    low: List[float]
+    close: List[float]
+    volume: List[int]
+
+
+class OperationItem(BaseModel):
+    cursor: str
+    id: str
+    parent_operation_id: str
+    date: datetime
+    type: str
+    state: str
+    description: str
+    figi: str
+    instrument_uid: str
+    instrument_type: str
+    currency: str
+    payment: float
+    price: float
+    commission: float
+    quantity: int
+    quantity_done: int
+
+
+class OperationsPage(BaseModel):
+    items: List[OperationItem]
+    next_cursor: str
+    has_next: bool
+
+
+class LedgerOperation(BaseModel):
+    id: str
+    date: datetime
+    type: str
+    state: str
+    description: str
+    figi: str
+    instrument_uid: str
+    instrument_type: str
+    currency: str
+    payment: float
+    price: float
+    commission: float
+    quantity: int
+    quantity_done: int
+
+
+class LedgerSyncStatus(BaseModel):
+    account_id: str
+    synced_to: Optional[datetime] = None
+    operations: int
+    running: bool
+
+
+class Turnover(BaseModel):
+    figi: str
+    currency: str
+    buy_amount: float
+    sell_amount: float
+    buy_quantity: int
+    sell_quantity: int
+    operations: int
+
+
+class Commission(BaseModel):
+    currency: str
+    amount: float
+    operations: int
+
+
+class AccountOverview(BaseModel):
+    account_id: str
+    name: str
+    portfolio: List[CurrencyAmount] = []
+    expected_yield: Optional[float] = None
+    money: List[CurrencyAmount] = []
+    blocked: List[CurrencyAmount] = []
+    withdraw_limit: List[CurrencyAmount] = []
+    securities: List[PositionsSecurities] = []
+    errors: List[str] = []
+
+
+class CurrencyTotals(BaseModel):
+    currency: str
+    portfolio: float
+    money: float
+    blocked: float
+    withdraw_limit: float
+
+
+class AccountsOverview(BaseModel):
+    accounts: List[AccountOverview]
+    totals: List[CurrencyTotals]
+
+
+class InstrumentAnalytics(BaseModel):
+    figi: str
+    ticker: Optional[str] = None
+    name: Optional[str] = None
+    instrument_type: str
+    sector: Optional[str] = None
+    currency: str
+    quantity: float
+    # FIFO basis from the ledger; the broker's when the ledger does not reach back to the position's opening
+    cost_basis: Optional[float] = None
+    average_price: Optional[float] = None
+    price: Optional[float] = None
+    market_value: Optional[float] = None
+    realized_pnl: float
+    unrealized_pnl: Optional[float] = None
+    income: float
+    commission: float
+    operations: int
+    complete: bool
+
+
+class CurrencyPnl(BaseModel):
+    currency: str
+    realized_pnl: float
+    unrealized_pnl: float
+    income: float
+    commission: float
+    market_value: float
+
+
+class Exposure(BaseModel):
+    key: str
+    currency: str
+    value: float
+    weight: Optional[float]
+
+
+class CurrencyExposure(BaseModel):
+    currency: str
+    securities: float
+    cash: float
+    total: float
+
+
+class AccountReturns(BaseModel):
+    currency: str
+    date: List[date]
+    value: List[float]
+    twr: List[float]
+    total: float
+    annualized: Optional[float] = None
+
+
+class AccountAnalytics(BaseModel):
+    account_id: str
+    operations: int
+    instruments: List[InstrumentAnalytics]
+    totals: List[CurrencyPnl]
+    sectors: List[Exposure]
+    currencies: List[CurrencyExposure]
+    returns: AccountReturns
@@ -0,0 +1,136 @@
+import asyncio
+import uuid
+from typing import List
+
+from tinkoff.invest import OrderExecutionReportStatus, OrderType, Quotation, TradeDirection
+from tinkoff.invest.async_services import AsyncServices
+from tinkoff.invest.exceptions import RequestError
+
+from common import config
+from common.call_policy import BrokerUnavailable, http_status
+from common.quotation import to_quotation
+from orders.schemas import (
+    BulkCancelResponse,
+    BulkCancelResult,
+    BulkItemError,
+    BulkOrder,
+    BulkOrderResult,
+    BulkOrdersResponse
+)
+
+DIRECTIONS = {"Buy": TradeDirection.TRADE_DIRECTION_BUY,
+              "Sell": TradeDirection.TRADE_DIRECTION_SELL}
+ORDER_TYPES = {"Limit": OrderType.ORDER_TYPE_LIMIT,
+               "Market": OrderType.ORDER_TYPE_MARKET}
+
+ORDER_ID_NAMESPACE = uuid.UUID("6f1c3a4e-2b7d-4c1e-9a55-0d3f8e2b7c61")
+
+
+def order_id_for(account_id: str, batch_id: str, index: int, order: BulkOrder) -> str:
+    # the broker deduplicates by order_id, so resending a batch cannot double-submit
+    return str(uuid.uuid5(ORDER_ID_NAMESPACE, f"{account_id}|{batch_id}|{index}|{order.figi}|{order.direction}|"
+                                              f"{order.quantity}|{order.price}|{order.order_type}"))
+
+
+def validate_orders(orders: List[BulkOrder]) -> List[BulkItemError]:
+    errors = list()
+    if len(orders) > config.BULK_ORDERS_MAX:
+        errors.append(BulkItemError(index=-1, error=f"At most {config.BULK_ORDERS_MAX} orders per batch"))
+    seen = set()
+    for i, order in enumerate(orders):
+        if order.direction not in DIRECTIONS:
+            errors.append(BulkItemError(index=i, error=f"Unknown direction {order.direction}"))
+        if order.order_type not in ORDER_TYPES:
+            errors.append(BulkItemError(index=i, error=f"Unknown order type {order.order_type}"))
+        if order.quantity <= 0:
+            errors.append(BulkItemError(index=i, error="Quantity must be positive"))
+        if order.order_type == "Limit" and (order.price is None or order.price <= 0):
+            errors.append(BulkItemError(index=i, error="Limit orders need a positive price"))
+        if order.order_id is not None:
+            if order.order_id in seen:
+                errors.append(BulkItemError(index=i, error=f"Duplicate order id {order.order_id}"))
+            seen.add(order.order_id)
+    return errors
+
+
+def describe(error: Exception) -> tuple:
+    if isinstance(error, BrokerUnavailable):
+        return 503, str(error)
+    if isinstance(error, RequestError):
+        return http_status(error), f"{error.code.name}: {error.details}"
+    return 500, repr(error)
+
+
+async def post_orders(client: AsyncServices, account_id: str, batch_id: str, orders: List[BulkOrder],
+                      prices: List[Quotation | None] | None = None,
+                      concurrency: int = config.BULK_ORDERS_CONCURRENCY) -> BulkOrdersResponse:
+    """``prices`` are the checked prices to send, by default the orders' own."""
+    semaphore = asyncio.Semaphore(concurrency)
+    order_ids = [order.order_id or order_id_for(account_id, batch_id, i, order) for i, order in enumerate(orders)]
+    if prices is None:
+        prices = [to_quotation(order.price) if order.price is not None else None for order in orders]
+
+    async def post(order: BulkOrder, order_id: str, price: Quotation | None):
+        async with semaphore:
+            return await client.orders.post_order(
+                figi=order.figi, quantity=order.quantity, direction=DIRECTIONS[order.direction], price=price,
+                account_id=account_id, order_type=ORDER_TYPES[order.order_type], order_id=order_id)
+
+    responses = await asyncio.gather(*(post(*item) for item in zip(orders, order_ids, prices)),
+                                     return_exceptions=True)
+    results = list()
+    for i, (order_id, response) in enumerate(zip(order_ids, responses)):
+        if isinstance(response, Exception):
+            code, error = describe(response)
+            results.append(BulkOrderResult(index=i, order_id=order_id, ok=False, status_code=code, error=error))
+        else:
+            status = OrderExecutionReportStatus(response.execution_report_status).name
+            results.append(BulkOrderResult(index=i, order_id=order_id, ok=True, status_code=200,
+                                           broker_order_id=response.order_id, execution_report_status=status,
+                                           lots_requested=response.lots_requested,
+                                           lots_executed=response.lots_executed))
+    failed = sum(not result.ok for result in results)
+    return BulkOrdersResponse(submitted=len(results) - failed, failed=failed, results=results)
+
+
+async def cancel_orders(client: AsyncServices, account_id: str, order_ids: List[str], stop_order_ids: List[str],
+                        figis: dict | None = None,
+                        concurrency: int = config.BULK_ORDERS_CONCURRENCY) -> BulkCancelResponse:
+    semaphore = asyncio.Semaphore(concurrency)
+    figis = figis or dict()
+
+    async def cancel(order_id: str, stop_order: bool):
+        async with semaphore:
+            if stop_order:
+                return await client.stop_orders.cancel_stop_order(account_id=account_id, stop_order_id=order_id)
+            return await client.orders.cancel_order(account_id=account_id, order_id=order_id)
+
+    items = [(order_id, False) for order_id in dict.fromkeys(order_ids)]
+    items += [(order_id, True) for order_id in dict.fromkeys(stop_order_ids)]
+    responses = await asyncio.gather(*(cancel(*item) for item in items), return_exceptions=True)
+    results = list()
+    for (order_id, stop_order), response in zip(items, responses):
+        result = BulkCancelResult(order_id=order_id, stop_order=stop_order, figi=figis.get(order_id), ok=True,
+                                  status_code=200)
+        if isinstance(response, Exception):
+            result.ok = False
+            result.status_code, result.error = describe(response)
+        else:
+            result.time = response.time
+        results.append(result)
+    failed = sum(not result.ok for result in results)
+    return BulkCancelResponse(cancelled=len(results) - failed, failed=failed, results=results)
+
+
+async def cancel_all(client: AsyncServices, account_id: str, figi: str | None = None,
+                     stop_orders: bool = True) -> BulkCancelResponse:
+    calls = [client.orders.get_orders(account_id=account_id)]
+    if stop_orders:
+        calls.append(client.stop_orders.get_stop_orders(account_id=account_id))
+    responses = await asyncio.gather(*calls)
+    active = [order for order in responses[0].orders if figi is None or order.figi == figi]
+    stops = [order for order in responses[1].stop_orders if figi is None or order.figi == figi] if stop_orders else []
+    figis = {order.order_id: order.figi for order in active}
+    figis.update({order.stop_order_id: order.figi for order in stops})
+    return await cancel_orders(client, account_id, [order.order_id for order in active],
+                               [order.stop_order_id for order in stops], figis)
@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+from tinkoff.invest import Quotation
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+from common.metrics import PRE_TRADE_REJECTIONS
+from common.quotation import NANO, nano_to_quotation, to_nano, to_quotation
+from instruments.catalog import InstrumentCatalog, TradingRules
+from instruments.schedules import TradingSchedules, is_open, next_open
+
+
+def round_price(nano: int, increment: int, direction: str) -> int:
+    # rounding never makes the order worse for the caller: buys round down, sells round up
+    remainder = nano % increment
+    if not remainder:
+        return nano
+    return nano - remainder if direction == "Buy" else nano - remainder + increment
+
+
+class PreTradeCheck:
+    """Rejects orders the broker would refuse, from cached instrument rules and trading schedules.
+
+    Instruments missing from the catalog are passed through for the broker to judge.
+    """
+
+    def __init__(self, catalog: InstrumentCatalog, schedules: TradingSchedules,
+                 round_prices: bool = config.PRE_TRADE_ROUND_PRICES):
+        self.catalog = catalog
+        self.schedules = schedules
+        self.round_prices = round_prices
+
+    async def check(self, client: AsyncServices, figi: str, quantity: int, price: float | None, direction: str,
+                    order_type: str, now: datetime | None = None) -> Tuple[Quotation | None, List[str]]:
+        """Returns the price to send and the reasons the order cannot be sent."""
+        await self.catalog.ensure_loaded(client)
+        rules = self.catalog.rules(figi)
+        errors = list()
+
+        def reject(reason: str, message: str):
+            PRE_TRADE_REJECTIONS.labels(reason).inc()
+            errors.append(message)
+
+        if quantity <= 0:
+            reject("quantity", "Quantity must be a positive number of lots")
+        if order_type == "Limit" and (price is None or price <= 0):
+            reject("price", "Limit orders need a positive price")
+        if rules is None:
+            return (to_quotation(price) if order_type == "Limit" and price is not None else None), errors
+
+        if not rules.api_trade_available:
+            reject("api_unavailable", f"{figi} cannot be traded through the API")
+        if direction == "Buy" and not rules.buy_available:
+            reject("buy_unavailable", f"{figi} is not available for buying")
+        if direction == "Sell" and not rules.sell_available:
+            reject("sell_unavailable", f"{figi} is not available for selling")
+
+        quotation = None
+        # market orders execute at the market price, so theirs is not sent
+        if order_type == "Limit" and price is not None and price > 0:
+            nano = to_nano(to_quotation(price))
+            if rules.min_price_increment > 0 and nano % rules.min_price_increment:
+                if self.round_prices:
+                    nano = round_price(nano, rules.min_price_increment, direction)
+                    # a buy below one price step rounds down to nothing
+                    if nano <= 0:
+                        reject("price", f"Price {price} is below the price step {rules.min_price_increment / NANO}")
+                else:
+                    reject("increment", f"Price {price} is not a multiple of the price step "
+                                        f"{rules.min_price_increment / NANO}")
+            quotation = nano_to_quotation(nano)
+
+        await self._check_session(client, rules, now or datetime.now(timezone.utc), reject)
+        return quotation, errors
+
+    async def _check_session(self, client: AsyncServices, rules: TradingRules, now: datetime, reject):
+        sessions = await self.schedules.sessions(client, rules.exchange)
+        # without a schedule the broker is left to decide
+        if sessions is not None and not is_open(sessions, now):
+            opens = next_open(sessions, now)
+            reject("closed", f"{rules.exchange} is closed" + (f" until {opens.isoformat()}" if opens else ""))
@@ -1,25 +1,154 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from orders.schemas import *
 
 from tinkoff.invest import (
     AccessLevel,
     AccountStatus,
     AccountType,
-    Client,
     InstrumentIdType,
+    OrderExecutionReportStatus,
     TradeDirection,
     OrderType
 )
+from tinkoff.invest.async_services import AsyncServices
+
+from common import config
+from common.dependencies import accept_websocket, get_client, get_order_trackers, get_pre_trade, track_in_flight
+from common.quotation import to_float
+from orders import bulk
+from orders.pre_trade import PreTradeCheck
+from orders.tracker import DIRECTION_NAMES, ORDER_TYPE_NAMES, AccountTracker, OrderTrackers, to_order_state
 
 router = APIRouter(
     prefix='/orders',
     tags=["Orders API"]
 )
 
+# an order sent to the broker is waited for on shutdown so its outcome reaches the caller
+IN_FLIGHT = [Depends(track_in_flight)]
+
+
+def to_post_order_response(order) -> PostOrderResponse:
+    return PostOrderResponse(order_id=order.order_id,
+                             execution_report_status=OrderExecutionReportStatus(order.execution_report_status).name,
+                             lots_requested=order.lots_requested, lots_executed=order.lots_executed,
+                             initial_order_price=to_float(order.initial_order_price),
+                             executed_order_price=to_float(order.executed_order_price),
+                             total_order_amount=to_float(order.total_order_amount),
+                             initial_commission=to_float(order.initial_commission),
+                             executed_commission=to_float(order.executed_commission),
+                             aci_value=to_float(order.aci_value), figi=order.figi,
+                             direction=DIRECTION_NAMES.get(order.direction, "Unspecified"),
+                             initial_security_price=to_float(order.initial_security_price),
+                             order_type=ORDER_TYPE_NAMES.get(order.order_type, "Unspecified"), message=order.message,
+                             initial_order_price_pt=to_float(order.initial_order_price_pt))
+
+
+@router.post("/post_order", response_model=PostOrderResponse, dependencies=IN_FLIGHT)
+async def post_order(post_order: PostOrder, client: AsyncServices = Depends(get_client),
+                     account_id: str | None = Header(default=None), token: str | None = Header(default=None),
+                     pre_trade: PreTradeCheck = Depends(get_pre_trade),
+                     trackers: OrderTrackers = Depends(get_order_trackers)):
+    if post_order.direction not in bulk.DIRECTIONS or post_order.order_type not in bulk.ORDER_TYPES:
+        raise HTTPException(status_code=422, detail="Direction must be Buy or Sell, order type Limit or Market")
+    # rejected locally, a bad order costs neither a broker round trip nor a rate limit token
+    price, errors = await pre_trade.check(client, post_order.figi, post_order.quantity, post_order.price,
+                                          post_order.direction, post_order.order_type)
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+
+    order = await client.orders.post_order(figi=post_order.figi, quantity=post_order.quantity, price=price,
+                                           direction=bulk.DIRECTIONS[post_order.direction], account_id=account_id,
+                                           order_type=bulk.ORDER_TYPES[post_order.order_type],
+                                           order_id=post_order.order_id)
+    tracker = trackers.find(token, account_id)
+    if tracker is not None:
+        tracker.watch(order.order_id)
+    return to_post_order_response(order)
+
+
+async def _tracker(trackers: OrderTrackers, token: str | None, account_id: str | None) -> AccountTracker | None:
+    # the first read for an account starts its tracker; reads go to the broker until it has synced
+    if not token or not account_id:
+        return None
+    return await trackers.acquire(token, account_id)
+
+
+@router.get("/order_state", response_model=OrderState)
+async def order_state(order_id: str, client: AsyncServices = Depends(get_client),
+                      account_id: str | None = Header(default=None), token: str | None = Header(default=None),
+                      trackers: OrderTrackers = Depends(get_order_trackers)):
+    tracker = await _tracker(trackers, token, account_id)
+    if tracker is not None and tracker.synced:
+        order = tracker.get(order_id)
+        if order is not None:
+            return order.state
+
+    state = to_order_state(await client.orders.get_order_state(account_id=account_id, order_id=order_id))
+    if tracker is not None:
+        tracker.update(state)
+    return state
+
+
+@router.get("/order_state/wait", response_model=TrackedOrder)
+async def wait_order_state(order_id: str, version: int = 0,
+                           timeout: float = Query(default=30, gt=0, le=config.ORDER_TRACKER_WAIT_MAX),
+                           client: AsyncServices = Depends(get_client), account_id: str | None = Header(default=None),
+                           token: str | None = Header(default=None),
+                           trackers: OrderTrackers = Depends(get_order_trackers)):
+    """Long-poll: answers as soon as the order changes past ``version``, or with its current state on timeout."""
+    tracker = await _tracker(trackers, token, _account(account_id))
+    if tracker.get(order_id) is None:
+        tracker.update(to_order_state(await client.orders.get_order_state(account_id=account_id, order_id=order_id)))
+    return (await tracker.wait(order_id, version, timeout)).tracked()
+
+
+@router.websocket("/ws")
+async def orders_ws(websocket: WebSocket):
+    credentials = await accept_websocket(websocket, with_account=True)
+    if credentials is None:
+        return
+    token, account_id = credentials
+    tracker = await websocket.app.state.order_trackers.acquire(token, account_id)
+    queue = tracker.subscribe()
+    try:
+        for order in tracker.active():
+            await websocket.send_json(jsonable_encoder(order.tracked()))
+        while True:
+            await websocket.send_json(jsonable_encoder(await queue.get()))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        tracker.unsubscribe(queue)
+
 
-@router.post("/post_order", response_model=PostOrderResponse)
-def post_order(post_order: PostOrder, token: str | None = Header(default=None),
-               account_id: str | None = Header(default=None)):
+@router.get("/get", response_model=List[OrderState])
+async def get_orders(client: AsyncServices = Depends(get_client),
+                     account_id: str | None = Header(default=None), token: str | None = Header(default=None),
+                     trackers: OrderTrackers = Depends(get_order_trackers)):
+    tracker = await _tracker(trackers, token, account_id)
+    if tracker is not None and tracker.synced:
+        return [order.state for order in tracker.active()]
+
+    orders = (await client.orders.get_orders(account_id=account_id)).orders
+    return [to_order_state(order) for order in orders]
+
+
+@router.post("/cancel_order", response_model=datetime, dependencies=IN_FLIGHT)
+async def cancel_order(order_id: str, client: AsyncServices = Depends(get_client),
+                       account_id: str | None = Header(default=None), token: str | None = Header(default=None),
+                       trackers: OrderTrackers = Depends(get_order_trackers)):
+    cancel_status = await client.orders.cancel_order(account_id=account_id, order_id=order_id)
+    tracker = trackers.find(token, account_id)
+    if tracker is not None:
+        tracker.mark_cancelled(order_id)
+    return cancel_status.time
+
+
+@router.put("/replace_order", response_model=PostOrderResponse, dependencies=IN_FLIGHT)
+async def replace_order(replace_order: ReplaceOrder, client: AsyncServices = Depends(get_client),
+                        account_id: str | None = Header(default=None)):
     direction = {"Buy": TradeDirection.TRADE_DIRECTION_BUY,
                  "Sell": TradeDirection.TRADE_DIRECTION_SELL,
                  "Unspecified": TradeDirection.TRADE_DIRECTION_UNSPECIFIED}
@@ -27,88 +156,87 @@ def post_order(post_order: PostOrder, token: str | None = Header(default=None),
                   "Limit": OrderType.ORDER_TYPE_LIMIT,
                   "Market": OrderType.ORDER_TYPE_MARKET}
 
-    with Client(token=token, app_name="islam") as client:
-        order = client.orders.post_order(figi=post_order.figi, price=None,
-                                         direction=direction.get(post_order.direction), account_id=account_id,
-                                         order_type=order_type.get(post_order.order_type),
-                                         order_id=str(datetime.utcnow().timestamp()))
-        return PostOrderResponse()
+    order = await client.orders.post_order(figi=post_order.figi, price=None,
+                                     direction=direction.get(post_order.direction), account_id=account_id,
+                                     order_type=order_type.get(post_order.order_type),
+                                     order_id=replace_order.order_id) # check
+    return PostOrderResponse()
 
 
-@router.get("/order_state", response_model=OrderState)
-def order_state(order_id: str, token: str | None = Header(default=None),
-                account_id: str | None = Header(default=None)):
-
-    with Client(token=token, app_name="islam") as client:
-        order_state = client.orders.get_order_state(account_id=account_id, order_id=order_id)
-        return OrderState(order_id=order_state.order_id) # add
-
-
-@router.get("/get", response_model=List[OrderState])
-def get_orders(token: str | None = Header(default=None),
-               account_id: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        orders = client.orders.get_orders(account_id=account_id).orders
-
-        response = list()
-        for ord in orders:
-            ord_data = OrderState(order_id=ord.order_id) # add
-            response.append(ord_data)
-        return response
-
-
-@router.post("/cancel_order", response_model=datetime)
-def cancel_order(order_id: str, token: str | None = Header(default=None),
-                 account_id: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        cancel_status = client.orders.cancel_order(account_id=account_id, order_id=order_id) # check
-        return cancel_status.time
-
-
-@router.put("/replace_order", response_model=PostOrderResponse)
-def replace_order(replace_order: ReplaceOrder, token: str | None = Header(default=None),
-                  account_id: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        direction = {"Buy": TradeDirection.TRADE_DIRECTION_BUY,
-                     "Sell": TradeDirection.TRADE_DIRECTION_SELL,
-                     "Unspecified": TradeDirection.TRADE_DIRECTION_UNSPECIFIED}
-        order_type = {"Unspecified": OrderType.ORDER_TYPE_UNSPECIFIED,
-                      "Limit": OrderType.ORDER_TYPE_LIMIT,
-                      "Market": OrderType.ORDER_TYPE_MARKET}
-
-        with Client(token=token, app_name="islam") as client:
-            order = client.orders.post_order(figi=post_order.figi, price=None,
-                                             direction=direction.get(post_order.direction), account_id=account_id,
-                                             order_type=order_type.get(post_order.order_type),
-                                             order_id=replace_order.order_id) # check
-            return PostOrderResponse()
-
-
-@router.post("/post_stop_order", response_model=str)
-def post_stop_order(stop_order: PostStopOrder, token: str | None = Header(default=None),
-                    account_id: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        order_stop = client.stop_orders.post_stop_order(figi=stop_order.figi, account_id=account_id).stop_order_id
-        return order_stop
+@router.post("/post_stop_order", response_model=str, dependencies=IN_FLIGHT)
+async def post_stop_order(stop_order: PostStopOrder, client: AsyncServices = Depends(get_client),
+                          account_id: str | None = Header(default=None)):
+    order_stop = (await client.stop_orders.post_stop_order(figi=stop_order.figi, account_id=account_id)).stop_order_id
+    return order_stop
 
 
 @router.get("/get_stop_order", response_model=List[StopOrder])
-def get_stop_order(token: str | None = Header(default=None),
-                   account_id: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        stop_order = client.stop_orders.get_stop_orders(account_id=account_id).stop_orders
-
-        response = list()
-        for stop_ord in stop_order:
-            ord_data = StopOrder(stop_order_id=stop_ord.stop_order_id) # add
-            response.append(ord_data)
-        return response
-
-
-@router.post("/cancel_stop_order", response_model=datetime)
-def cancel_stop_order(stop_order_id: str, token: str | None = Header(default=None),
-                      account_id: str | None = Header(default=None)):
-    with Client(token=token, app_name="islam") as client:
-        cancel_order = client.stop_orders.cancel_stop_order(account_id=account_id, stop_order_id=stop_order_id)
-        return cancel_order.time
-
+async def get_stop_order(client: AsyncServices = Depends(get_client),
+                         account_id: str | None = Header(default=None)):
+    stop_order = (await client.stop_orders.get_stop_orders(account_id=account_id)).stop_orders
+
+    response = list()
+    for stop_ord in stop_order:
+        ord_data = StopOrder(stop_order_id=stop_ord.stop_order_id) # add
+        response.append(ord_data)
+    return response
+
+
+@router.post("/cancel_stop_order", response_model=datetime, dependencies=IN_FLIGHT)
+async def cancel_stop_order(stop_order_id: str, client: AsyncServices = Depends(get_client),
+                            account_id: str | None = Header(default=None)):
+    cancel_order = await client.stop_orders.cancel_stop_order(account_id=account_id, stop_order_id=stop_order_id)
+    return cancel_order.time
+
+
+
+def _account(account_id: str | None) -> str:
+    if not account_id:
+        raise HTTPException(status_code=400, detail="Account-Id header is required")
+    return account_id
+
+
+@router.post("/bulk/post_orders", response_model=BulkOrdersResponse, dependencies=IN_FLIGHT)
+async def post_orders(request: BulkPostOrders, client: AsyncServices = Depends(get_client),
+                      account_id: str | None = Header(default=None),
+                      pre_trade: PreTradeCheck = Depends(get_pre_trade)):
+    # nothing is sent unless every order passes, so a batch never half-applies on a typo
+    errors = bulk.validate_orders(request.orders)
+    if errors:
+        raise HTTPException(status_code=422, detail=[error.dict() for error in errors])
+    prices = list()
+    for i, order in enumerate(request.orders):
+        price, reasons = await pre_trade.check(client, order.figi, order.quantity, order.price, order.direction,
+                                               order.order_type)
+        prices.append(price)
+        errors.extend(BulkItemError(index=i, error=reason) for reason in reasons)
+    if errors:
+        raise HTTPException(status_code=422, detail=[error.dict() for error in errors])
+    return await bulk.post_orders(client, _account(account_id), request.batch_id, request.orders, prices)
+
+
+def _mark_cancelled(trackers: OrderTrackers, token: str | None, account_id: str, response: BulkCancelResponse):
+    tracker = trackers.find(token, account_id)
+    if tracker is not None:
+        for result in response.results:
+            if result.ok and not result.stop_order:
+                tracker.mark_cancelled(result.order_id)
+    return response
+
+
+@router.post("/bulk/cancel_orders", response_model=BulkCancelResponse, dependencies=IN_FLIGHT)
+async def cancel_orders(request: BulkCancelOrders, client: AsyncServices = Depends(get_client),
+                        account_id: str | None = Header(default=None), token: str | None = Header(default=None),
+                        trackers: OrderTrackers = Depends(get_order_trackers)):
+    if len(request.order_ids) + len(request.stop_order_ids) > config.BULK_ORDERS_MAX:
+        raise HTTPException(status_code=422, detail=f"At most {config.BULK_ORDERS_MAX} orders per batch")
+    response = await bulk.cancel_orders(client, _account(account_id), request.order_ids, request.stop_order_ids)
+    return _mark_cancelled(trackers, token, account_id, response)
+
+
+@router.post("/bulk/cancel_all", response_model=BulkCancelResponse, dependencies=IN_FLIGHT)
+async def cancel_all(figi: str | None = None, stop_orders: bool = True, client: AsyncServices = Depends(get_client),
+                     account_id: str | None = Header(default=None), token: str | None = Header(default=None),
+                     trackers: OrderTrackers = Depends(get_order_trackers)):
+    response = await bulk.cancel_all(client, _account(account_id), figi, stop_orders)
+    return _mark_cancelled(trackers, token, account_id, response)
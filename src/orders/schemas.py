@@ -82,3 +82,77 @@ class StopOrder(BaseModel):
     expiration_date: datetime
     price: float
     stop_price: float
+
+
+class BulkOrder(BaseModel):
+    figi: str
+    quantity: int
+    price: Optional[float] = None
+    direction: str
+    order_type: str
+    # derived from the batch id and the item when left out, so a retried batch sends the same ids
+    order_id: Optional[str] = None
+
+
+class BulkPostOrders(BaseModel):
+    batch_id: str
+    orders: List[BulkOrder]
+
+
+class BulkCancelOrders(BaseModel):
+    order_ids: List[str] = []
+    stop_order_ids: List[str] = []
+
+
+class BulkItemError(BaseModel):
+    index: int
+    error: str
+
+
+class BulkOrderResult(BaseModel):
+    index: int
+    order_id: str
+    ok: bool
+    status_code: int
+    # the id the broker assigned, used to cancel or look the order up
+    broker_order_id: Optional[str] = None
+    execution_report_status: Optional[str] = None
+    lots_requested: Optional[int] = None
+    lots_executed: Optional[int] = None
+    error: Optional[str] = None
+
+
+class BulkCancelResult(BaseModel):
+    order_id: str
+    stop_order: bool = False
+    figi: Optional[str] = None
+    ok: bool
+    status_code: int
+    time: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+class BulkOrdersResponse(BaseModel):
+    submitted: int
+    failed: int
+    results: List[BulkOrderResult]
+
+
+class BulkCancelResponse(BaseModel):
+    cancelled: int
+    failed: int
+    results: List[BulkCancelResult]
+
+
+class OrderFill(BaseModel):
+    trade_id: str
+    time: datetime
+    price: float
+    quantity: int
+
+
+class TrackedOrder(BaseModel):
+    # grows with every change, pass it back to /order_state/wait to wait for the next one
+    version: int
+    state: OrderState
+    fills: List[OrderFill] = []
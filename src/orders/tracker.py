@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Set, Tuple
+
+from tinkoff.invest import OrderDirection, OrderExecutionReportStatus, OrderType
+
+from common import config
+from common.quotation import to_float
+from orders.schemas import OrderFill, OrderState, TrackedOrder
+
+logger = logging.getLogger(__name__)
+
+TRADES_STREAM = "OrdersStreamService/TradesStream"
+
+DIRECTION_NAMES = {OrderDirection.ORDER_DIRECTION_BUY: "Buy", OrderDirection.ORDER_DIRECTION_SELL: "Sell"}
+ORDER_TYPE_NAMES = {OrderType.ORDER_TYPE_LIMIT: "Limit", OrderType.ORDER_TYPE_MARKET: "Market"}
+
+FILLED = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL.name
+PARTIALLY_FILLED = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL.name
+CANCELLED = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED.name
+TERMINAL_STATUSES = (FILLED, CANCELLED, OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED.name)
+
+
+def to_order_state(state) -> OrderState:
+    return OrderState(order_id=state.order_id,
+                      execution_report_status=OrderExecutionReportStatus(state.execution_report_status).name,
+                      lots_requested=state.lots_requested, lots_executed=state.lots_executed,
+                      initial_order_price=to_float(state.initial_order_price),
+                      executed_order_price=to_float(state.executed_order_price),
+                      total_order_amount=to_float(state.total_order_amount),
+                      initial_commission=to_float(state.initial_commission),
+                      executed_commission=to_float(state.executed_commission), figi=state.figi,
+                      direction=DIRECTION_NAMES.get(state.direction, "Unspecified"),
+                      initial_security_price=to_float(state.initial_security_price),
+                      service_commission=to_float(state.service_commission), currency=state.currency,
+                      order_type=ORDER_TYPE_NAMES.get(state.order_type, "Unspecified"), order_date=state.order_date)
+
+
+class Order:
+    def __init__(self, state: OrderState):
+        self.state = state
+        self.fills: Dict[str, OrderFill] = dict()
+        self.version = 0
+        self.updated = time.monotonic()
+
+    @property
+    def is_active(self) -> bool:
+        return self.state.execution_report_status not in TERMINAL_STATUSES
+
+    def tracked(self) -> TrackedOrder:
+        return TrackedOrder(version=self.version, state=self.state, fills=list(self.fills.values()))
+
+
+class AccountTracker:
+    """Live orders of one account, kept current from the broker's trades stream.
+
+    Every (re)connect is followed by a reconciliation against ``get_orders``, and fills are keyed by trade id,
+    so a fill seen by both paths is counted once and one missed while disconnected is picked up.
+    """
+
+    def __init__(self, token: str, account_id: str, client_pool, limiter=None):
+        self.token = token
+        self.account_id = account_id
+        self.client_pool = client_pool
+        self.limiter = limiter
+        self.orders: Dict[str, Order] = dict()
+        self.listeners: Set[asyncio.Queue] = set()
+        # false until the first reconciliation after a (re)connect, so reads fall back to the broker meanwhile
+        self.synced = False
+        self.last_used = time.monotonic()
+        self._task: asyncio.Task | None = None
+        self._pending: Set[asyncio.Task] = set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._pending:
+            task.cancel()
+
+    def get(self, order_id: str) -> Order | None:
+        self.last_used = time.monotonic()
+        return self.orders.get(order_id)
+
+    def active(self) -> List[Order]:
+        self.last_used = time.monotonic()
+        return [order for order in self.orders.values() if order.is_active]
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=config.ORDER_TRACKER_LISTENER_QUEUE)
+        self.listeners.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.listeners.discard(queue)
+        self.last_used = time.monotonic()
+
+    async def wait(self, order_id: str, version: int, timeout: float) -> Order | None:
+        """Returns the order once its version passes ``version``, or as it is when ``timeout`` runs out."""
+        order = self.get(order_id)
+        if order is not None and order.version > version:
+            return order
+        queue = self.subscribe()
+
+        async def changed():
+            while (await queue.get()).state.order_id != order_id:
+                pass
+
+        try:
+            await asyncio.wait_for(changed(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.unsubscribe(queue)
+        return self.get(order_id)
+
+    def _publish(self, order: Order):
+        order.version += 1
+        order.updated = time.monotonic()
+        message = order.tracked()
+        for queue in self.listeners:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def update(self, state: OrderState):
+        """Takes a state read from the broker; counters never move backwards past fills already seen."""
+        order = self.orders.get(state.order_id)
+        if order is None:
+            order = self.orders[state.order_id] = Order(state)
+            self._publish(order)
+            return
+        current = order.state
+        if (state.lots_executed < current.lots_executed and
+                state.execution_report_status not in TERMINAL_STATUSES):
+            state = current.copy(update={"execution_report_status": state.execution_report_status})
+        if state != current:
+            order.state = state
+            self._publish(order)
+
+    def mark_cancelled(self, order_id: str):
+        order = self.orders.get(order_id)
+        if order is not None and order.is_active:
+            order.state = order.state.copy(update={"execution_report_status": CANCELLED})
+            self._publish(order)
+
+    def on_trades(self, order_trades):
+        order = self.orders.get(order_trades.order_id)
+        if order is not None:
+            new = [trade for trade in order_trades.trades if trade.trade_id not in order.fills]
+            if not new:
+                return
+            for trade in new:
+                order.fills[trade.trade_id] = OrderFill(trade_id=trade.trade_id, time=trade.date_time,
+                                                        price=to_float(trade.price), quantity=trade.quantity)
+            if order.state.execution_report_status not in TERMINAL_STATUSES:
+                order.state = order.state.copy(update={"execution_report_status": PARTIALLY_FILLED})
+            self._publish(order)
+        # the stream carries fills only; lots, average price and commissions come from the broker's state
+        self._spawn(self._refresh(order_trades.order_id))
+
+    def watch(self, order_id: str):
+        """Starts tracking an order placed through the service without waiting for the next reconciliation."""
+        self._spawn(self._refresh(order_id))
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _refresh(self, order_id: str):
+        try:
+            async with self.client_pool.lease(self.token) as client:
+                state = await client.orders.get_order_state(account_id=self.account_id, order_id=order_id)
+            self.update(to_order_state(state))
+        except Exception:
+            logger.exception("Could not refresh order %s", order_id)
+
+    async def reconcile(self):
+        async with self.client_pool.lease(self.token) as client:
+            live = (await client.orders.get_orders(account_id=self.account_id)).orders
+        seen = set()
+        for state in live:
+            seen.add(state.order_id)
+            self.update(to_order_state(state))
+        # orders that left the active list were filled or cancelled while nobody was listening
+        gone = [order_id for order_id, order in self.orders.items() if order.is_active and order_id not in seen]
+        await asyncio.gather(*(self._refresh(order_id) for order_id in gone))
+        expired = time.monotonic() - config.ORDER_TRACKER_RETENTION
+        for order_id in [order_id for order_id, order in self.orders.items()
+                         if not order.is_active and order.updated < expired]:
+            del self.orders[order_id]
+        self.synced = True
+
+    async def _reconcile_periodically(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("Order reconciliation failed for account %s", self.account_id)
+            await asyncio.sleep(config.ORDER_TRACKER_RECONCILE_INTERVAL)
+
+    async def _run(self):
+        while True:
+            try:
+                if self.limiter is None:
+                    await self._stream()
+                else:
+                    async with self.limiter.stream_slot(self.token, TRADES_STREAM):
+                        await self._stream()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Trades stream failed for account %s, reconnecting", self.account_id)
+            self.synced = False
+            await asyncio.sleep(config.ORDER_TRACKER_RECONNECT_DELAY)
+
+    async def _stream(self):
+        async with self.client_pool.lease(self.token) as client:
+            # reconciliation starts with the stream, so fills from before the subscription come from get_orders
+            reconciler = asyncio.create_task(self._reconcile_periodically())
+            try:
+                async for response in client.orders_stream.trades_stream(accounts=[self.account_id]):
+                    if response.order_trades:
+                        self.on_trades(response.order_trades)
+            finally:
+                reconciler.cancel()
+
+
+class OrderTrackers:
+    def __init__(self, client_pool, limiter=None, idle_timeout: float = config.ORDER_TRACKER_IDLE_TIMEOUT):
+        self.client_pool = client_pool
+        self.limiter = limiter
+        self.idle_timeout = idle_timeout
+        self._trackers: Dict[Tuple[str, str], AccountTracker] = dict()
+
+    def find(self, token: str | None, account_id: str | None) -> AccountTracker | None:
+        if not token or not account_id:
+            return None
+        return self._trackers.get((token, account_id))
+
+    async def acquire(self, token: str, account_id: str) -> AccountTracker:
+        await self._stop_idle()
+        tracker = self._trackers.get((token, account_id))
+        if tracker is None:
+            tracker = self._trackers[(token, account_id)] = AccountTracker(token, account_id, self.client_pool,
+                                                                           self.limiter)
+            tracker.start()
+        tracker.last_used = time.monotonic()
+        return tracker
+
+    async def _stop_idle(self):
+        now = time.monotonic()
+        for key, tracker in list(self._trackers.items()):
+            if not tracker.listeners and now - tracker.last_used > self.idle_timeout:
+                del self._trackers[key]
+                await tracker.close()
+
+    def stats(self) -> dict:
+        return {f"tracker-{i}": {"synced": tracker.synced, "orders": len(tracker.orders),
+                                 "active": sum(order.is_active for order in tracker.orders.values()),
+                                 "listeners": len(tracker.listeners), "last_used": tracker.last_used}
+                for i, tracker in enumerate(self._trackers.values())}
+
+    async def close(self):
+        for tracker in self._trackers.values():
+            await tracker.close()
+        self._trackers.clear()
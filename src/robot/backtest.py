@@ -0,0 +1,84 @@
+import time
+from datetime import datetime, timezone
+from typing import Dict
+
+import numpy as np
+
+from robot.engine import Candle, Engine, SimulatedGateway
+from robot.strategies import Strategy
+
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+
+# equity curves are thinned to this many points in responses
+EQUITY_POINTS = 500
+
+
+def to_bars(columns: dict) -> Dict[str, np.ndarray]:
+    """CandleStore columns as arrays; time becomes epoch seconds."""
+    bars = {name: np.asarray(columns[name], dtype=np.float64) for name in ("open", "high", "low", "close")}
+    bars["volume"] = np.asarray(columns["volume"], dtype=np.int64)
+    bars["time"] = np.fromiter((t.timestamp() for t in columns["time"]), dtype=np.float64, count=len(columns["time"]))
+    return bars
+
+
+def vectorized(target: np.ndarray, bars: Dict[str, np.ndarray], lot: int, commission: float) -> tuple:
+    """Replays target positions decided at each close as market orders filled at the next bar's open."""
+    held = np.zeros(len(target), dtype=np.int64)
+    held[1:] = target[:-1]
+    traded = np.diff(held, prepend=0)
+    flows = traded * lot * bars["open"]
+    cash = -np.cumsum(flows + np.abs(flows) * commission)
+    equity = cash + held * lot * bars["close"]
+    return equity, int(np.count_nonzero(traded))
+
+
+async def event_driven(strategy: Strategy, bars: Dict[str, np.ndarray], lot: int, commission: float) -> tuple:
+    """Runs the strategy through the live engine, one candle event at a time."""
+    gateway = SimulatedGateway(lot, commission)
+    engine = Engine(strategy, gateway)
+    engine.start()
+    equity = np.empty(len(bars["close"]))
+    columns = zip(bars["time"].tolist(), bars["open"].tolist(), bars["high"].tolist(), bars["low"].tolist(),
+                  bars["close"].tolist(), bars["volume"].tolist())
+    for i, (t, open_, high, low, close, volume) in enumerate(columns):
+        await engine.handle(Candle(strategy.figi, datetime.fromtimestamp(t, timezone.utc), open_, high, low, close,
+                                   volume))
+        equity[i] = gateway.equity(close, engine.context)
+    return equity, gateway.trades
+
+
+def summarize(bars: Dict[str, np.ndarray], equity: np.ndarray, trades: int, capital: float) -> dict:
+    if not len(equity):
+        return {"bars": 0, "trades": 0, "pnl": 0.0, "return": 0.0, "max_drawdown": 0.0, "sharpe": None,
+                "equity": []}
+    value = capital + equity
+    peak = np.maximum.accumulate(value)
+    returns = np.diff(value) / value[:-1]
+    span = bars["time"][-1] - bars["time"][0]
+    sharpe = None
+    if len(returns) > 1 and returns.std() > 0 and span > 0:
+        bars_per_year = len(returns) / span * SECONDS_PER_YEAR
+        sharpe = float(returns.mean() / returns.std() * np.sqrt(bars_per_year))
+    step = max(len(value) // EQUITY_POINTS, 1)
+    return {"bars": len(equity), "trades": trades, "pnl": float(equity[-1]), "return": float(equity[-1] / capital),
+            "max_drawdown": float(((peak - value) / peak).max()), "sharpe": sharpe,
+            "equity": value[::step].tolist()}
+
+
+async def backtest(strategy: Strategy, columns: dict, mode: str = "auto", lot: int = 1, commission: float = 0.0,
+                   capital: float = 100_000.0) -> dict:
+    """``mode`` is "vectorized", "events" or "auto", which vectorizes whenever the strategy allows it."""
+    started = time.perf_counter()
+    bars = to_bars(columns)
+    target = strategy.signals(bars) if mode != "events" else None
+    if target is not None:
+        mode = "vectorized"
+        equity, trades = vectorized(target, bars, lot, commission)
+    elif mode == "vectorized":
+        raise ValueError(f"{strategy.name} has no vectorized form, use mode=events")
+    else:
+        mode = "events"
+        equity, trades = await event_driven(strategy, bars, lot, commission)
+    result = summarize(bars, equity, trades, capital)
+    result.update(mode=mode, elapsed=time.perf_counter() - started)
+    return result
@@ -0,0 +1,154 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Union
+
+from market_data.order_book import OrderBook
+from orders.schemas import TrackedOrder
+
+
+@dataclass(frozen=True)
+class Candle:
+    figi: str
+    time: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: int
+
+
+@dataclass(frozen=True)
+class TradeTick:
+    figi: str
+    time: datetime
+    price: float
+    quantity: int
+    direction: str
+
+
+@dataclass(frozen=True)
+class BookUpdate:
+    figi: str
+    time: datetime
+    book: OrderBook
+
+
+@dataclass(frozen=True)
+class OrderUpdate:
+    order: TrackedOrder
+
+
+Event = Union[Candle, TradeTick, BookUpdate, OrderUpdate]
+
+
+@dataclass
+class OrderIntent:
+    figi: str
+    direction: str
+    lots: int
+    price: float | None = None
+
+    @property
+    def order_type(self) -> str:
+        return "Market" if self.price is None else "Limit"
+
+
+class Context:
+    """What a strategy sees of the outside world: its position and a way to ask for orders."""
+
+    def __init__(self, figi: str):
+        self.figi = figi
+        # lots held and lots sent but not yet filled (negative for sells); both kept by the gateway
+        self.position = 0
+        self.working = 0
+        self.pending: List[OrderIntent] = list()
+
+    def buy(self, lots: int, price: float | None = None):
+        self.pending.append(OrderIntent(self.figi, "Buy", lots, price))
+
+    def sell(self, lots: int, price: float | None = None):
+        self.pending.append(OrderIntent(self.figi, "Sell", lots, price))
+
+    def target(self, position: int, price: float | None = None):
+        """Orders whatever takes the position to ``position`` lots, counting orders not yet filled."""
+        planned = self.position + self.working
+        planned += sum(intent.lots if intent.direction == "Buy" else -intent.lots for intent in self.pending)
+        if position > planned:
+            self.buy(position - planned, price)
+        elif position < planned:
+            self.sell(planned - position, price)
+
+    def take_orders(self) -> List[OrderIntent]:
+        pending, self.pending = self.pending, list()
+        return pending
+
+
+class SimulatedGateway:
+    """Fills orders against the next candle: market orders at its open, limit orders when its range crosses."""
+
+    def __init__(self, lot: int = 1, commission: float = 0.0):
+        self.lot = lot
+        self.commission = commission
+        self.cash = 0.0
+        self.trades = 0
+        self.waiting: List[OrderIntent] = list()
+
+    async def submit(self, order: OrderIntent, context: Context):
+        self.waiting.append(order)
+        context.working += order.lots if order.direction == "Buy" else -order.lots
+
+    def on_candle(self, candle: Candle, context: Context):
+        waiting, self.waiting = self.waiting, list()
+        for order in waiting:
+            if order.price is None:
+                price = candle.open
+            elif order.direction == "Buy" and candle.low <= order.price:
+                price = min(order.price, candle.open)
+            elif order.direction == "Sell" and candle.high >= order.price:
+                price = max(order.price, candle.open)
+            else:
+                self.waiting.append(order)
+                continue
+            self.fill(order, price, context)
+
+    def fill(self, order: OrderIntent, price: float, context: Context):
+        sign = 1 if order.direction == "Buy" else -1
+        value = order.lots * self.lot * price
+        self.cash -= sign * value + abs(value) * self.commission
+        context.position += sign * order.lots
+        context.working -= sign * order.lots
+        self.trades += 1
+
+    def on_order(self, update: OrderUpdate, context: Context):
+        pass
+
+    def equity(self, price: float, context: Context) -> float:
+        return self.cash + context.position * self.lot * price
+
+
+class Engine:
+    """Feeds events to a strategy and hands the orders it asks for to the gateway.
+
+    The same loop runs live, in paper trading and in event-by-event backtests; only the gateway differs.
+    """
+
+    def __init__(self, strategy, gateway, context: Context | None = None):
+        self.strategy = strategy
+        self.gateway = gateway
+        self.context = context or Context(strategy.figi)
+        self.events = 0
+
+    def start(self):
+        self.strategy.on_start(self.context)
+
+    async def handle(self, event: Event):
+        self.events += 1
+        if isinstance(event, Candle):
+            # orders placed on the previous bar execute on this one, before the strategy sees it
+            self.gateway.on_candle(event, self.context)
+        elif isinstance(event, OrderUpdate):
+            self.gateway.on_order(event, self.context)
+        self.strategy.on_event(event, self.context)
+        for order in self.context.take_orders():
+            if order.lots > 0:
+                await self.gateway.submit(order, self.context)
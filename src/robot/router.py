@@ -1,22 +1,53 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+import json
+from datetime import datetime
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 
 from tinkoff.invest import (
     AccessLevel,
     AccountStatus,
     AccountType,
-    Client,
     InstrumentIdType,
 )
+from tinkoff.invest.async_services import AsyncServices
+
+from common.dependencies import accept_websocket, get_candle_store, get_catalog, get_client, get_market_hubs, get_robots
+from instruments.catalog import InstrumentCatalog
+from market_data.candles import INTERVALS, CandleStore
+from market_data.hub import MarketDataHubs
+from operations.schemas import Candles
+from robot.backtest import backtest
+from robot.runtime import RobotManager
+from robot.schemas import BacktestRequest, BacktestResult, RobotStart, RobotStatus, StrategyInfo
+from robot.strategies import STRATEGIES, Strategy
 
 router = APIRouter(
     prefix='/market',
     tags=["Market API"]
 )
 
+robot_router = APIRouter(
+    prefix='/robot',
+    tags=["Robot API"]
+)
 
-@router.get("/get_kline")
-def get_kline():
-    pass
+
+@router.get("/get_kline", response_model=Candles)
+async def get_kline(figi: str, interval: str = "1min", limit: int = Query(default=200, gt=0, le=100000),
+                    client: AsyncServices = Depends(get_client), store: CandleStore = Depends(get_candle_store)):
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Unsupported interval {interval}")
+    to = datetime.utcnow()
+    from_ = to - INTERVALS[interval][1] * limit
+    try:
+        columns = await store.get(client, figi, interval, from_, to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    columns = {name: values[-limit:] for name, values in columns.items()}
+    return Candles(figi=figi, interval=interval, **columns)
 
 
 @router.get("/instrument_info")
@@ -25,8 +56,28 @@ def get_instrument_info():
 
 
 @router.get("/tickers")
-def get_latest_price_snapshot():
-    pass
+def get_latest_price_snapshot(figi: List[str] = Query(), token: str | None = Header(default=None),
+                              hubs: MarketDataHubs = Depends(get_market_hubs)):
+    hub = hubs.find(token)
+    response = list()
+    for f in figi:
+        state = hub.get(f) if hub is not None else None
+        if state is not None:
+            response.append(state.snapshot())
+    return response
+
+
+@router.get("/order_book/{figi}")
+def get_order_book_metrics(figi: str, depth: int = Query(default=10, gt=0),
+                           size: int | None = Query(default=None, gt=0), levels: int = Query(default=1, gt=0),
+                           window: float | None = Query(default=None, gt=0),
+                           token: str | None = Header(default=None), hubs: MarketDataHubs = Depends(get_market_hubs)):
+    # served from the streamed book only; subscribe through /market/ws or /market/sse first
+    hub = hubs.find(token)
+    state = hub.get(figi) if hub is not None else None
+    if state is None or not state.has_book:
+        raise HTTPException(status_code=404, detail=f"No streamed order book for {figi}")
+    return state.book.metrics(depth, size, levels, window)
 
 
 @router.get("/position_info")
@@ -37,3 +88,121 @@ def get_position_info():
 @router.get("/coin_info")
 def change_order():
     pass
+
+
+@router.websocket("/ws/{figi}")
+async def market_data_ws(websocket: WebSocket, figi: str):
+    credentials = await accept_websocket(websocket)
+    if credentials is None:
+        return
+    token, _ = credentials
+    hubs: MarketDataHubs = websocket.app.state.market_hubs
+    hub = hubs.acquire(token)
+    queue = hub.subscribe(figi)
+    try:
+        while True:
+            await websocket.send_json(jsonable_encoder(await queue.get()))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(figi, queue)
+        await hubs.release(token)
+
+
+@router.get("/sse/{figi}")
+async def market_data_sse(figi: str, request: Request, token: str | None = Header(default=None),
+                          hubs: MarketDataHubs = Depends(get_market_hubs)):
+    if not token:
+        raise HTTPException(status_code=401, detail="Token header is required")
+    hub = hubs.acquire(token)
+    queue = hub.subscribe(figi)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                message = await queue.get()
+                yield f"event: {message['type']}\ndata: {json.dumps(jsonable_encoder(message))}\n\n"
+        finally:
+            hub.unsubscribe(figi, queue)
+            await hubs.release(token)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def make_strategy(name: str, figi: str, lots: int, params: dict) -> Strategy:
+    if name not in STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Unknown strategy {name}, expected one of {', '.join(STRATEGIES)}")
+    if lots <= 0:
+        raise HTTPException(status_code=400, detail="Lots must be positive")
+    try:
+        return STRATEGIES[name](figi, lots, **params)
+    except (TypeError, ValueError) as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+async def lot_size(client: AsyncServices, catalog: InstrumentCatalog, figi: str) -> int:
+    await catalog.ensure_loaded(client)
+    rules = catalog.rules(figi)
+    return rules.lot if rules is not None else 1
+
+
+@robot_router.get("/strategies", response_model=List[StrategyInfo])
+def get_strategies():
+    return [StrategyInfo(name=name, description=(strategy.__doc__ or "").strip(), defaults=strategy.defaults,
+                         vectorized=strategy.signals is not Strategy.signals)
+            for name, strategy in STRATEGIES.items()]
+
+
+@robot_router.post("/start", response_model=RobotStatus)
+async def start_robot(request: RobotStart, account_id: str | None = Header(default=None),
+                      token: str | None = Header(default=None), client: AsyncServices = Depends(get_client),
+                      catalog: InstrumentCatalog = Depends(get_catalog), robots: RobotManager = Depends(get_robots)):
+    if request.candle_interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Unsupported interval {request.candle_interval}")
+    if not request.dry_run and not account_id:
+        raise HTTPException(status_code=400, detail="Live robots need the account-id header")
+    strategy = make_strategy(request.strategy, request.figi, request.lots, request.params)
+    robot = robots.start(strategy, token, account_id, request.dry_run, INTERVALS[request.candle_interval][1],
+                         await lot_size(client, catalog, request.figi), request.commission)
+    return robot.status()
+
+
+@robot_router.get("", response_model=List[RobotStatus])
+def list_robots(token: str | None = Header(default=None), robots: RobotManager = Depends(get_robots)):
+    return [robot.status() for robot in robots.owned_by(token)]
+
+
+@robot_router.get("/{robot_id}", response_model=RobotStatus)
+def get_robot(robot_id: str, token: str | None = Header(default=None), robots: RobotManager = Depends(get_robots)):
+    robot = robots.find(robot_id, token)
+    if robot is None:
+        raise HTTPException(status_code=404, detail=f"No robot {robot_id}")
+    return robot.status()
+
+
+@robot_router.post("/{robot_id}/stop", response_model=RobotStatus)
+async def stop_robot(robot_id: str, token: str | None = Header(default=None),
+                     robots: RobotManager = Depends(get_robots)):
+    # working orders are left with the broker; cancel them through /orders if needed
+    robot = robots.find(robot_id, token)
+    if robot is None:
+        raise HTTPException(status_code=404, detail=f"No robot {robot_id}")
+    await robots.remove(robot_id)
+    return robot.status()
+
+
+@robot_router.post("/backtest", response_model=BacktestResult)
+async def run_backtest(request: BacktestRequest, client: AsyncServices = Depends(get_client),
+                       store: CandleStore = Depends(get_candle_store),
+                       catalog: InstrumentCatalog = Depends(get_catalog)):
+    if request.mode not in ("auto", "vectorized", "events"):
+        raise HTTPException(status_code=400, detail=f"Unknown mode {request.mode}")
+    strategy = make_strategy(request.strategy, request.figi, request.lots, request.params)
+    lot = request.lot or await lot_size(client, catalog, request.figi)
+    try:
+        columns = await store.get(client, request.figi, request.interval, request.start,
+                                  request.end or datetime.utcnow())
+        result = await backtest(strategy, columns, request.mode, lot, request.commission, request.capital)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return BacktestResult(strategy=strategy.name, figi=request.figi, **result)
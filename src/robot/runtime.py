@@ -0,0 +1,244 @@
+import asyncio
+import itertools
+import logging
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from tinkoff.invest import TradeDirection
+
+from market_data.hub import MarketDataHubs
+from orders.bulk import DIRECTIONS, ORDER_TYPES
+from orders.pre_trade import PreTradeCheck
+from orders.tracker import TERMINAL_STATUSES, OrderTrackers
+from robot.engine import BookUpdate, Candle, Context, Engine, OrderIntent, OrderUpdate, SimulatedGateway, TradeTick
+from robot.schemas import RobotStatus
+from robot.strategies import Strategy
+
+logger = logging.getLogger(__name__)
+
+ROBOT_ORDER_NAMESPACE = uuid.UUID("2c0f6f5e-8d1b-4f7a-b0e4-5a9d3c7e1f20")
+
+TRADE_DIRECTIONS = {TradeDirection.TRADE_DIRECTION_BUY: "Buy", TradeDirection.TRADE_DIRECTION_SELL: "Sell"}
+
+
+class CandleBuilder:
+    """Aggregates streamed trades into candles; a candle is emitted when the first trade of the next one arrives."""
+
+    def __init__(self, figi: str, period: timedelta):
+        self.figi = figi
+        self.period = period.total_seconds()
+        self.start: float | None = None
+        self.bar: list | None = None
+
+    def add(self, time: datetime, price: float, quantity: int) -> Candle | None:
+        start = time.timestamp() // self.period * self.period
+        closed = None
+        if self.bar is not None and start > self.start:
+            closed = Candle(self.figi, datetime.fromtimestamp(self.start, time.tzinfo), *self.bar)
+            self.bar = None
+        if self.bar is None:
+            self.start, self.bar = start, [price, price, price, price, 0]
+        bar = self.bar
+        bar[1], bar[2], bar[3], bar[4] = max(bar[1], price), min(bar[2], price), price, bar[4] + quantity
+        return closed
+
+
+class LiveGateway:
+    """Sends the robot's orders through the pre-trade check to the broker and books fills from the order tracker."""
+
+    def __init__(self, robot_id: str, client_pool, token: str, account_id: str, pre_trade: PreTradeCheck,
+                 trackers: OrderTrackers):
+        self.robot_id = robot_id
+        self.client_pool = client_pool
+        self.token = token
+        self.account_id = account_id
+        self.pre_trade = pre_trade
+        self.trackers = trackers
+        self.trades = 0
+        self.errors: deque = deque(maxlen=20)
+        # broker order id -> [sign, lots, lots executed so far]
+        self.orders: Dict[str, list] = dict()
+        self._sequence = itertools.count()
+
+    async def submit(self, order: OrderIntent, context: Context):
+        async with self.client_pool.lease(self.token) as client:
+            await self._submit(client, order, context)
+
+    async def _submit(self, client, order: OrderIntent, context: Context):
+        price, errors = await self.pre_trade.check(client, order.figi, order.lots, order.price, order.direction,
+                                                   order.order_type)
+        if errors:
+            self.errors.append(f"{order.direction} {order.lots}: {'; '.join(errors)}")
+            return
+        # a restarted robot numbers its orders afresh, so ids only need to be unique within this run
+        order_id = str(uuid.uuid5(ROBOT_ORDER_NAMESPACE, f"{self.robot_id}|{next(self._sequence)}"))
+        try:
+            response = await client.orders.post_order(figi=order.figi, quantity=order.lots, price=price,
+                                                      direction=DIRECTIONS[order.direction],
+                                                      account_id=self.account_id,
+                                                      order_type=ORDER_TYPES[order.order_type], order_id=order_id)
+        except Exception as error:
+            logger.warning("Robot %s could not place an order: %s", self.robot_id, error)
+            self.errors.append(f"{order.direction} {order.lots}: {error}")
+            return
+        sign = 1 if order.direction == "Buy" else -1
+        self.orders[response.order_id] = [sign, order.lots, 0]
+        context.working += sign * order.lots
+        (await self.trackers.acquire(self.token, self.account_id)).watch(response.order_id)
+
+    def on_candle(self, candle: Candle, context: Context):
+        pass
+
+    def on_order(self, update: OrderUpdate, context: Context):
+        state = update.order.state
+        entry = self.orders.get(state.order_id)
+        if entry is None:
+            return
+        sign, lots, executed = entry
+        if state.lots_executed > executed:
+            filled = state.lots_executed - executed
+            context.position += sign * filled
+            context.working -= sign * filled
+            entry[2] = state.lots_executed
+            self.trades += 1
+        if state.execution_report_status in TERMINAL_STATUSES:
+            context.working -= sign * (lots - entry[2])
+            del self.orders[state.order_id]
+
+
+class Robot:
+    """One strategy on one instrument, fed by the market data hub (and, when live, the order tracker).
+
+    Robots live in the worker process that started them.
+    """
+
+    def __init__(self, robot_id: str, strategy: Strategy, token: str, account_id: str, gateway, dry_run: bool,
+                 candle_period: timedelta):
+        self.id = robot_id
+        self.strategy = strategy
+        self.token = token
+        self.account_id = account_id
+        self.dry_run = dry_run
+        self.gateway = gateway
+        self.engine = Engine(strategy, gateway)
+        self.candles = CandleBuilder(strategy.figi, candle_period)
+        self.started_at = datetime.utcnow()
+        self.error: str | None = None
+        self.last_price: float | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, hubs: MarketDataHubs, trackers: OrderTrackers):
+        self.engine.start()
+        self._task = asyncio.create_task(self._run(hubs, trackers))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def _market_events(self, message: dict, hub) -> List:
+        figi = self.strategy.figi
+        if message["type"] == "orderbook":
+            return [BookUpdate(figi, message["time"], hub.get(figi).book)]
+        if message["type"] == "trade":
+            self.last_price = message["price"]
+            events = [TradeTick(figi, message["time"], message["price"], message["quantity"],
+                                TRADE_DIRECTIONS.get(message["direction"], "Unspecified"))]
+            candle = self.candles.add(message["time"], message["price"], message["quantity"])
+            return events + [candle] if candle is not None else events
+        return []
+
+    async def _run(self, hubs: MarketDataHubs, trackers: OrderTrackers):
+        events: asyncio.Queue = asyncio.Queue()
+        hub = hubs.acquire(self.token)
+        market = hub.subscribe(self.strategy.figi)
+        tracker = None if self.dry_run else await trackers.acquire(self.token, self.account_id)
+        orders = tracker.subscribe() if tracker is not None else None
+
+        async def pump_market():
+            while True:
+                message = await market.get()
+                if hub.get(self.strategy.figi) is not None:
+                    for event in self._market_events(message, hub):
+                        events.put_nowait(event)
+
+        async def pump_orders():
+            while True:
+                events.put_nowait(OrderUpdate(await orders.get()))
+
+        pumps = [asyncio.create_task(pump_market())]
+        if orders is not None:
+            pumps.append(asyncio.create_task(pump_orders()))
+        try:
+            while True:
+                await self.engine.handle(await events.get())
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.exception("Robot %s stopped on an error", self.id)
+            self.error = repr(error)
+        finally:
+            for pump in pumps:
+                pump.cancel()
+            hub.unsubscribe(self.strategy.figi, market)
+            await hubs.release(self.token)
+            if tracker is not None:
+                tracker.unsubscribe(orders)
+
+    def status(self) -> RobotStatus:
+        context = self.engine.context
+        equity = None
+        if isinstance(self.gateway, SimulatedGateway) and self.last_price is not None:
+            equity = self.gateway.equity(self.last_price, context)
+        return RobotStatus(id=self.id, strategy=self.strategy.name, figi=self.strategy.figi, lots=self.strategy.lots,
+                           params=self.strategy.params, dry_run=self.dry_run, running=self.running,
+                           started_at=self.started_at, events=self.engine.events, position=context.position,
+                           working=context.working, trades=self.gateway.trades, paper_pnl=equity,
+                           errors=list(getattr(self.gateway, "errors", ())) + ([self.error] if self.error else []))
+
+
+class RobotManager:
+    def __init__(self, hubs: MarketDataHubs, trackers: OrderTrackers, client_pool, pre_trade: PreTradeCheck):
+        self.hubs = hubs
+        self.trackers = trackers
+        self.client_pool = client_pool
+        self.pre_trade = pre_trade
+        self.robots: Dict[str, Robot] = dict()
+
+    def start(self, strategy: Strategy, token: str, account_id: str, dry_run: bool, candle_period: timedelta,
+              lot: int = 1, commission: float = 0.0) -> Robot:
+        robot_id = uuid.uuid4().hex[:12]
+        if dry_run:
+            gateway = SimulatedGateway(lot, commission)
+        else:
+            gateway = LiveGateway(robot_id, self.client_pool, token, account_id, self.pre_trade, self.trackers)
+        robot = self.robots[robot_id] = Robot(robot_id, strategy, token, account_id, gateway, dry_run, candle_period)
+        robot.start(self.hubs, self.trackers)
+        return robot
+
+    def find(self, robot_id: str, token: str | None) -> Robot | None:
+        robot = self.robots.get(robot_id)
+        # robots are only visible to the token that started them
+        return robot if robot is not None and robot.token == token else None
+
+    def owned_by(self, token: str | None) -> List[Robot]:
+        return [robot for robot in self.robots.values() if robot.token == token]
+
+    async def remove(self, robot_id: str):
+        robot = self.robots.pop(robot_id, None)
+        if robot is not None:
+            await robot.stop()
+
+    async def close(self):
+        for robot in self.robots.values():
+            await robot.stop()
+        self.robots.clear()
@@ -0,0 +1,71 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class StrategyInfo(BaseModel):
+    name: str
+    description: str
+    defaults: dict
+    vectorized: bool
+
+
+class RobotStart(BaseModel):
+    strategy: str
+    figi: str
+    lots: int = 1
+    params: dict = {}
+    # paper trading on streamed data until explicitly switched off
+    dry_run: bool = True
+    candle_interval: str = "1min"
+    commission: float = 0.0
+
+
+class RobotStatus(BaseModel):
+    id: str
+    strategy: str
+    figi: str
+    lots: int
+    params: dict
+    dry_run: bool
+    running: bool
+    started_at: datetime
+    events: int
+    position: int
+    working: int
+    trades: int
+    paper_pnl: Optional[float] = None
+    errors: List[str]
+
+
+class BacktestRequest(BaseModel):
+    strategy: str
+    figi: str
+    start: datetime
+    end: Optional[datetime] = None
+    interval: str = "1min"
+    lots: int = 1
+    params: dict = {}
+    mode: str = "auto"
+    commission: float = 0.0
+    capital: float = 100_000.0
+    # lot size of the instrument; taken from the instrument catalog when omitted
+    lot: Optional[int] = None
+
+
+class BacktestResult(BaseModel):
+    strategy: str
+    figi: str
+    mode: str
+    bars: int
+    trades: int
+    pnl: float
+    return_: float = Field(alias="return")
+    max_drawdown: float
+    sharpe: Optional[float] = None
+    equity: List[float]
+    elapsed: float
+
+    class Config:
+        allow_population_by_field_name = True
@@ -0,0 +1,87 @@
+from collections import deque
+from typing import Dict
+
+import numpy as np
+
+from robot.engine import BookUpdate, Candle, Context
+
+
+class Strategy:
+    """Base class: react to events in ``on_event``; strategies that only need closing prices can also implement
+    ``signals`` so backtests run vectorized instead of bar by bar."""
+
+    name = ""
+    defaults: dict = dict()
+
+    def __init__(self, figi: str, lots: int = 1, **params):
+        unknown = set(params) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"Unknown parameters for {self.name}: {', '.join(sorted(unknown))}")
+        self.figi = figi
+        self.lots = lots
+        self.params = {**self.defaults, **params}
+
+    def on_start(self, context: Context):
+        pass
+
+    def on_event(self, event, context: Context):
+        pass
+
+    def signals(self, bars: Dict[str, np.ndarray]) -> np.ndarray | None:
+        """Target position in lots after each bar's close, or None if the strategy needs the event loop."""
+        return None
+
+
+def _sma(values: np.ndarray, window: int) -> np.ndarray:
+    # NaN until a full window is available, matching the event-driven version
+    sums = np.cumsum(np.insert(values, 0, 0.0))
+    means = np.full(len(values), np.nan)
+    if len(values) >= window:
+        means[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return means
+
+
+class SmaCross(Strategy):
+    """Long while the fast moving average of closes is above the slow one, flat otherwise."""
+
+    name = "sma_cross"
+    defaults = {"fast": 20, "slow": 50}
+
+    def on_start(self, context: Context):
+        self._closes = deque(maxlen=self.params["slow"])
+
+    def on_event(self, event, context: Context):
+        if not isinstance(event, Candle):
+            return
+        self._closes.append(event.close)
+        if len(self._closes) < self.params["slow"]:
+            return
+        closes = list(self._closes)
+        fast = sum(closes[-self.params["fast"]:]) / self.params["fast"]
+        slow = sum(closes) / self.params["slow"]
+        context.target(self.lots if fast > slow else 0)
+
+    def signals(self, bars: Dict[str, np.ndarray]) -> np.ndarray:
+        fast, slow = _sma(bars["close"], self.params["fast"]), _sma(bars["close"], self.params["slow"])
+        return np.where(fast > slow, self.lots, 0)
+
+
+class BookImbalance(Strategy):
+    """Buys when resting bids outweigh asks over the top levels and exits when the book turns."""
+
+    name = "book_imbalance"
+    defaults = {"levels": 5, "enter": 0.3, "exit": -0.1}
+
+    def on_event(self, event, context: Context):
+        if not isinstance(event, BookUpdate):
+            return
+        imbalance = event.book.imbalance(self.params["levels"])
+        if imbalance is None:
+            return
+        if imbalance >= self.params["enter"]:
+            context.target(self.lots)
+        elif imbalance <= self.params["exit"]:
+            context.target(0)
+
+
+STRATEGIES = {strategy.name: strategy for strategy in (SmaCross, BookImbalance)}
@@ -0,0 +1,28 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# configuration is read when modules are imported, so the test database is set up first
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/tests.db")
+os.environ.setdefault("WARMUP_TOKENS", "")
+
+
+@pytest.fixture
+def database():
+    from common.database import engine, init_db, metadata
+
+    async def create():
+        await init_db()
+        # pooled connections belong to the event loop that opened them
+        await engine.dispose()
+
+    async def drop():
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.drop_all)
+        await engine.dispose()
+
+    asyncio.run(create())
+    yield engine
+    asyncio.run(drop())
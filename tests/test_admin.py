@@ -0,0 +1,29 @@
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from common import config
+from common.dependencies import require_admin
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+
+    @app.get("/stats", dependencies=[Depends(require_admin)])
+    def stats():
+        return {"tokens": 1}
+
+    return TestClient(app)
+
+
+def test_admin_endpoints_are_off_without_an_admin_token(client, monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", None)
+    assert client.get("/stats", headers={"admin-token": ""}).status_code == 404
+
+
+@pytest.mark.parametrize("headers, status", [({}, 403), ({"admin-token": "wrong"}, 403), ({"token": "secret"}, 403),
+                                             ({"admin-token": "secret"}, 200)])
+def test_admin_endpoints_need_the_admin_token(client, monkeypatch, headers, status):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    assert client.get("/stats", headers=headers).status_code == status
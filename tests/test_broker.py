@@ -0,0 +1,225 @@
+import asyncio
+import time
+
+import grpc
+import pytest
+
+from common.broker import BrokerClient, coalesced
+from common.call_policy import BrokerUnavailable, CircuitBreaker, breaker_for, breakers
+
+
+class CountingInstruments:
+    """Answers once ``release`` is set, counting the calls that reached it."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def share_by(self, **kwargs):
+        self.calls += 1
+        await self.release.wait()
+        return f"share {kwargs['id']}"
+
+
+class CountingOrders:
+    def __init__(self):
+        self.calls = 0
+
+    async def post_order(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return "posted"
+
+
+class CountingServices:
+    def __init__(self):
+        self.instruments = CountingInstruments()
+        self.orders = CountingOrders()
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers():
+    breakers.clear()
+    yield
+    breakers.clear()
+
+
+def test_identical_reads_share_one_call():
+    async def scenario():
+        services = CountingServices()
+        client = BrokerClient(services, "token")
+        before = coalesced["InstrumentsService/ShareBy"]
+        calls = [asyncio.create_task(client.instruments.share_by(id_type=1, id="FIGI")) for _ in range(10)]
+        await asyncio.sleep(0)
+        services.instruments.release.set()
+        results = await asyncio.gather(*calls)
+        return services.instruments.calls, results, coalesced["InstrumentsService/ShareBy"] - before
+
+    calls, results, shared = asyncio.run(scenario())
+    assert calls == 1 and shared == 9
+    assert results == ["share FIGI"] * 10
+
+
+def test_different_arguments_are_separate_calls():
+    async def scenario():
+        services = CountingServices()
+        client = BrokerClient(services, "token")
+        calls = [asyncio.create_task(client.instruments.share_by(id_type=1, id=figi)) for figi in ("A", "B", "A")]
+        await asyncio.sleep(0)
+        services.instruments.release.set()
+        results = await asyncio.gather(*calls)
+        return services.instruments.calls, results
+
+    calls, results = asyncio.run(scenario())
+    assert calls == 2 and results == ["share A", "share B", "share A"]
+
+
+def test_finished_calls_are_not_reused():
+    async def scenario():
+        services = CountingServices()
+        services.instruments.release.set()
+        client = BrokerClient(services, "token")
+        await client.instruments.share_by(id_type=1, id="FIGI")
+        await client.instruments.share_by(id_type=1, id="FIGI")
+        return services.instruments.calls, client._in_flight
+
+    calls, in_flight = asyncio.run(scenario())
+    assert calls == 2 and not in_flight
+
+
+def test_orders_are_never_shared():
+    async def scenario():
+        services = CountingServices()
+        client = BrokerClient(services, "token")
+        await asyncio.gather(*(client.orders.post_order(figi="FIGI", quantity=1, order_id="1") for _ in range(3)))
+        return services.orders.calls
+
+    assert asyncio.run(scenario()) == 3
+
+
+def test_cancelled_leader_does_not_cancel_the_shared_call():
+    async def scenario():
+        services = CountingServices()
+        client = BrokerClient(services, "token")
+        leader = asyncio.create_task(client.instruments.share_by(id_type=1, id="FIGI"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(client.instruments.share_by(id_type=1, id="FIGI"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        services.instruments.release.set()
+        result = await follower
+        return leader.cancelled(), result, services.instruments.calls
+
+    leader_cancelled, result, calls = asyncio.run(scenario())
+    assert leader_cancelled and result == "share FIGI" and calls == 1
+
+
+def test_call_finishes_when_every_caller_is_gone():
+    async def scenario():
+        services = CountingServices()
+        client = BrokerClient(services, "token")
+        caller = asyncio.create_task(client.instruments.share_by(id_type=1, id="FIGI"))
+        await asyncio.sleep(0)
+        caller.cancel()
+        services.instruments.release.set()
+        await asyncio.sleep(0.01)
+        # the response still lands in the stale cache and the in-flight entry is cleared
+        return client._in_flight, [value for _, value in client._stale._entries.values()]
+
+    in_flight, stale = asyncio.run(scenario())
+    assert not in_flight and stale == ["share FIGI"]
+
+
+def test_failures_reach_every_waiter():
+    class Failing(CountingInstruments):
+        async def share_by(self, **kwargs):
+            self.calls += 1
+            await self.release.wait()
+            raise ValueError("no such instrument")
+
+    async def scenario():
+        services = CountingServices()
+        services.instruments = Failing()
+        client = BrokerClient(services, "token")
+        calls = [asyncio.create_task(client.instruments.share_by(id_type=1, id="FIGI")) for _ in range(3)]
+        await asyncio.sleep(0)
+        services.instruments.release.set()
+        return services.instruments, await asyncio.gather(*calls, return_exceptions=True)
+
+    instruments, results = asyncio.run(scenario())
+    assert instruments.calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+class BrokerError(Exception):
+    def __init__(self, code: grpc.StatusCode):
+        super().__init__(code.name)
+        self.code = code
+
+
+def test_breaker_opens_after_repeated_failures_and_probes_once():
+    breaker = CircuitBreaker("Service/Method", threshold=2, reset_timeout=0.05)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.on_failure(BrokerError(grpc.StatusCode.UNAVAILABLE))
+    assert breaker.state == "open"
+    with pytest.raises(BrokerUnavailable):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    breaker.before_call()
+    # only the probe goes through while it runs
+    with pytest.raises(BrokerUnavailable) as rejected:
+        breaker.before_call()
+    assert rejected.value.retry_after >= 0
+    breaker.on_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker("Service/Method", threshold=1, reset_timeout=0.05)
+    breaker.before_call()
+    breaker.on_failure(BrokerError(grpc.StatusCode.INTERNAL))
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.on_failure(BrokerError(grpc.StatusCode.INTERNAL))
+    assert breaker.state == "open"
+
+
+def test_client_errors_do_not_open_the_breaker():
+    breaker = CircuitBreaker("Service/Method", threshold=1)
+    breaker.before_call()
+    breaker.on_failure(BrokerError(grpc.StatusCode.INVALID_ARGUMENT))
+    assert breaker.state == "closed"
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    class HangingOrders:
+        def __init__(self):
+            self.calls = 0
+
+        async def cancel_order(self, **kwargs):
+            self.calls += 1
+            await asyncio.sleep(10)
+
+    async def scenario():
+        services = CountingServices()
+        services.orders = HangingOrders()
+        client = BrokerClient(services, "token")
+        breaker = breaker_for("OrdersService/CancelOrder")
+        breaker.reset_timeout = 0.0
+        breaker.opened_at = time.monotonic()
+        probe = asyncio.create_task(client.orders.cancel_order(account_id="1", order_id="1"))
+        await asyncio.sleep(0)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        # without the reset every later call would be refused as if the probe were still running
+        next_probe = asyncio.create_task(client.orders.cancel_order(account_id="1", order_id="1"))
+        await asyncio.sleep(0)
+        next_probe.cancel()
+        await asyncio.gather(next_probe, return_exceptions=True)
+        return services.orders.calls
+
+    assert asyncio.run(scenario()) == 2
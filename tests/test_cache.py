@@ -0,0 +1,72 @@
+import fakeredis.aioredis
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from fastapi_cache import FastAPICache
+from starlette.requests import Request
+
+from common.cache import cached, init_cache, scoped_key_builder
+
+
+def make_request(headers: dict, query: str = "") -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": query.encode(),
+                    "headers": [(name.encode(), value.encode()) for name, value in headers.items()]})
+
+
+def accounts():
+    pass
+
+
+def test_key_depends_on_token_and_account():
+    key = scoped_key_builder(accounts, "accounts", request=make_request({"token": "a", "account-id": "1"}))
+    assert key == scoped_key_builder(accounts, "accounts", request=make_request({"token": "a", "account-id": "1"}))
+    assert key != scoped_key_builder(accounts, "accounts", request=make_request({"token": "b", "account-id": "1"}))
+    assert key != scoped_key_builder(accounts, "accounts", request=make_request({"token": "a", "account-id": "2"}))
+    assert key != scoped_key_builder(accounts, "accounts", request=make_request({"token": "a"}))
+
+
+def test_key_hashes_the_token():
+    key = scoped_key_builder(accounts, "accounts", request=make_request({"token": "secret-token"}))
+    assert "secret-token" not in key
+
+
+def test_key_depends_on_query():
+    headers = {"token": "a"}
+    assert scoped_key_builder(accounts, "accounts", request=make_request(headers, "figi=X")) != \
+        scoped_key_builder(accounts, "accounts", request=make_request(headers, "figi=Y"))
+
+
+@pytest.fixture(params=["memory", "redis"])
+def app(request):
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.on_event("startup")
+    async def startup():
+        # the redis client belongs to the event loop the test client runs the app on
+        redis = fakeredis.aioredis.FakeRedis() if request.param == "redis" else None
+        app.state.cache_backend = await init_cache(redis)
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        # FastAPICache is initialised once per process and the in-memory store is shared between backends
+        await FastAPICache.clear(namespace="accounts")
+        FastAPICache.reset()
+
+    @app.get("/accounts")
+    @cached("accounts")
+    async def get_accounts():
+        app.state.calls += 1
+        return {"calls": app.state.calls}
+
+    return app
+
+
+def test_entries_are_not_shared_between_tokens_and_accounts(app):
+    with TestClient(app) as client:
+        first = client.get("/accounts", headers={"token": "a", "account-id": "1"}).json()
+        assert client.get("/accounts", headers={"token": "a", "account-id": "1"}).json() == first
+        assert client.get("/accounts", headers={"token": "b", "account-id": "1"}).json() != first
+        assert client.get("/accounts", headers={"token": "a", "account-id": "2"}).json() != first
+        assert app.state.calls == 3
+        assert app.state.cache_backend.stats() == {"accounts": {"hits": 1, "misses": 3}}
@@ -0,0 +1,38 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from bench.stub_broker import StubServices
+from common import config
+from common.database import engine
+from market_data.candles import CandleStore, missing_ranges
+
+
+def test_missing_ranges():
+    day = datetime(2023, 1, 1)
+    covered = [(day, day + timedelta(hours=2)), (day + timedelta(hours=3), day + timedelta(hours=4))]
+    assert missing_ranges(covered, day + timedelta(hours=1), day + timedelta(hours=5)) == [
+        (day + timedelta(hours=2), day + timedelta(hours=3)), (day + timedelta(hours=4), day + timedelta(hours=5))]
+
+
+def test_long_range_is_served_and_stored_once(database):
+    client = StubServices(latency=0)
+    # ends before the still-forming candle, which would be fetched again
+    end = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+    # more GetCandles windows than one backfill batch
+    start = end - timedelta(weeks=config.CANDLES_MAX_WINDOWS + 10)
+
+    async def scenario():
+        try:
+            store = CandleStore()
+            first = await store.get(client, "FIGI", "hour", start, end)
+            calls = client.market_data.calls
+            second = await store.get(client, "FIGI", "hour", start, end)
+            return first, second, calls
+        finally:
+            await engine.dispose()
+
+    first, second, calls = asyncio.run(scenario())
+    assert len(first["time"]) == (end - start) // timedelta(hours=1)
+    assert calls == config.CANDLES_MAX_WINDOWS + 10
+    # the second request is answered from the store
+    assert second == first and client.market_data.calls == calls
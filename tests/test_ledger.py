@@ -0,0 +1,140 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from bench.stub_broker import StubClientPool, StubServices
+from common.database import engine
+from operations.ledger import OperationsLedger
+from operations.router import router
+
+OWN_ACCOUNT = "2000000000"
+
+
+def run(coroutine):
+    async def scenario():
+        try:
+            return await coroutine
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(scenario())
+
+
+def test_sync_is_idempotent(database):
+    ledger, client = OperationsLedger(), StubServices(latency=0)
+
+    async def scenario():
+        first = await ledger.sync(client, OWN_ACCOUNT)
+        second = await ledger.sync(client, OWN_ACCOUNT)
+        return first, second, await ledger.status(OWN_ACCOUNT), await ledger.operations(OWN_ACCOUNT, limit=10)
+
+    first, second, status, operations = run(scenario())
+    assert first == second == 5000
+    assert status.operations == 5000 and status.synced_to is not None
+    assert all(operation.type.startswith("OPERATION_TYPE_") for operation in operations)
+
+
+def test_rows_are_kept_per_account(database):
+    ledger, client = OperationsLedger(), StubServices(latency=0)
+
+    async def scenario():
+        await ledger.sync(client, OWN_ACCOUNT)
+        return await ledger.status("2000000001")
+
+    assert run(scenario()).operations == 0
+
+
+def test_ownership_is_checked_against_the_token_accounts():
+    ledger, client = OperationsLedger(), StubServices(latency=0)
+    calls = 0
+    get_accounts = client.users.get_accounts
+
+    async def counting_get_accounts(**kwargs):
+        nonlocal calls
+        calls += 1
+        return await get_accounts(**kwargs)
+
+    client.users.get_accounts = counting_get_accounts
+
+    async def scenario():
+        return [await ledger.is_owner(client, "token", OWN_ACCOUNT),
+                await ledger.is_owner(client, "token", "2000000001"),
+                await ledger.is_owner(client, "token", "someone-else"),
+                await ledger.is_owner(client, "other-token", OWN_ACCOUNT)]
+
+    assert asyncio.run(scenario()) == [True, True, False, True]
+    # one lookup per token while the answer is fresh, and again for an unknown account
+    assert calls == 3
+
+
+def test_background_sync_holds_its_own_lease(database):
+    leases = list()
+
+    class CountingPool(StubClientPool):
+        @asynccontextmanager
+        async def lease(self, token: str):
+            leases.append(token)
+            async with super().lease(token) as client:
+                yield client
+            leases.remove(token)
+
+    client, ledger = StubServices(latency=0), OperationsLedger()
+    get_operations = client.operations.get_operations_by_cursor
+
+    async def leased_get_operations(request):
+        # the request that started the sync has long returned its client
+        assert leases == ["token"]
+        return await get_operations(request)
+
+    client.operations.get_operations_by_cursor = leased_get_operations
+
+    async def scenario():
+        assert ledger.sync_in_background(CountingPool(client), "token", OWN_ACCOUNT)
+        await ledger._tasks[OWN_ACCOUNT]
+        return await ledger.status(OWN_ACCOUNT)
+
+    assert run(scenario()).operations == 5000
+    assert leases == []
+
+
+def make_app(client) -> FastAPI:
+    app = FastAPI()
+    app.include_router(router)
+    app.state.operations_ledger = OperationsLedger()
+    app.state.client_pool = StubClientPool(client)
+    return app
+
+
+def test_ledger_endpoints_serve_only_the_token_accounts(database):
+    client = StubServices(latency=0)
+    with TestClient(make_app(client)) as http:
+        for path in ("/operation_market/ledger/status", "/operation_market/ledger/operations",
+                     "/operation_market/ledger/turnover", "/operation_market/ledger/commissions",
+                     "/operation_market/analytics"):
+            response = http.get(path, headers={"token": "token", "account-id": "someone-else"})
+            assert response.status_code == 403, path
+        assert http.get("/operation_market/ledger/status",
+                        headers={"token": "token", "account-id": OWN_ACCOUNT}).status_code == 200
+        assert http.get("/operation_market/ledger/status", headers={"account-id": OWN_ACCOUNT}).status_code == 401
+    run(engine.dispose())
+
+
+def test_operations_report_the_same_type_from_broker_and_ledger(database):
+    client = StubServices(latency=0)
+    headers = {"token": "token", "account-id": OWN_ACCOUNT}
+    with TestClient(make_app(client)) as http:
+        # the first request starts the ledger sync and is answered by the broker
+        from_broker = {item["id"]: item["type"] for item in http.get("/operation_market/operations",
+                                                                      headers=headers).json()}
+        deadline = time.monotonic() + 10
+        while http.get("/operation_market/ledger/status", headers=headers).json()["synced_to"] is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        from_ledger = {item["id"]: item["type"] for item in http.get("/operation_market/operations",
+                                                                      headers=headers).json()}
+    run(engine.dispose())
+    assert from_ledger and from_broker.keys() >= from_ledger.keys()
+    assert all(from_ledger[key] == from_broker[key] for key in from_ledger)
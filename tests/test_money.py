@@ -0,0 +1,64 @@
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from tinkoff.invest import MoneyValue, Quotation
+
+from common.money import Money, MoneyArray
+
+
+def test_exact_arithmetic():
+    assert Money(0.1) + Money(0.2) == Money(Decimal("0.3"))
+    assert Money(-1, -500_000_000).to_decimal() == Decimal("-1.5")
+    assert sum([Money(1), Money(2), Money(3)]) == Money(6)
+    assert Money(10) / 3 == Money.from_nano(3_333_333_333)
+
+
+def test_conversions():
+    money = Money(MoneyValue("rub", 12, 340_000_000))
+    assert money.currency == "rub"
+    assert (money.units, money.nano) == (12, 340_000_000)
+    value = money.to_money_value()
+    assert (value.currency, value.units, value.nano) == ("rub", 12, 340_000_000)
+    assert Money(Quotation(-3, -250_000_000)).to_float() == -3.25
+
+
+def test_untagged_amounts_take_the_other_currency():
+    assert (Money(1, currency="rub") + Money(2)).currency == "rub"
+    assert (Money(2) - Money(1, currency="usd")).currency == "usd"
+    assert Money.sum([Money(1), MoneyValue("rub", 1, 0), Quotation(1, 0)]) == Money(3, currency="rub")
+
+
+@pytest.mark.parametrize("combine", [
+    lambda a, b: a + b,
+    lambda a, b: a - b,
+    lambda a, b: a < b,
+    lambda a, b: a / b,
+    lambda a, b: Money.sum([a, b]),
+    lambda a, b: Money.sum([a.to_money_value(), b.to_money_value()]),
+    lambda a, b: MoneyArray.from_money([a]) + MoneyArray.from_money([b]),
+    lambda a, b: MoneyArray.from_money([a]) - MoneyArray.from_money([b]),
+    lambda a, b: MoneyArray.from_money([a, b]),
+    lambda a, b: MoneyArray.from_values([a.to_money_value(), b.to_money_value()]),
+])
+def test_different_currencies_never_mix(combine):
+    with pytest.raises(ValueError):
+        combine(Money(1, currency="rub"), Money(1, currency="usd"))
+
+
+def test_equality_is_exact_and_consistent_with_hash():
+    untagged, rub, usd = Money(5), Money(5, currency="rub"), Money(5, currency="usd")
+    assert untagged != rub and rub != usd and untagged != usd
+    assert untagged == 5 and rub != 5
+    assert hash(untagged) == hash(5)
+    assert len({untagged, rub, usd, Money(5, currency="rub")}) == 3
+    assert len({Money(0.5), Money(Decimal("0.5"))}) == 1
+
+
+def test_money_array_sums():
+    values = [MoneyValue("rub", i, 500_000_000) for i in range(5)]
+    array = MoneyArray.from_values(values)
+    assert array.currency == "rub"
+    assert array.sum() == Money(12, 500_000_000, currency="rub")
+    assert np.array_equal(array.cumsum().to_float(), np.cumsum([0.5, 1.5, 2.5, 3.5, 4.5]))
+    assert (array * 2).sum() == Money(25, currency="rub")
@@ -0,0 +1,80 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from instruments.catalog import TradingRules
+from instruments.schedules import _sessions, is_open
+from orders.pre_trade import PreTradeCheck, round_price
+
+DAY = datetime(2023, 6, 5, tzinfo=timezone.utc)
+UNSET = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def at(hour: float) -> datetime:
+    return DAY + timedelta(hours=hour)
+
+
+def trading_day(**fields):
+    times = {name: UNSET for name in ("start_time", "end_time", "evening_start_time", "evening_end_time",
+                                      "premarket_start_time", "premarket_end_time")}
+    return SimpleNamespace(**{"is_trading_day": True, "intervals": [], **times, **fields})
+
+
+def test_main_evening_and_premarket_sessions_are_open():
+    sessions = _sessions([trading_day(premarket_start_time=at(4), premarket_end_time=at(7),
+                                      start_time=at(7), end_time=at(15.75),
+                                      evening_start_time=at(16), evening_end_time=at(20.83))])
+    assert all(is_open(sessions, at(hour)) for hour in (4.5, 10, 18))
+    assert not is_open(sessions, at(15.9)) and not is_open(sessions, at(22))
+
+
+def test_typed_intervals_count_as_open_whatever_their_type():
+    weekend = SimpleNamespace(type="weekend", interval=SimpleNamespace(start_ts=at(7), end_ts=at(16)))
+    unknown = SimpleNamespace(type="something_new", interval=SimpleNamespace(start_ts=at(17), end_ts=at(18)))
+    sessions = _sessions([trading_day(is_trading_day=False, intervals=[weekend, unknown])])
+    assert is_open(sessions, at(8)) and is_open(sessions, at(17.5))
+    assert not is_open(sessions, at(16.5))
+
+
+def test_unset_times_are_ignored():
+    assert _sessions([trading_day()]) == []
+
+
+@pytest.mark.parametrize("nano, direction, expected", [(105, "Buy", 100), (105, "Sell", 110), (100, "Buy", 100),
+                                                       (5, "Buy", 0)])
+def test_round_price_never_worsens_the_order(nano, direction, expected):
+    assert round_price(nano, 10, direction) == expected
+
+
+class Catalog:
+    async def ensure_loaded(self, client):
+        return True
+
+    def rules(self, figi):
+        return TradingRules(figi=figi, exchange="MOEX", lot=1, min_price_increment=10_000_000, buy_available=True,
+                            sell_available=True, api_trade_available=True)
+
+
+class Schedules:
+    async def sessions(self, client, exchange):
+        return [(at(0), at(24))]
+
+
+def check(price: float, direction: str):
+    pre_trade = PreTradeCheck(Catalog(), Schedules(), round_prices=True)
+    return asyncio.run(pre_trade.check(None, "FIGI", 1, price, direction, "Limit", now=at(12)))
+
+
+def test_prices_are_rounded_to_the_step():
+    quotation, errors = check(100.005, "Buy")
+    assert not errors and (quotation.units, quotation.nano) == (100, 0)
+
+
+def test_buy_below_one_step_is_rejected():
+    _, errors = check(0.005, "Buy")
+    assert errors and "below the price step" in errors[0]
+    # a sell rounds up to one step and goes through
+    quotation, errors = check(0.005, "Sell")
+    assert not errors and (quotation.units, quotation.nano) == (0, 10_000_000)
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+
+from bench.stub_broker import StubServices
+from common import config
+from common.broker import BrokerClient
+from common.rate_limit import DEFAULT_GROUP, PRIORITY_DEFAULT, PRIORITY_ORDERS, RateLimiter, TokenBucket, shape
+
+
+def test_shape_splits_the_limit_between_burst_and_refill():
+    capacity, rate = shape(100, 60.0, 0.2)
+    assert capacity == 20
+    # the burst plus a full window of refill never exceeds the limit
+    assert capacity + rate * 60.0 == 100
+
+
+def test_bucket_paces_calls_to_the_limit():
+    async def scenario():
+        bucket = TokenBucket(10, period=0.5, burst=0.2)
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(10)))
+        return time.monotonic() - started, bucket
+
+    elapsed, bucket = asyncio.run(scenario())
+    # 2 calls from the burst, the other 8 at 16 per second
+    assert 0.4 < elapsed < 0.8
+    assert bucket.waited == 8 and bucket.queue_depth == 0
+
+
+def test_orders_are_served_before_queued_reads():
+    async def scenario():
+        bucket = TokenBucket(10, period=0.5, burst=0.1)
+        order = list()
+
+        async def call(name: str, priority: int):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        await bucket.acquire()
+        reads = [asyncio.create_task(call(f"read-{i}", PRIORITY_DEFAULT)) for i in range(3)]
+        await asyncio.sleep(0)
+        await asyncio.gather(call("order", PRIORITY_ORDERS), *reads)
+        return order
+
+    assert asyncio.run(scenario())[0] == "order"
+
+
+def test_limits_are_seeded_from_the_tariff_on_the_first_call():
+    async def scenario():
+        limiter = RateLimiter()
+        client = BrokerClient(StubServices(latency=0, limit_per_minute=50), "token", limiter)
+        await client.instruments.shares()
+        return limiter.limits("token")
+
+    limits = asyncio.run(scenario())
+    assert limits.seeded
+    group, bucket = limits.bucket("InstrumentsService/Shares")
+    assert group != DEFAULT_GROUP and bucket.limit == 50 and bucket.acquired == 1
+    assert limits.stream_limits[limits.stream_groups["MarketDataStreamService/MarketDataStream"]] == 2
+
+
+class FailingUsers:
+    def __init__(self):
+        self.calls = 0
+
+    async def get_user_tariff(self):
+        self.calls += 1
+        raise ConnectionError("tariff lookup failed")
+
+
+def test_failed_seed_backs_off_and_warns_once(monkeypatch, caplog):
+    monkeypatch.setattr(config, "RATE_LIMIT_SEED_RETRY", 0.05)
+    monkeypatch.setattr(config, "RATE_LIMIT_SEED_RETRY_MAX", 0.1)
+    users = FailingUsers()
+
+    async def scenario():
+        limiter = RateLimiter()
+        await asyncio.gather(*(limiter.seed("token", users) for _ in range(20)))
+        # still within the retry delay, so nothing is asked
+        await limiter.seed("token", users)
+        calls_before_retry = users.calls
+        await asyncio.sleep(0.06)
+        await limiter.seed("token", users)
+        return limiter.limits("token"), calls_before_retry
+
+    with caplog.at_level(logging.DEBUG, logger="common.rate_limit"):
+        limits, calls_before_retry = asyncio.run(scenario())
+    assert calls_before_retry == 1 and users.calls == 2
+    assert not limits.seeded and limits.seed_failures == 2
+    # the second failure doubles the delay
+    assert limits.seed_retry_at - time.monotonic() > 0.05
+    warnings = [record for record in caplog.records if record.levelno >= logging.WARNING]
+    assert len(warnings) == 1 and warnings[0].exc_info is None
+    # calls keep going through the default bucket meanwhile
+    assert limits.bucket("InstrumentsService/Shares")[0] == DEFAULT_GROUP
@@ -0,0 +1,32 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from robot.backtest import backtest
+from robot.schemas import BacktestResult
+from robot.strategies import SmaCross
+
+
+def columns(bars: int = 500) -> dict:
+    close = 100 + 10 * np.sin(np.linspace(0, 12 * np.pi, bars))
+    start = datetime(2023, 1, 2, 7, tzinfo=timezone.utc)
+    return {"time": [start + timedelta(minutes=i) for i in range(bars)], "open": close.tolist(),
+            "high": (close + 0.5).tolist(), "low": (close - 0.5).tolist(), "close": close.tolist(),
+            "volume": [100] * bars}
+
+
+def test_vectorized_and_event_driven_backtests_agree():
+    data = columns()
+    vectorized = asyncio.run(backtest(SmaCross("FIGI", fast=5, slow=20), data, "vectorized", commission=0.0005))
+    events = asyncio.run(backtest(SmaCross("FIGI", fast=5, slow=20), data, "events", commission=0.0005))
+    assert vectorized["mode"] == "vectorized" and events["mode"] == "events"
+    assert vectorized["trades"] == events["trades"] > 0
+    assert vectorized["pnl"] == pytest.approx(events["pnl"])
+
+
+def test_backtest_result_uses_the_return_alias():
+    result = BacktestResult(strategy="sma_cross", figi="FIGI", **asyncio.run(backtest(SmaCross("FIGI"), columns())))
+    assert result.dict(by_alias=True)["return"] == result.return_
+    assert "return" in BacktestResult.schema()["properties"]
@@ -0,0 +1,49 @@
+import pytest
+from fastapi import FastAPI, WebSocket
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from common import config
+from common.dependencies import accept_websocket
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+
+    @app.websocket("/ws")
+    async def echo(websocket: WebSocket):
+        credentials = await accept_websocket(websocket, with_account=True)
+        if credentials is not None:
+            await websocket.send_json(list(credentials))
+            await websocket.close()
+
+    return TestClient(app)
+
+
+def test_credentials_from_headers(client):
+    with client.websocket_connect("/ws", headers={"token": "t", "account-id": "1"}) as websocket:
+        assert websocket.receive_json() == ["t", "1"]
+
+
+def test_credentials_from_the_first_message(client):
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_json({"token": "t", "account_id": "1"})
+        assert websocket.receive_json() == ["t", "1"]
+
+
+@pytest.mark.parametrize("message", [{"token": "t"}, {"token": 1, "account_id": "1"}, ["t", "1"]])
+def test_incomplete_credentials_close_the_socket(client, message):
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_json(message)
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+    assert closed.value.code == 4401
+
+
+def test_query_string_is_not_read(client, monkeypatch):
+    monkeypatch.setattr(config, "WEBSOCKET_AUTH_TIMEOUT", 0.05)
+    with client.websocket_connect("/ws?token=t&account_id=1") as websocket:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+    assert closed.value.code == 4401